@@ -0,0 +1,117 @@
+"""
+This module implements the asynchronous batch transcription jobs API.
+Clients submit one or more audio files/URLs and receive a job ID immediately; background workers
+transcribe the queued items with the shared models, and results are polled or delivered by webhook.
+"""
+from fastapi import APIRouter, File, UploadFile, Form
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from typing import Any, Dict, List, Optional
+import os
+import shutil
+import uuid
+
+from app.api import transcribe
+from app.models.decoding import DecodingOptionsError
+from app.models.jobs import JobStore, JobWorkers
+from app.utils.audio import READ_BLOCK, decode_audio_file
+from app.utils.timing import RequestTiming
+
+router = APIRouter()
+
+# 由 main.py 注入（未启用时为 None）
+job_store: Optional[JobStore] = None
+job_workers: Optional[JobWorkers] = None
+# 单个上传文件的大小上限（字节），None 表示不限制
+max_upload_bytes: Optional[int] = None
+
+def jobs_disabled_response() -> JSONResponse:
+    return JSONResponse({"error": "Jobs API is disabled."}, status_code=503)
+
+async def execute_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Transcribe one claimed job item with the same pipeline as `/transcribe` (VAD, long-form, batching).
+    """
+    options = item["options"]
+    source = item["source"]
+    timing = RequestTiming(item["model"], "job")
+    timing.activate()
+    with timing.stage("decode"):
+        if source.startswith(("http://", "https://")):
+            arr = await transcribe.audio_fetcher.fetch(source)
+        else:
+            arr = await run_in_threadpool(decode_audio_file, source)
+    vad_opts = transcribe.resolve_vad(options.get("vad"))
+    use_long_form = transcribe.model_manager.use_long_form(arr, options.get("long_form"))
+    _, decoding = transcribe.model_manager.decoding_options(item["model"], options.get("preset"))
+    result = await transcribe.run_transcription(item["model"], arr, options.get("language"), vad_opts, use_long_form,
+                                                **decoding)
+    timing.finish(len(arr) / 16000)
+    return result
+
+def save_upload(upload: UploadFile, path: str) -> int:
+    with open(path, "wb") as f:
+        shutil.copyfileobj(upload.file, f, READ_BLOCK)
+        return f.tell()
+
+@router.post("/jobs", status_code=202)
+async def create_job(
+    audio_files: Optional[List[UploadFile]] = File(None),
+    audio_urls: Optional[List[str]] = Form(None),
+    model: str = Form(...),
+    language: Optional[str] = Form(None),
+    vad: Optional[bool] = Form(None),
+    long_form: Optional[bool] = Form(None),
+    preset: Optional[str] = Form(None),
+    webhook_url: Optional[str] = Form(None),
+):
+    if job_store is None:
+        return jobs_disabled_response()
+    if not audio_files and not audio_urls:
+        return JSONResponse({"error": "No valid audio input provided."}, status_code=400)
+    if not transcribe.model_manager.has_model(model):
+        return JSONResponse({"error": f"Model '{model}' not loaded."}, status_code=404)
+    try:
+        transcribe.model_manager.decoding_options(model, preset)
+    except DecodingOptionsError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    for url in audio_urls or []:
+        if not url.startswith(("http://", "https://")):
+            return JSONResponse({"error": "audio_urls must be http(s) URLs."}, status_code=400)
+    job_id = uuid.uuid4().hex
+    job_dir = job_store.job_dir(job_id)
+    sources = []
+    # 上传文件先落盘，保证服务重启后任务仍可继续
+    if audio_files:
+        os.makedirs(job_dir, exist_ok=True)
+        for i, upload in enumerate(audio_files):
+            path = os.path.join(job_dir, str(i))
+            size = await run_in_threadpool(save_upload, upload, path)
+            if max_upload_bytes and size > max_upload_bytes:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                return JSONResponse({"error": f"File '{upload.filename}' exceeds the maximum upload size."},
+                                    status_code=413)
+            sources.append({"name": upload.filename, "source": path})
+    sources += [{"name": url, "source": url} for url in audio_urls or []]
+    options = {"language": language, "vad": vad, "long_form": long_form, "preset": preset}
+    await run_in_threadpool(job_store.create, job_id, model, options, sources, webhook_url)
+    job_workers.notify()
+    return {"id": job_id, "status": "queued", "items": len(sources)}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, results: bool = True):
+    if job_store is None:
+        return jobs_disabled_response()
+    job = await run_in_threadpool(job_store.get, job_id, results)
+    if job is None:
+        return JSONResponse({"error": f"Job '{job_id}' not found."}, status_code=404)
+    return job
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    if job_store is None:
+        return jobs_disabled_response()
+    status = await job_workers.cancel(job_id)
+    if status is None:
+        return JSONResponse({"error": f"Job '{job_id}' not found."}, status_code=404)
+    return {"id": job_id, "status": status}
@@ -0,0 +1,48 @@
+"""
+This module exposes in-process service metrics in the Prometheus text format (or JSON with ?format=json).
+It reports per-stage latency histograms, real-time factor, batch statistics, cache counters,
+queue depth, admission queues, model memory and open WebSocket sessions.
+"""
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+
+from app.models.manager import ModelManager
+from app.utils import metrics
+from app.utils.admission import AdmissionController
+
+router = APIRouter()
+
+model_manager: Optional[ModelManager] = None
+admission: Optional[AdmissionController] = None
+
+QUEUE_ACTIVE = metrics.Gauge("whisper_queue_active", "Requests currently running inference, per model", ["model"])
+QUEUE_WAITING = metrics.Gauge("whisper_queue_waiting", "Requests waiting for an inference slot, per model", ["model"])
+MODEL_MEMORY = metrics.Gauge("whisper_model_memory_bytes", "Weight memory of loaded models", ["model", "backend"])
+MODEL_LOADED = metrics.Gauge("whisper_model_loaded", "1 if the model is loaded, else 0", ["model"])
+ADMISSION_ACTIVE = metrics.Gauge("whisper_admission_active", "Admitted requests holding a fair-queue slot", ["model"])
+ADMISSION_WAITING = metrics.Gauge("whisper_admission_waiting", "Admitted requests waiting in the fair queue", ["model"])
+
+def update_gauges():
+    # 队列深度与模型内存在抓取时从 ModelManager 读取，保证是最新值
+    if model_manager is None:
+        return
+    for name, queue in model_manager.queues.items():
+        QUEUE_ACTIVE.set(queue.active, model=name)
+        QUEUE_WAITING.set(queue.waiting, model=name)
+    for m in model_manager.list_models():
+        loaded = m["state"] == "loaded"
+        memory = model_manager.memory.get(m["name"], 0) if loaded else 0
+        MODEL_MEMORY.set(memory, model=m["name"], backend=m["backend"])
+        MODEL_LOADED.set(1 if loaded else 0, model=m["name"])
+    if admission is not None:
+        for name, stats in admission.stats().items():
+            ADMISSION_ACTIVE.set(stats["active"], model=name)
+            ADMISSION_WAITING.set(stats["waiting"], model=name)
+
+@router.get("/metrics")
+async def get_metrics(format: str = "prometheus"):
+    update_gauges()
+    if format == "json":
+        return metrics.snapshot()
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -3,80 +3,914 @@ This module implements the transcription API endpoints for both HTTP and WebSock
 It handles audio input in various formats and returns transcription results using the loaded models.
 """
 from fastapi import APIRouter, File, UploadFile, Form, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
-from typing import Optional
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import AsyncIterator, Callable, List, Optional, Tuple
 import numpy as np
+import asyncio
 import base64
+import inspect
+import json
+import time
+import typing
 
-from app.models.manager import ModelManager
-from app.utils.audio import decode_audio_file, decode_audio_base64, decode_audio_ndarray, decode_audio_url
+from app.models.manager import ModelManager, ModelLoadError
+from app.models.decoding import DECODING_OPTIONS, DecodingOptionsError
+from app.models.executor import QueueFullError
+from app.models.language import DETECTION_SAMPLES, LanguageDetectionError
+from app.models.longform import SegmentStitcher
+from app.models.streaming import AudioBacklog, StreamingSession
+from app.utils.admission import AdmissionController, AdmissionError
+from app.utils.cache import ResultCache, cache_key
+from app.utils.vad import apply_vad, remap_timestamps, vad_options
+from app.utils.audio import AudioDecodeError, decode_audio_file, decode_audio_base64, decode_audio_ndarray, decode_pcm_bytes, PCM_DTYPES
+from app.utils.fetch import AudioFetcher, AudioFetchError, decode_stream
+from app.utils.metrics import Counter, Gauge
+from app.utils.subtitles import SUBTITLE_FORMATS, SubtitleWriter
+from app.utils.timing import RequestTiming, timed_stage
 
 router = APIRouter()
 
 # 假设全局有 model_manager 实例
 model_manager: Optional[ModelManager] = None
+# 结果缓存（未启用时为 None）
+result_cache: Optional[ResultCache] = None
+# audio_url 下载器（共享连接池）
+audio_fetcher: Optional[AudioFetcher] = None
+# 按客户端音频秒数预算的准入控制（未启用时为 None）
+admission: Optional[AdmissionController] = None
+# 是否在响应中附带 Server-Timing 头（各阶段耗时）
+server_timing: bool = False
+# 流式会话配置（max_sessions / max_pending_seconds / lag_warning_seconds）
+streaming: dict = {}
+# 当前打开的流式会话数
+stream_sessions = 0
 
-def get_audio_array(audio_file, audio_url, audio_base64, audio_ndarray):
+# stream=true 时等待下一个窗口期间发送进度事件的间隔（秒），同时用作连接保活
+PROGRESS_INTERVAL = 5.0
+
+WEBSOCKET_SESSIONS = Gauge("whisper_websocket_sessions", "Open /transcribe/stream WebSocket sessions")
+STREAM_OVERLOAD = Counter(
+    "whisper_stream_overload_total",
+    "Streaming sessions rejected at the session cap, and chunks coalesced / backpressure and lag notices sent "
+    "because inference fell behind", ["kind"],
+)
+
+def input_type(audio_file, audio_url, audio_base64, audio_ndarray, body_type: Optional[str] = None) -> str:
+    if body_type:
+        return body_type
     if audio_file:
-        return decode_audio_file(audio_file.file)
+        return "file"
     if audio_url:
-        return decode_audio_url(audio_url)
+        return "url"
+    if audio_base64:
+        return "base64"
+    return "ndarray"
+
+def get_audio_array(audio_file, audio_base64, audio_ndarray):
+    if audio_file:
+        return decode_audio_file(audio_file.file)
     if audio_base64:
         return decode_audio_base64(audio_base64)
     if audio_ndarray:
         return decode_audio_ndarray(audio_ndarray)
     return None
 
+def upload_size(audio_file, audio_base64, audio_ndarray) -> Optional[int]:
+    """
+    Encoded size in bytes of the uploaded audio, known before decoding (None for audio_url).
+    """
+    if audio_file:
+        f = audio_file.file
+        pos = f.tell()
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(pos)
+        return size
+    if audio_base64:
+        return len(audio_base64) * 3 // 4
+    return None
+
+def estimate_cost(model: str, audio_file, audio_base64, audio_ndarray) -> Optional[float]:
+    """
+    Audio-seconds cost of a request estimated before decoding, or None if it cannot be estimated.
+    """
+    if audio_ndarray and not (audio_file or audio_base64):
+        seconds = len(audio_ndarray) * 3 / 4 / 4 / 16000  # base64 编码的 float32 PCM，时长可精确计算
+    else:
+        size = upload_size(audio_file, audio_base64, audio_ndarray)
+        if size is None:
+            return None
+        seconds = admission.estimate_seconds(size)
+    return seconds * model_manager.cost_factor(model)
+
+def estimate_body_cost(model: str, request: Request, body_type: str, dtype: str, sample_rate: int) -> Optional[float]:
+    """
+    Audio-seconds cost of a raw-body request from its Content-Length (exact for PCM), or None if unknown.
+    """
+    length = request.headers.get("content-length", "")
+    if not length.isdigit():
+        return None
+    if body_type == "pcm" and dtype in PCM_DTYPES and sample_rate > 0:
+        seconds = int(length) / np.dtype(PCM_DTYPES[dtype]).itemsize / sample_rate
+    else:
+        seconds = admission.estimate_seconds(int(length))
+    return seconds * model_manager.cost_factor(model)
+
+def raw_body_type(request: Request) -> Optional[str]:
+    """
+    'pcm' for an application/octet-stream body, 'encoded' for an audio/* body (Opus, FLAC, ...),
+    None for form requests.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "application/octet-stream":
+        return "pcm"
+    if content_type.startswith("audio/"):
+        return "encoded"
+    return None
+
+def query_params(request: Request, endpoint) -> dict:
+    """
+    Form parameters of `endpoint` passed in the query string (raw-body requests), converted to their annotated
+    types.
+
+    Raises:
+        ValueError: If a value cannot be converted.
+    """
+    params = {}
+    for name, param in inspect.signature(endpoint).parameters.items():
+        raw = request.query_params.get(name)
+        if raw is None:
+            continue
+        kind = next((t for t in typing.get_args(param.annotation) if t is not type(None)), param.annotation)
+        if kind is bool:
+            if raw.lower() not in ("true", "false", "1", "0", "yes", "no", "on", "off"):
+                raise ValueError(f"Invalid boolean for '{name}': {raw}")
+            params[name] = raw.lower() in ("true", "1", "yes", "on")
+        elif kind in (str, int, float):
+            try:
+                params[name] = kind(raw)
+            except ValueError:
+                raise ValueError(f"Invalid value for '{name}': {raw}")
+    return params
+
+async def body_chunks(request: Request) -> AsyncIterator[bytes]:
+    """
+    Chunks of the request body as they arrive, enforcing the maximum upload size.
+
+    Raises:
+        AudioFetchError: 413 if the body exceeds `max_upload_size_mb`.
+    """
+    max_bytes = audio_fetcher.max_bytes
+    length = request.headers.get("content-length", "")
+    if max_bytes and length.isdigit() and int(length) > max_bytes:
+        raise AudioFetchError("Request body exceeds the maximum upload size.", status_code=413)
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if max_bytes and received > max_bytes:
+            raise AudioFetchError("Request body exceeds the maximum upload size.", status_code=413)
+        if chunk:
+            yield chunk
+
+async def read_pcm_body(request: Request, dtype: str, sample_rate: int) -> np.ndarray:
+    """
+    Decode a raw little-endian mono PCM body; the samples are viewed in place with `np.frombuffer`
+    (float32 at 16kHz needs no conversion at all).
+
+    Raises:
+        AudioDecodeError: If dtype/sample_rate are invalid or the body is not a whole number of samples.
+        AudioFetchError: 413 if the body exceeds the maximum upload size.
+    """
+    if dtype not in PCM_DTYPES:
+        raise AudioDecodeError(f"Unsupported PCM dtype: {dtype} (expected one of {', '.join(PCM_DTYPES)}).")
+    if sample_rate <= 0:
+        raise AudioDecodeError("sample_rate must be positive.")
+    buf = bytearray()
+    async for chunk in body_chunks(request):
+        buf += chunk
+    if not buf:
+        raise AudioDecodeError("Empty request body.")
+    try:
+        return decode_pcm_bytes(buf, dtype=dtype, sample_rate=sample_rate)
+    except ValueError as e:
+        raise AudioDecodeError(f"Invalid PCM body: {e}")
+
+def admission_response(e: AdmissionError) -> JSONResponse:
+    content = {"error": str(e), "cost_audio_seconds": round(e.cost, 1),
+               "available_audio_seconds": round(e.available, 1), "retry_after": e.retry_after}
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else None
+    return JSONResponse(content, status_code=e.status_code, headers=headers)
+
+def resolve_vad(enabled: Optional[bool], **overrides) -> Optional[dict]:
+    """
+    Return VAD options for a request (config defaults + per-request overrides), or None if VAD is off.
+    """
+    config = model_manager.vad_config
+    if not (config.get("enabled", False) if enabled is None else enabled):
+        return None
+    return vad_options(**{**config, **overrides})
+
+async def strip_silence(arr: np.ndarray, vad_opts: Optional[dict]):
+    """
+    Run VAD if enabled; returns (speech, regions, vad_info), or (arr, None, None) when VAD is off.
+    """
+    if vad_opts is None:
+        return arr, None, None
+    # 去除静音段，只对语音部分推理
+    with timed_stage("vad"):
+        speech, regions = await run_in_threadpool(apply_vad, arr, **vad_opts)
+    vad_info = {
+        "speech_seconds": round(len(speech) / 16000, 3),
+        "skipped_seconds": round((len(arr) - len(speech)) / 16000, 3),
+    }
+    return speech, regions, vad_info
+
+async def run_transcription(model: str, arr: np.ndarray, language: Optional[str], vad_opts: Optional[dict],
+                            use_long_form: bool, **options) -> dict:
+    """
+    Run VAD (optional) and inference for one request; the returned result carries a 'vad' entry when VAD ran.
+    Extra `options` (e.g. word_timestamps) are passed to the model's transcribe call.
+
+    Raises:
+        QueueFullError: If the model's queue is full.
+        ModelLoadError: If the model fails to load.
+    """
+    arr, regions, vad_info = await strip_silence(arr, vad_opts)
+    if len(arr) == 0 and vad_info is not None:
+        result = {"text": "", "segments": [], "language": language}
+    elif use_long_form:
+        # 长音频: 按静音切分后并行识别再拼接
+        result = await model_manager.transcribe_long(model, arr, language=language, **options)
+    else:
+        result = await model_manager.transcribe(model, arr, language=language, **options)
+    if vad_info is not None:
+        remap_timestamps(result, regions)
+        result = dict(result, vad=vad_info)
+    return result
+
+async def iter_segments(stitcher: SegmentStitcher, model: str, speech: np.ndarray, regions, use_long_form: bool,
+                        **options) -> AsyncIterator[Tuple[int, List[dict]]]:
+    """
+    Transcribe window by window and yield `(end_sample, segments)` for each window (segments on the original
+    timeline) as soon as it is done; the complete result is available from `stitcher` once the iterator is
+    exhausted.
+    """
+    if len(speech) == 0 and regions is not None:
+        return
+    windows = model_manager.transcribe_windows(model, speech, long_form=use_long_form, **options)
+    async for (start, end), result in windows:
+        segments = stitcher.add(result, start)
+        if regions is not None:
+            remap_timestamps({"segments": segments}, regions)
+        yield end, segments
+
+async def write_subtitles(writer: SubtitleWriter, first: List[dict], batches: AsyncIterator[Tuple[int, List[dict]]],
+                          stitcher: SegmentStitcher, vad_info: Optional[dict], key: Optional[str],
+                          timing: RequestTiming, audio_seconds: float) -> AsyncIterator[str]:
+    with timing.stage("serialization"):
+        chunk = writer.header() + writer.segments(first)
+    yield chunk
+    async for _, segments in batches:
+        with timing.stage("serialization"):
+            chunk = writer.segments(segments)
+        yield chunk
+    yield writer.footer(stitcher.language)
+    result = stitcher.result()
+    if vad_info is not None:
+        result = dict(result, vad=vad_info)
+    if key is not None:
+        result_cache.put(key, result)
+    timing.finish(audio_seconds)
+
+async def detect_language(arr: np.ndarray, model: Optional[str] = None,
+                          fallback: Optional[str] = None) -> Tuple[dict, bool]:
+    """
+    Detect the language of the first 30 s of `arr` with `model` (default: the manager's detector model, else
+    `fallback`); results are cached by audio content and detector model. Returns (detection, cached).
+
+    Raises:
+        KeyError: If no model is available for detection.
+        QueueFullError: If the detector model's queue is full.
+        ModelLoadError: If the detector model fails to load.
+        LanguageDetectionError: If the detector model cannot detect the language.
+    """
+    name = model or model_manager.language_detector(fallback)
+    if name is None:
+        raise KeyError("No model available for language detection.")
+    key = None
+    if result_cache is not None:
+        with timed_stage("cache"):
+            key = await run_in_threadpool(cache_key, arr[:DETECTION_SAMPLES], name, {"task": "detect_language"})
+            detection = result_cache.get(key)
+        if detection is not None:
+            return detection, True
+    detection = await model_manager.detect_language(arr, name)
+    if key is not None:
+        result_cache.put(key, detection)
+    return detection, False
+
+async def fast_detect_language(arr: np.ndarray, model: str) -> Optional[dict]:
+    """
+    Language-detection fast path for requests without a language: detect once with the smallest loaded model
+    so `model` does not detect on its own. Returns None when detection is unavailable (the model then detects).
+    """
+    try:
+        detection, _ = await detect_language(arr, fallback=model)
+    except (KeyError, QueueFullError, ModelLoadError, LanguageDetectionError):
+        return None
+    return detection
+
+def queue_full_response(e: QueueFullError) -> JSONResponse:
+    return JSONResponse(
+        {"error": str(e), "retry_after": e.retry_after},
+        status_code=503,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+def format_event(event: dict, sse: bool) -> str:
+    data = json.dumps(event, ensure_ascii=False)
+    if sse:
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+def segment_event(seg: dict) -> dict:
+    event = {"event": "segment", "id": seg.get("id"), "start": seg["start"], "end": seg["end"], "text": seg["text"]}
+    if seg.get("words"):
+        event["words"] = seg["words"]
+    return event
+
+def done_event(result: dict, model: str, cached: bool) -> dict:
+    event = {"event": "done", "text": result["text"], "language": result.get("language"), "model": model,
+             "cached": cached}
+    if result.get("vad") is not None:
+        event["vad"] = result["vad"]
+    return event
+
+async def stream_events(pending: asyncio.Future, batches: AsyncIterator[Tuple[int, List[dict]]],
+                        stitcher: SegmentStitcher, total_samples: int, sse: bool, model: str,
+                        vad_info: Optional[dict], key: Optional[str], timing: RequestTiming,
+                        audio_seconds: float) -> AsyncIterator[str]:
+    """
+    Emit `segment` events for each window as soon as it is decoded, a `progress` event after every window
+    and every PROGRESS_INTERVAL seconds while waiting (keep-alive), then a final `done` (or `error`) event.
+    `pending` is the already started task for the first window.
+    """
+    started = time.perf_counter()
+    processed = 0
+
+    def progress() -> str:
+        elapsed = time.perf_counter() - started
+        remaining = max(0, total_samples - processed)
+        eta = elapsed / processed * remaining if processed else None
+        return format_event({
+            "event": "progress",
+            "processed_seconds": round(processed / 16000, 2),
+            "total_seconds": round(total_samples / 16000, 2),
+            "elapsed_seconds": round(elapsed, 2),
+            "eta_seconds": round(eta, 2) if eta is not None else None,
+        }, sse)
+
+    try:
+        while True:
+            done, _ = await asyncio.wait({pending}, timeout=PROGRESS_INTERVAL)
+            if not done:
+                yield progress()
+                continue
+            try:
+                processed, segments = pending.result()
+            except StopAsyncIteration:
+                break
+            with timing.stage("serialization"):
+                chunk = "".join(format_event(segment_event(seg), sse) for seg in segments)
+            yield chunk + progress()
+            pending = asyncio.ensure_future(batches.__anext__())
+    except (QueueFullError, ModelLoadError) as e:
+        yield format_event({"event": "error", "error": str(e)}, sse)
+        return
+    finally:
+        # 客户端断开时取消仍在进行的窗口，释放模型队列
+        pending.cancel()
+    result = stitcher.result()
+    if vad_info is not None:
+        result = dict(result, vad=vad_info)
+    if key is not None:
+        result_cache.put(key, result)
+    yield format_event(done_event(result, model, False), sse)
+    timing.finish(audio_seconds)
+
+async def replay_events(result: dict, sse: bool, model: str) -> AsyncIterator[str]:
+    for seg in result.get("segments", []):
+        yield format_event(segment_event(seg), sse)
+    yield format_event(done_event(result, model, True), sse)
+
 @router.post("/transcribe")
 async def transcribe(
+    request: Request,
     audio_file: Optional[UploadFile] = File(None),
     audio_url: Optional[str] = Form(None),
     audio_base64: Optional[str] = Form(None),
     audio_ndarray: Optional[str] = Form(None),
-    model: str = Form(...),
+    model: Optional[str] = Form(None),
     language: Optional[str] = Form(None),
     output_format: Optional[str] = Form("json"),
-    stream: Optional[bool] = Form(False)
+    stream: Optional[bool] = Form(False),
+    vad: Optional[bool] = Form(None),
+    vad_threshold_db: Optional[float] = Form(None),
+    vad_min_silence_ms: Optional[float] = Form(None),
+    vad_speech_pad_ms: Optional[float] = Form(None),
+    long_form: Optional[bool] = Form(None),
+    word_timestamps: Optional[bool] = Form(None),
+    preset: Optional[str] = Form(None),
+    temperature: Optional[str] = Form(None),
+    beam_size: Optional[int] = Form(None),
+    best_of: Optional[int] = Form(None),
+    patience: Optional[float] = Form(None),
+    condition_on_previous_text: Optional[bool] = Form(None),
+    compression_ratio_threshold: Optional[float] = Form(None),
+    logprob_threshold: Optional[float] = Form(None),
+    no_speech_threshold: Optional[float] = Form(None),
+    initial_prompt: Optional[str] = Form(None),
+    fp16: Optional[bool] = Form(None),
+    dtype: Optional[str] = Form(None),
+    sample_rate: Optional[int] = Form(None),
 ):
-    arr = get_audio_array(audio_file, audio_url, audio_base64, audio_ndarray)
+    """
+    Transcribe audio sent as a multipart/urlencoded form, or as a raw request body with the parameters in the
+    query string: `application/octet-stream` is mono little-endian PCM (`dtype` int16/float32, default
+    float32, at `sample_rate`, default 16000), `audio/*` (e.g. audio/ogg for Opus, audio/flac) is decoded by
+    ffmpeg while the body is received.
+    """
+    params = dict(locals())
+    body_type = raw_body_type(request)
+    if body_type is not None:
+        try:
+            params.update(query_params(request, transcribe))
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+    if not params["model"]:
+        return JSONResponse({"error": "model is required."}, status_code=400)
+    return await handle_transcribe(body_type=body_type, **params)
+
+async def handle_transcribe(
+    request: Request,
+    body_type: Optional[str],
+    audio_file: Optional[UploadFile],
+    audio_url: Optional[str],
+    audio_base64: Optional[str],
+    audio_ndarray: Optional[str],
+    model: str,
+    language: Optional[str],
+    output_format: Optional[str],
+    stream: Optional[bool],
+    vad: Optional[bool],
+    vad_threshold_db: Optional[float],
+    vad_min_silence_ms: Optional[float],
+    vad_speech_pad_ms: Optional[float],
+    long_form: Optional[bool],
+    word_timestamps: Optional[bool],
+    preset: Optional[str],
+    temperature: Optional[str],
+    beam_size: Optional[int],
+    best_of: Optional[int],
+    patience: Optional[float],
+    condition_on_previous_text: Optional[bool],
+    compression_ratio_threshold: Optional[float],
+    logprob_threshold: Optional[float],
+    no_speech_threshold: Optional[float],
+    initial_prompt: Optional[str],
+    fp16: Optional[bool],
+    dtype: Optional[str],
+    sample_rate: Optional[int],
+):
+    timing = RequestTiming(model, input_type(audio_file, audio_url, audio_base64, audio_ndarray, body_type))
+    timing.activate()
+    dtype = dtype or "float32"
+    sample_rate = sample_rate or 16000
+    client = None
+    if admission is not None:
+        client = admission.client_id(request.headers, request.client.host if request.client else None)
+        # 解码前按上传大小估算成本，预算明显不足时直接拒绝
+        if body_type is not None:
+            estimate = estimate_body_cost(model, request, body_type, dtype, sample_rate)
+        else:
+            estimate = await run_in_threadpool(estimate_cost, model, audio_file, audio_base64, audio_ndarray)
+        if estimate is not None:
+            try:
+                admission.check(client, estimate)
+            except AdmissionError as e:
+                return admission_response(e)
+    # 解码和推理都放到线程池/推理池中，避免阻塞事件循环；URL 与编码音频请求体则边接收边解码
+    try:
+        with timing.stage("decode"):
+            if body_type == "pcm":
+                arr = await read_pcm_body(request, dtype, sample_rate)
+            elif body_type == "encoded":
+                arr = await decode_stream(body_chunks(request))
+            elif audio_url and not audio_file:
+                arr = await audio_fetcher.fetch(audio_url)
+            else:
+                arr = await run_in_threadpool(get_audio_array, audio_file, audio_base64, audio_ndarray)
+    except AudioFetchError as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    except AudioDecodeError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     if arr is None:
         return JSONResponse({"error": "No valid audio input provided."}, status_code=400)
-    m = model_manager.get_model(model)
-    if m is None:
+    if not model_manager.has_model(model):
         return JSONResponse({"error": f"Model '{model}' not loaded."}, status_code=404)
-    result = m.transcribe(arr, language=language)
+    vad_opts = resolve_vad(vad, threshold_db=vad_threshold_db, min_silence_ms=vad_min_silence_ms,
+                           speech_pad_ms=vad_speech_pad_ms)
+    use_long_form = model_manager.use_long_form(arr, long_form)
+    try:
+        # 预设 + 模型默认值 + 请求参数，并检查服务端上限
+        preset, options = model_manager.decoding_options(model, preset, {
+            "temperature": temperature, "beam_size": beam_size, "best_of": best_of, "patience": patience,
+            "condition_on_previous_text": condition_on_previous_text,
+            "compression_ratio_threshold": compression_ratio_threshold, "logprob_threshold": logprob_threshold,
+            "no_speech_threshold": no_speech_threshold, "initial_prompt": initial_prompt, "fp16": fp16,
+        })
+    except DecodingOptionsError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    decoding = dict(options, preset=preset)
+    if word_timestamps or output_format == "words":
+        options["word_timestamps"] = True
+    key = None
+    result = None
+    if result_cache is not None:
+        with timing.stage("cache"):
+            key = await run_in_threadpool(cache_key, arr, model, {
+                "language": language, "vad": vad_opts, "long_form": use_long_form, **options,
+            })
+            result = result_cache.get(key)
+    cached = result is not None
+    if admission is not None and not cached:
+        # 按解码后的实际时长 × 模型成本系数扣除预算，再按客户端公平排队；槽位在响应发送完后由中间件释放
+        queue = model_manager.queues[model]
+        try:
+            request.state.admission_ticket = await admission.admit(
+                client, model, len(arr) / 16000 * model_manager.cost_factor(model), queue.concurrency,
+                retry_after=queue.retry_after, max_waiting=queue.max_queue_size,
+            )
+        except AdmissionError as e:
+            return admission_response(e)
+        except QueueFullError as e:
+            return queue_full_response(e)
+    detection = None
+    if not cached and language is None and model_manager.auto_detect_language(model):
+        # 语言检测快速通道: 用检测模型检测一次并把语言传给目标模型（缓存键仍按请求的 language=None 计算）
+        detection = await fast_detect_language(arr, model)
+        min_probability = model_manager.language_detection.get("min_probability", 0)
+        if detection is not None and detection["probability"] >= min_probability:
+            language = detection["language"]
+    if (stream or output_format == "stream") and output_format not in SUBTITLE_FORMATS:
+        # 增量返回分段: 默认 NDJSON，Accept: text/event-stream 时使用 SSE
+        sse = "text/event-stream" in request.headers.get("accept", "")
+        media_type = "text/event-stream" if sse else "application/x-ndjson"
+        if cached:
+            timing.finish(len(arr) / 16000)
+            return StreamingResponse(replay_events(result, sse, model), media_type=media_type)
+        speech, regions, vad_info = await strip_silence(arr, vad_opts)
+        stitcher = SegmentStitcher()
+        batches = iter_segments(stitcher, model, speech, regions, use_long_form, language=language, **options)
+        pending = asyncio.ensure_future(batches.__anext__())
+        # 让首个窗口的任务运行到第一次挂起: 队列已满会在入队时同步抛出，此时仍可返回 503
+        await asyncio.sleep(0)
+        if pending.done() and isinstance(pending.exception(), QueueFullError):
+            return queue_full_response(pending.exception())
+        return StreamingResponse(
+            stream_events(pending, batches, stitcher, len(speech), sse, model, vad_info, key, timing, len(arr) / 16000),
+            media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    if output_format in SUBTITLE_FORMATS and not cached:
+        # 字幕格式: 每个窗口识别完成后立即输出对应的字幕条目
+        speech, regions, vad_info = await strip_silence(arr, vad_opts)
+        stitcher = SegmentStitcher()
+        batches = iter_segments(stitcher, model, speech, regions, use_long_form, language=language, **options)
+        try:
+            # 先等第一个窗口完成，使排队满/加载失败仍能以状态码返回
+            _, first = await batches.__anext__()
+        except StopAsyncIteration:
+            first = []
+        except QueueFullError as e:
+            return queue_full_response(e)
+        except ModelLoadError as e:
+            return JSONResponse({"error": str(e)}, status_code=500)
+        writer = SubtitleWriter(output_format, model)
+        headers = {"X-Audio-Skipped-Seconds": str(vad_info["skipped_seconds"])} if vad_info else None
+        return StreamingResponse(
+            write_subtitles(writer, first, batches, stitcher, vad_info, key, timing, len(arr) / 16000),
+            media_type=writer.media_type, headers=headers,
+        )
+    if not cached:
+        try:
+            result = await run_transcription(model, arr, language, vad_opts, use_long_form, **options)
+        except QueueFullError as e:
+            return queue_full_response(e)
+        except ModelLoadError as e:
+            return JSONResponse({"error": str(e)}, status_code=500)
+        if key is not None:
+            result_cache.put(key, result)
+    vad_info = result.get("vad")
     actual_model = model  # 实际执行的模型名
-    if output_format == "text":
-        return PlainTextResponse(result["text"])
-    elif output_format == "json_metadata":
-        result_with_model = dict(result)
-        result_with_model["model"] = actual_model
-        return JSONResponse(result_with_model)
-    else:
-        return JSONResponse({"text": result["text"], "language": result["language"], "model": actual_model})
+    with timing.stage("serialization"):
+        if output_format in SUBTITLE_FORMATS:
+            writer = SubtitleWriter(output_format, model)
+            resp = Response(writer.render(result), media_type=writer.media_type)
+        elif output_format == "text":
+            headers = {"X-Audio-Skipped-Seconds": str(vad_info["skipped_seconds"])} if vad_info else None
+            resp = PlainTextResponse(result["text"], headers=headers)
+        elif output_format == "json_metadata":
+            result_with_model = dict(result)
+            result_with_model["model"] = actual_model
+            result_with_model["cached"] = cached
+            result_with_model["decoding"] = decoding
+            if detection is not None:
+                result_with_model["language_detection"] = detection
+            resp = JSONResponse(result_with_model)
+        else:
+            response = {"text": result["text"], "language": result["language"], "model": actual_model}
+            if vad_info is not None:
+                response["vad"] = vad_info
+            resp = JSONResponse(response)
+    timing.finish(len(arr) / 16000)
+    if server_timing:
+        resp.headers["Server-Timing"] = timing.server_timing()
+    return resp
+
+@router.post("/detect-language")
+async def detect_language_endpoint(
+    audio_file: Optional[UploadFile] = File(None),
+    audio_url: Optional[str] = Form(None),
+    audio_base64: Optional[str] = Form(None),
+    audio_ndarray: Optional[str] = Form(None),
+    model: Optional[str] = Form(None),
+):
+    """
+    Detect the spoken language from a single 30 s log-mel window (one encoder pass) without transcribing.
+    `model` defaults to `language_detection.model` or the smallest loaded multilingual model.
+    """
+    timing = RequestTiming(model or "auto", input_type(audio_file, audio_url, audio_base64, audio_ndarray))
+    timing.activate()
+    try:
+        with timing.stage("decode"):
+            if audio_url and not audio_file:
+                arr = await audio_fetcher.fetch(audio_url)
+            else:
+                arr = await run_in_threadpool(get_audio_array, audio_file, audio_base64, audio_ndarray)
+    except AudioFetchError as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    except AudioDecodeError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if arr is None:
+        return JSONResponse({"error": "No valid audio input provided."}, status_code=400)
+    if model is not None and not model_manager.has_model(model):
+        return JSONResponse({"error": f"Model '{model}' not loaded."}, status_code=404)
+    try:
+        detection, cached = await detect_language(arr, model)
+    except KeyError as e:
+        return JSONResponse({"error": str(e.args[0])}, status_code=404)
+    except LanguageDetectionError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except QueueFullError as e:
+        return queue_full_response(e)
+    except ModelLoadError as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    timing.finish(min(len(arr), DETECTION_SAMPLES) / 16000)
+    resp = JSONResponse(dict(detection, cached=cached))
+    if server_timing:
+        resp.headers["Server-Timing"] = timing.server_timing()
+    return resp
+
+def stream_status(backlog: Optional[AudioBacklog], chunks: int) -> dict:
+    """
+    Pipeline fields added to each streaming response: seconds of audio received but not yet decoded, and how
+    many chunks the response covers when they were coalesced.
+    """
+    if backlog is None:
+        return {}
+    status = {"lag_seconds": round(backlog.pending_seconds, 3)}
+    if chunks > 1:
+        status["coalesced_chunks"] = chunks
+    return status
+
+async def stream_step(send: Callable[[dict], None], session: StreamingSession, arr: np.ndarray,
+                      timing: RequestTiming, backlog: Optional[AudioBacklog] = None, chunks: int = 1):
+    """
+    Append audio (one chunk, or several coalesced ones) to the session, re-decode its unstable tail and queue
+    the response with `send`. All-silent audio (when VAD is enabled) skips inference entirely.
+    """
+    if session.is_silent(arr):
+        words = session.skip_silence(len(arr))
+        send(dict(session.message(words, [], final=bool(words)), **stream_status(backlog, chunks)))
+        timing.finish(len(arr) / 16000)
+        return
+    session.insert_audio(arr)
+    sample = session.language_sample()
+    if sample is not None:
+        # 从会话开头的几秒音频检测一次语言，之后锁定，避免每个分片重复检测且语言来回跳变
+        session.lock_language(await fast_detect_language(sample, session.model))
+    # 只重新识别缓冲区中尚未确认的尾部音频
+    try:
+        result = await model_manager.transcribe(session.model, session.buffer, features=session.features,
+                                                encoder_cache=session.encoder_cache, **session.transcribe_options())
+    except QueueFullError as e:
+        send({"error": str(e), "retry_after": e.retry_after})
+        return
+    except ModelLoadError as e:
+        send({"error": str(e)})
+        return
+    with timing.stage("serialization"):
+        new_words, partial = session.process(result)
+        msg = session.message(new_words, partial)
+        msg["language"] = result.get("language")
+        if session.language_detection is not None:
+            msg["language_locked"] = True
+        msg.update(stream_status(backlog, chunks))
+        send(msg)
+    timing.finish(len(arr) / 16000)
 
 # WebSocket流式接口
 @router.websocket("/transcribe/stream")
 async def transcribe_stream(ws: WebSocket):
+    """
+    Two message styles are accepted on the same socket:
+    - binary mode: a JSON control message {"model", "language", "dtype", "sample_rate"} followed by
+      binary frames of raw little-endian PCM (float32 or int16);
+    - legacy mode: JSON messages carrying a base64 float32 `audio_ndarray` plus model/language.
+
+    Receiving, inference and sending run as separate tasks: received audio goes into a bounded backlog, the
+    inference task decodes everything that accumulated while the previous re-decode ran in one call, and
+    responses are written by a sender task, so frames keep being read while the model works.
+    """
+    global stream_sessions
     await ws.accept()
-    try:
+    max_sessions = streaming.get("max_sessions")
+    if max_sessions and stream_sessions >= max_sessions:
+        STREAM_OVERLOAD.inc(kind="rejected")
+        retry_after = model_manager.config.get("retry_after", 5)
+        await ws.send_json({"error": "Too many streaming sessions.", "retry_after": retry_after})
+        await ws.close(code=1013)  # Try Again Later
+        return
+    stream_sessions += 1
+    WEBSOCKET_SESSIONS.inc()
+    session: Optional[StreamingSession] = None
+    pcm_format = None  # 二进制模式下协商好的 (dtype, sample_rate)
+    backlog = AudioBacklog(streaming.get("max_pending_seconds", 10))
+    lag_warning = streaming.get("lag_warning_seconds", 5)
+    outbox: asyncio.Queue = asyncio.Queue()
+    send = outbox.put_nowait
+
+    async def send_loop():
         while True:
-            data = await ws.receive_json()
+            await ws.send_json(await outbox.get())
+            outbox.task_done()
+
+    async def infer_loop():
+        # 会话只在 backlog.join() 之后切换，此时本任务空闲，读取到的 session 总是这批音频所属的会话
+        lagging = False
+        try:
+            while True:
+                item = await backlog.get()
+                if item is None:
+                    return
+                arr, chunks, decode_seconds = item
+                try:
+                    # 每次推理单独计时（input=stream），合并的分片计为一次
+                    timing = RequestTiming(session.model, "stream")
+                    timing.activate()
+                    timing.add("decode", decode_seconds)
+                    if chunks > 1:
+                        STREAM_OVERLOAD.inc(chunks - 1, kind="coalesced")
+                    await stream_step(send, session, arr, timing, backlog, chunks)
+                finally:
+                    await backlog.task_done()
+                # 推理期间积压的音频超过阈值时通知客户端（回落到阈值以下之前只通知一次）
+                if backlog.pending_seconds >= lag_warning and not lagging:
+                    STREAM_OVERLOAD.inc(kind="lag")
+                    send({"event": "lag", "lag_seconds": round(backlog.pending_seconds, 3)})
+                lagging = backlog.pending_seconds >= lag_warning
+        finally:
+            await backlog.close()
+
+    sender = asyncio.ensure_future(send_loop())
+    worker = asyncio.ensure_future(infer_loop())
+
+    async def enqueue(arr: np.ndarray, decode_seconds: float):
+        if backlog.full():
+            # 积压已满: 暂停读取 socket（TCP 背压）直到推理任务取走音频
+            STREAM_OVERLOAD.inc(kind="backpressure")
+            send({"event": "backpressure", "pending_seconds": round(backlog.pending_seconds, 3)})
+        await backlog.put(arr, decode_seconds)
+
+    try:
+        while not backlog.closed:
+            receiving = asyncio.ensure_future(ws.receive())
+            await asyncio.wait({receiving, worker}, return_when=asyncio.FIRST_COMPLETED)
+            if not receiving.done():
+                # 推理任务已退出（异常）: 不再等待客户端的下一条消息
+                receiving.cancel()
+                break
+            message = receiving.result()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                if session is None or pcm_format is None:
+                    send({"error": "Send a JSON control message with 'model' before binary audio frames."})
+                    continue
+                started = time.perf_counter()
+                try:
+                    arr = decode_pcm_bytes(message["bytes"], *pcm_format)
+                except ValueError as e:
+                    send({"error": str(e)})
+                    continue
+                await enqueue(arr, time.perf_counter() - started)
+                continue
+
+            try:
+                data = json.loads(message.get("text") or "")
+            except ValueError:
+                send({"error": "Invalid JSON message."})
+                continue
+            if data.get("event") == "end":
+                # 客户端声明音频结束: 等积压的音频识别完，再提交剩余的未确认文本
+                await backlog.join()
+                if session is not None:
+                    msg = session.message(session.finish(), [], final=True)
+                    msg["event"] = "end"
+                    if session.encoder_cache is not None:
+                        msg["encoder_cache"] = session.encoder_cache.stats()
+                    send(msg)
+                    if pcm_format is None:
+                        session = None
+                continue
             model = data.get("model")
             language = data.get("language")
+            if not model_manager.has_model(model):
+                send({"error": f"Model '{model}' not loaded."})
+                continue
+            try:
+                preset, decoding = model_manager.decoding_options(
+                    model, data.get("preset"), {k: data.get(k) for k in DECODING_OPTIONS})
+            except DecodingOptionsError as e:
+                send({"error": str(e)})
+                continue
             audio_ndarray = data.get("audio_ndarray")
-            arr = decode_audio_ndarray(audio_ndarray)
-            m = model_manager.get_model(model)
-            if m is None:
-                await ws.send_json({"error": f"Model '{model}' not loaded."})
+            changed = (session is None or session.model != model or session.requested_language != language
+                       or session.decoding != decoding)
+            if changed or audio_ndarray is None:
+                # 先识别完已排队的音频，使其仍按旧的会话与格式处理
+                await backlog.join()
+            if changed:
+                vad_opts = resolve_vad(data.get("vad"), threshold_db=data.get("vad_threshold_db"),
+                                       min_silence_ms=data.get("vad_min_silence_ms"))
+                detection_config = model_manager.language_detection
+                session = StreamingSession(
+                    model, language, vad=vad_opts, decoding=decoding,
+                    detect_language_seconds=(detection_config.get("stream_seconds", 3)
+                                             if model_manager.auto_detect_language(model) else None),
+                    min_language_probability=detection_config.get("min_probability", 0),
+                    encoder_cache=model_manager.new_encoder_cache(),
+                )
+            if audio_ndarray is None:
+                # 控制消息: 协商模型、语言与 PCM 格式，之后的音频以二进制帧发送
+                dtype = data.get("dtype", "float32")
+                if dtype not in PCM_DTYPES:
+                    send({"error": f"Unsupported PCM dtype: {dtype}"})
+                    continue
+                try:
+                    sample_rate = int(data.get("sample_rate", 16000))
+                except (TypeError, ValueError):
+                    sample_rate = 0
+                if sample_rate <= 0:
+                    send({"error": f"Invalid sample_rate: {data.get('sample_rate')}"})
+                    continue
+                pcm_format = (dtype, sample_rate)
+                send({"event": "ready", "model": model, "language": language,
+                      "dtype": dtype, "sample_rate": pcm_format[1],
+                      "decoding": dict(decoding, preset=preset)})
                 continue
-            # 这里假设每次推理一小段
-            result = m.transcribe(arr, language=language)
-            await ws.send_json({
-                "text": result["text"],
-                "is_final": True,
-                "metadata": result,
-                "model": model  # 实际执行的模型名
-            })
+            started = time.perf_counter()
+            arr = decode_audio_ndarray(audio_ndarray)
+            await enqueue(arr, time.perf_counter() - started)
+        if worker.done() and not worker.cancelled() and worker.exception() is not None:
+            # 推理任务异常退出: 先发出已排队的响应和错误消息，再关闭连接并抛出该错误
+            send({"error": f"Streaming inference failed: {worker.exception()}"})
+            flushed = asyncio.ensure_future(outbox.join())
+            await asyncio.wait({flushed, sender}, return_when=asyncio.FIRST_COMPLETED)
+            flushed.cancel()
+            try:
+                await ws.close(code=1011)  # Internal Error
+            except RuntimeError:
+                pass  # 客户端已断开
+            worker.result()
     except WebSocketDisconnect:
-        pass 
\ No newline at end of file
+        pass
+    finally:
+        # 断开时取消进行中的推理（释放模型队列），已排队的响应不再发送
+        worker.cancel()
+        await backlog.close()
+        sender.cancel()
+        await asyncio.gather(worker, sender, return_exceptions=True)
+        stream_sessions -= 1
+        WEBSOCKET_SESSIONS.dec()
@@ -4,8 +4,12 @@ It serves as the main entry point for the Whisper Docker API service.
 """
 import os
 from fastapi import FastAPI
-from app.api import transcribe, models, health
+from app.api import transcribe, models, health, metrics, jobs
 from app.models.manager import ModelManager
+from app.models.jobs import JobStore, JobWorkers
+from app.utils.admission import AdmissionController, AdmissionMiddleware
+from app.utils.cache import ResultCache
+from app.utils.fetch import AudioFetcher
 
 # 加载配置
 CONFIG_PATH = os.getenv("CONFIG_PATH", "config/config.yaml")
@@ -13,10 +17,46 @@ model_manager = ModelManager(CONFIG_PATH)
 
 # 注入到各API模块
 transcribe.model_manager = model_manager
+transcribe.result_cache = ResultCache.from_config(model_manager.config.get("cache"))
+transcribe.audio_fetcher = AudioFetcher.from_config(model_manager.config)
+transcribe.admission = AdmissionController.from_config(model_manager.config.get("admission"))
+transcribe.server_timing = bool((model_manager.config.get("metrics") or {}).get("server_timing", False))
+transcribe.streaming = model_manager.config.get("streaming") or {}
 models.model_manager = model_manager
+metrics.model_manager = model_manager
+metrics.admission = transcribe.admission
+
+# 异步批量任务：SQLite 持久化队列 + 后台 worker，与实时接口共享已加载的模型
+jobs_config = model_manager.config.get("jobs") or {}
+if jobs_config.get("enabled", False):
+    jobs.job_store = JobStore(jobs_config.get("db_path", "data/jobs.db"), jobs_config.get("data_dir", "data/jobs"))
+    jobs.job_workers = JobWorkers(
+        jobs.job_store,
+        jobs.execute_item,
+        workers=jobs_config.get("workers", 2),
+        webhook_timeout=jobs_config.get("webhook_timeout", 10),
+        webhook_retries=jobs_config.get("webhook_retries", 3),
+    )
+jobs.max_upload_bytes = transcribe.audio_fetcher.max_bytes
 
 app = FastAPI(title="Whisper Docker API")
+if transcribe.admission is not None:
+    app.add_middleware(AdmissionMiddleware)
 
 app.include_router(transcribe.router)
 app.include_router(models.router)
-app.include_router(health.router) 
\ No newline at end of file
+app.include_router(health.router)
+app.include_router(metrics.router)
+app.include_router(jobs.router)
+
+@app.on_event("startup")
+async def startup():
+    if jobs.job_workers is not None:
+        jobs.job_workers.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if jobs.job_workers is not None:
+        await jobs.job_workers.shutdown()
+    await transcribe.audio_fetcher.aclose()
+    model_manager.shutdown() 
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+This module provides the pluggable inference backends that can be selected per model in config.yaml.
+Every backend returns an object with the same `transcribe(arr, language=..., **options)` interface and
+result format as `whisper.model.Whisper.transcribe`, so the rest of the service is backend-agnostic.
+
+Backends:
+- pytorch: the reference openai-whisper model (fp32 on CPU).
+- pytorch-int8: the same model with Linear layers dynamically quantized to int8 (CPU only).
+- ctranslate2: a CTranslate2 int8 engine through the optional `faster-whisper` package.
+"""
+from typing import Any, Dict, Optional
+
+import torch
+import whisper
+
+BACKENDS = ("pytorch", "pytorch-int8", "ctranslate2")
+
+# whisper.transcribe 的参数名 -> faster-whisper 的参数名
+_FASTER_WHISPER_OPTIONS = {
+    "language": "language",
+    "task": "task",
+    "temperature": "temperature",
+    "beam_size": "beam_size",
+    "best_of": "best_of",
+    "patience": "patience",
+    "length_penalty": "length_penalty",
+    "initial_prompt": "initial_prompt",
+    "condition_on_previous_text": "condition_on_previous_text",
+    "compression_ratio_threshold": "compression_ratio_threshold",
+    "logprob_threshold": "log_prob_threshold",
+    "no_speech_threshold": "no_speech_threshold",
+    "word_timestamps": "word_timestamps",
+    "suppress_tokens": "suppress_tokens",
+}
+
+
+def quantize_int8(model: "whisper.model.Whisper") -> "whisper.model.Whisper":
+    """
+    Dynamically quantize the Linear layers (attention projections and MLPs) of a CPU model to int8.
+
+    whisper uses its own `Linear` subclass (it only casts weights to the input dtype, a no-op in fp32),
+    which the quantization converter rejects, so those modules are first turned back into plain
+    `nn.Linear`. Convolutions, layer norms and the token embedding stay in fp32.
+    """
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class FasterWhisperModel:
+    """
+    Adapter exposing a faster-whisper (CTranslate2) model through the whisper `transcribe` interface.
+    """
+
+    def __init__(self, name: str, device: str = "cpu", compute_type: str = "int8", cpu_threads: int = 0):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise RuntimeError("The ctranslate2 backend requires the 'faster-whisper' package.") from e
+        self.name = name
+        self.device = device
+        self.compute_type = compute_type
+        self.model = WhisperModel(name, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def transcribe(self, arr, **options) -> Dict[str, Any]:
+        kwargs = {_FASTER_WHISPER_OPTIONS[k]: v for k, v in options.items()
+                  if k in _FASTER_WHISPER_OPTIONS and v is not None}
+        if isinstance(kwargs.get("temperature"), (int, float)):
+            kwargs["temperature"] = [kwargs["temperature"]]
+        segments, info = self.model.transcribe(arr, **kwargs)
+        out = []
+        for seg in segments:
+            item = {
+                "id": seg.id,
+                "seek": seg.seek,
+                "start": seg.start,
+                "end": seg.end,
+                "text": seg.text,
+                "tokens": list(seg.tokens),
+                "temperature": seg.temperature,
+                "avg_logprob": seg.avg_logprob,
+                "compression_ratio": seg.compression_ratio,
+                "no_speech_prob": seg.no_speech_prob,
+            }
+            if seg.words is not None:
+                item["words"] = [
+                    {"word": w.word, "start": w.start, "end": w.end, "probability": w.probability}
+                    for w in seg.words
+                ]
+            out.append(item)
+        return {"text": "".join(s["text"] for s in out), "segments": out, "language": info.language}
+
+
+def load_backend(name: str, backend: str = "pytorch", device: str = "cpu",
+                 options: Optional[Dict[str, Any]] = None):
+    """
+    Load model `name` with the given backend.
+
+    Args:
+        name (str): Whisper model name (e.g., 'base').
+        backend (str): One of BACKENDS.
+        device (str): 'cpu' or 'cuda'.
+        options (Optional[Dict[str, Any]]): Backend-specific options from the model's config entry
+            (ctranslate2: compute_type, cpu_threads).
+    Returns:
+        A model object with a whisper-compatible `transcribe(arr, **options)` method.
+    Raises:
+        ValueError: If the backend is unknown or not supported on the device.
+    """
+    options = options or {}
+    if backend == "pytorch":
+        return whisper.load_model(name, device=device)
+    if backend == "pytorch-int8":
+        if device != "cpu":
+            raise ValueError("The pytorch-int8 backend only supports device 'cpu'.")
+        return quantize_int8(whisper.load_model(name, device="cpu"))
+    if backend == "ctranslate2":
+        return FasterWhisperModel(
+            name, device=device, compute_type=options.get("compute_type", "int8"),
+            cpu_threads=options.get("cpu_threads", 0),
+        )
+    raise ValueError(f"Unknown backend: {backend}")
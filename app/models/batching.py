@@ -0,0 +1,170 @@
+"""
+This module implements dynamic micro-batching for short transcription requests.
+Concurrent clips for the same model are gathered for a few milliseconds, padded/trimmed to 30 s log-mel
+windows and decoded in a single batched encoder + greedy decoder pass.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import whisper
+
+from app.models.executor import QueueFullError
+from app.models.features import log_mel_batch
+from app.utils.metrics import Histogram
+from app.utils.timing import timed_stage
+
+BATCH_SIZE = Histogram(
+    "whisper_batch_size", "Number of requests decoded together in one batch",
+    [1, 2, 4, 8, 16, 32, 64], ["model"],
+)
+BATCH_WAIT_SECONDS = Histogram(
+    "whisper_batch_wait_seconds", "Time a request waited in the batcher before its batch started",
+    [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0], ["model"],
+)
+
+
+def batchable(options: Dict[str, Any]) -> bool:
+    """
+    Whether a request's transcribe options are served identically by the batched greedy decoder
+    (single temperature 0, no beam search, no timestamps or prompts).
+
+    Only an explicit temperature 0 (after presets and defaults are resolved) is batchable: without a
+    temperature whisper uses its fallback cascade, which the batched single greedy pass cannot reproduce.
+    """
+    if options.get("temperature") not in (0, (0.0,), [0.0]):
+        return False
+    for name, value in options.items():
+        if name in ("language", "temperature") or value is None:
+            continue
+        if name in ("beam_size", "best_of") and value == 1:
+            continue
+        if name == "condition_on_previous_text":
+            # 单个 30 s 窗口没有前文可供条件化
+            continue
+        return False
+    return True
+
+
+def transcribe_batch(model, arrs: List[np.ndarray], language: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Decode up to 30 s clips in one batched pass and return a `transcribe`-like result per clip.
+
+    Args:
+        model: Loaded whisper model.
+        arrs (List[np.ndarray]): 1D float32 arrays, 16kHz, each at most 30 s long.
+        language (Optional[str]): Language code shared by the batch, or None to detect per clip.
+    Returns:
+        List[Dict[str, Any]]: One dict with 'text', 'segments' and 'language' per input clip.
+    """
+    with timed_stage("mel"):
+        mel = log_mel_batch(arrs, model.dims.n_mels).to(model.device)
+    options = whisper.DecodingOptions(
+        language=language,
+        without_timestamps=True,
+        fp16=model.device.type != "cpu",
+    )
+    decoded = whisper.decode(model, mel, options)
+    results = []
+    for arr, r in zip(arrs, decoded):
+        # 与 whisper.transcribe 保持一致: 判定为静音时不输出文本
+        silent = r.no_speech_prob > 0.6 and r.avg_logprob < -1.0
+        text = "" if silent else r.text
+        segments = [] if silent else [{
+            "id": 0,
+            "seek": 0,
+            "start": 0.0,
+            "end": round(len(arr) / whisper.audio.SAMPLE_RATE, 3),
+            "text": text,
+            "tokens": r.tokens,
+            "temperature": r.temperature,
+            "avg_logprob": r.avg_logprob,
+            "compression_ratio": r.compression_ratio,
+            "no_speech_prob": r.no_speech_prob,
+        }]
+        results.append({"text": text, "segments": segments, "language": r.language})
+    return results
+
+
+class BatchScheduler:
+    """
+    Gathers requests for one model for up to `max_wait_ms` or `max_batch_size` items, then runs them as one batch.
+
+    Requests with different languages are batched separately. All methods run on the event loop thread.
+
+    Args:
+        name (str): Model name (used for metrics and errors).
+        execute (Callable): Coroutine function `execute(arrs, language)` returning one result per clip;
+            it is responsible for model concurrency limits.
+        max_batch_size (int): Flush as soon as this many requests are pending.
+        max_wait_ms (float): Flush at most this long after the first pending request arrived.
+        max_pending (int): Reject new requests with QueueFullError beyond this many pending items.
+        retry_after (int): Retry hint for rejected requests.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        execute: Callable[[List[np.ndarray], Optional[str]], Awaitable[List[Dict[str, Any]]]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20,
+        max_pending: int = 64,
+        retry_after: int = 5,
+    ):
+        self.name = name
+        self.execute = execute
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_pending = int(max_pending)
+        self.retry_after = retry_after
+        self.pending = 0
+        self._groups: Dict[Optional[str], List[Tuple[np.ndarray, asyncio.Future, float]]] = {}
+        self._timers: Dict[Optional[str], asyncio.TimerHandle] = {}
+        self._tasks = set()
+
+    async def submit(self, arr: np.ndarray, language: Optional[str] = None) -> Dict[str, Any]:
+        if self.pending >= self.max_pending:
+            raise QueueFullError(self.name, self.retry_after)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        group = self._groups.setdefault(language, [])
+        group.append((arr, fut, time.perf_counter()))
+        self.pending += 1
+        if len(group) >= self.max_batch_size:
+            self._flush(language)
+        elif language not in self._timers:
+            self._timers[language] = loop.call_later(self.max_wait, self._flush, language)
+        return await fut
+
+    def _flush(self, language: Optional[str]):
+        timer = self._timers.pop(language, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._groups.pop(language, [])
+        if items:
+            task = asyncio.ensure_future(self._run(items, language))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, items, language: Optional[str]):
+        started = time.perf_counter()
+        BATCH_SIZE.observe(len(items), model=self.name)
+        for _, _, enqueued in items:
+            BATCH_WAIT_SECONDS.observe(started - enqueued, model=self.name)
+        try:
+            results = await self.execute([arr for arr, _, _ in items], language)
+        except asyncio.CancelledError:
+            for _, fut, _ in items:
+                fut.cancel()
+            raise
+        except Exception as e:
+            for _, fut, _ in items:
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            for (_, fut, _), result in zip(items, results):
+                if not fut.done():
+                    fut.set_result(result)
+        finally:
+            self.pending -= len(items)
@@ -0,0 +1,118 @@
+"""
+This module resolves the decoding options passed to `model.transcribe` for a request.
+Options are merged from the global `decoding.defaults`, the model's own `decoding` entry, a named speed preset
+and finally the request's explicit values, then checked against server-side limits so clients cannot request
+arbitrarily expensive decoding (large beams, long temperature-fallback cascades).
+"""
+from typing import Any, Dict, Optional, Tuple
+
+# 允许客户端设置的解码参数 -> 类型
+DECODING_OPTIONS = {
+    "temperature": "temperature",
+    "beam_size": int,
+    "best_of": int,
+    "patience": float,
+    "length_penalty": float,
+    "condition_on_previous_text": bool,
+    "compression_ratio_threshold": float,
+    "logprob_threshold": float,
+    "no_speech_threshold": float,
+    "initial_prompt": str,
+    "fp16": bool,
+}
+
+DEFAULT_LIMITS = {
+    "max_beam_size": 5,
+    "max_best_of": 5,
+    "max_temperatures": 6,  # 温度回退序列的最大长度（whisper 默认为 6 个温度）
+}
+
+
+class DecodingOptionsError(ValueError):
+    """Raised when a request asks for an unknown preset or for options outside the server limits."""
+
+
+def parse_temperature(value) -> Tuple[float, ...]:
+    """
+    Parse a temperature or fallback cascade: 0.2, "0.2", "0,0.2,0.4" or [0, 0.2, 0.4].
+    """
+    if isinstance(value, str):
+        value = [v for v in value.replace(" ", "").split(",") if v]
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+    try:
+        temperatures = tuple(float(v) for v in value)
+    except (TypeError, ValueError):
+        raise DecodingOptionsError(f"Invalid temperature: {value}")
+    if not temperatures or any(t < 0 or t > 1 for t in temperatures):
+        raise DecodingOptionsError("temperature values must be between 0 and 1.")
+    return temperatures
+
+
+def _coerce(name: str, value):
+    kind = DECODING_OPTIONS[name]
+    if kind == "temperature":
+        return parse_temperature(value)
+    if kind is bool and isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise DecodingOptionsError(f"Invalid value for {name}: {value!r}")
+
+
+def _clean(options: Optional[Dict[str, Any]], source: str) -> Dict[str, Any]:
+    out = {}
+    for name, value in (options or {}).items():
+        if name not in DECODING_OPTIONS:
+            raise DecodingOptionsError(f"Unknown decoding option in {source}: {name}")
+        if value is not None:
+            out[name] = _coerce(name, value)
+    return out
+
+
+def resolve_decoding(config: Dict[str, Any], model_config: Dict[str, Any], preset: Optional[str] = None,
+                     overrides: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    Merge decoding options for one request and enforce the limits.
+
+    Args:
+        config (Dict[str, Any]): The `decoding` section of config.yaml (defaults, presets, default_preset, limits).
+        model_config (Dict[str, Any]): The model's entry; its optional `decoding` block may set `preset`,
+            `defaults` and `limits` for that model.
+        preset (Optional[str]): Preset requested by the client (falls back to the model's / global default preset).
+        overrides (Optional[Dict[str, Any]]): Explicit options from the request; None values are ignored.
+    Returns:
+        Tuple[Optional[str], Dict[str, Any]]: The preset used and the keyword options for `transcribe`.
+    Raises:
+        DecodingOptionsError: If the preset or an option is unknown, or a limit is exceeded.
+    """
+    model_decoding = model_config.get("decoding") or {}
+    presets = config.get("presets") or {}
+    preset = preset or model_decoding.get("preset") or config.get("default_preset")
+    if preset is not None and preset not in presets:
+        raise DecodingOptionsError(f"Unknown decoding preset: {preset}")
+
+    options = _clean(config.get("defaults"), "decoding.defaults")
+    options.update(_clean(model_decoding.get("defaults"), f"decoding of model {model_config.get('name')}"))
+    if preset is not None:
+        options.update(_clean(presets[preset], f"preset {preset}"))
+    options.update(_clean(overrides, "request"))
+
+    limits = {**DEFAULT_LIMITS, **(config.get("limits") or {}), **(model_decoding.get("limits") or {})}
+    for name, limit in (("beam_size", "max_beam_size"), ("best_of", "max_best_of")):
+        value = options.get(name)
+        if value is not None and value < 1:
+            raise DecodingOptionsError(f"{name} must be at least 1.")
+        if value is not None and limits.get(limit) is not None and value > limits[limit]:
+            raise DecodingOptionsError(f"{name}={value} exceeds the server limit of {limits[limit]}.")
+    temperatures = options.get("temperature")
+    if temperatures is not None:
+        if limits.get("max_temperatures") is not None and len(temperatures) > limits["max_temperatures"]:
+            raise DecodingOptionsError(
+                f"At most {limits['max_temperatures']} temperatures are allowed in the fallback cascade.")
+        # 单个温度即关闭回退
+        options["temperature"] = temperatures[0] if len(temperatures) == 1 else temperatures
+    if options.get("patience") is not None and options.get("beam_size") is None:
+        raise DecodingOptionsError("patience requires beam_size.")
+    return preset, options
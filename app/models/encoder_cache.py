@@ -0,0 +1,129 @@
+"""
+This module caches whisper encoder outputs so repeated decoder passes over the same 30 s window skip the encoder.
+Within one `transcribe` call the same window is encoded for language detection, for every temperature-fallback
+decode and again for word-timestamp alignment; a cache scope (one per request, or one per streaming session)
+is carried in a context variable and consulted by the model's patched encoder.
+Entries are keyed on the model name plus a hash of the mel input, and each scope is bounded in bytes (LRU).
+"""
+import contextlib
+import contextvars
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.utils.metrics import Counter
+
+ENCODER_CACHE_REQUESTS = Counter(
+    "whisper_encoder_cache_requests_total", "Encoder output cache lookups by model and result", ["model", "result"],
+)
+
+_scope: contextvars.ContextVar[Optional["EncoderCache"]] = contextvars.ContextVar("encoder_cache", default=None)
+
+
+class EncoderCache:
+    """
+    Bounded LRU cache of encoder outputs for one request or streaming session.
+
+    Args:
+        max_bytes (int): Memory budget of the cached outputs; least recently used entries are evicted beyond it.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> Optional["EncoderCache"]:
+        config = config or {}
+        if not config.get("enabled", False):
+            return None
+        return cls(max_bytes=int(config.get("max_mb", 32) * 1024 * 1024))
+
+    def get(self, key: Tuple[str, str]):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        ENCODER_CACHE_REQUESTS.inc(model=key[0], result="miss" if value is None else "hit")
+        return value
+
+    def put(self, key: Tuple[str, str], value):
+        size = value.numel() * value.element_size()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.bytes -= old.numel() * old.element_size()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+        }
+
+
+def _mel_key(mel) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((tuple(mel.shape), mel.dtype)).encode("utf-8"))
+    h.update(memoryview(np.ascontiguousarray(mel.detach().cpu().numpy())).cast("B"))
+    return h.hexdigest()
+
+
+def install(model, name: str):
+    """
+    Route a whisper PyTorch model's encoder through the encoder cache of the current scope (a plain forward
+    pass when no scope is active). Models of other backends are left untouched.
+    """
+    encoder = getattr(model, "encoder", None)
+    if encoder is None or not hasattr(encoder, "register_forward_hook"):
+        return
+    forward = encoder.forward
+
+    def cached_forward(mel):
+        cache = _scope.get()
+        if cache is None:
+            return forward(mel)
+        key = (name, _mel_key(mel))
+        output = cache.get(key)
+        if output is None:
+            output = forward(mel).detach()
+            cache.put(key, output)
+        return output
+
+    # nn.Module.__call__ 调用实例上的 forward，原有的计时钩子仍然生效
+    encoder.forward = cached_forward
+
+
+@contextlib.contextmanager
+def encoder_cache_scope(cache: Optional[EncoderCache]):
+    """
+    Use `cache` for encoder calls inside the block (including the worker thread started from it, via the
+    copied context). A no-op if `cache` is None.
+    """
+    if cache is None:
+        yield
+        return
+    token = _scope.set(cache)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
@@ -0,0 +1,163 @@
+"""
+This module dispatches blocking model inference off the asyncio event loop.
+It provides a lazily created thread/process pool and a bounded per-model queue that limits concurrency.
+"""
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+class QueueFullError(Exception):
+    """Raised when a model's waiting queue is full and the request must be rejected."""
+
+    def __init__(self, model: str, retry_after: int):
+        super().__init__(f"Model '{model}' is busy, please retry later.")
+        self.model = model
+        self.retry_after = retry_after
+
+
+class ModelQueue:
+    """
+    Admission gate for a single model: at most `concurrency` requests run at once
+    and at most `max_queue_size` wait for a slot; further requests fail fast.
+
+    All methods must be called from the event loop thread.
+    """
+
+    def __init__(self, name: str, concurrency: int = 1, max_queue_size: int = 8, retry_after: int = 5):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.max_queue_size = max(0, int(max_queue_size))
+        self.retry_after = int(retry_after)
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue_size:
+            raise QueueFullError(self.name, self.retry_after)
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 槽位已经交给了本请求，转交给下一个等待者
+                self.release()
+            elif fut in self._waiters:
+                # release() 可能已跳过并弹出这个已取消的 future
+                self._waiters.remove(fut)
+            raise
+
+    def release(self):
+        # 直接把槽位交给下一个等待者，active 数不变
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "max_queue_size": self.max_queue_size,
+        }
+
+
+class InferencePool:
+    """
+    Lazily created executor used for blocking inference calls.
+
+    Args:
+        kind (str): 'thread' or 'process'.
+        max_workers (Optional[int]): Pool size (executor default if None).
+        threads_per_worker (Optional[int]): torch intra-op threads per process worker
+            (default: CPU count divided by pool size, to avoid oversubscription).
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: Optional[int] = None,
+                 threads_per_worker: Optional[int] = None):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor type: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.threads_per_worker = threads_per_worker
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        # 延迟创建，避免在 fork 之前启动线程/进程
+        if self._executor is None:
+            if self.kind == "process":
+                workers = self.max_workers or os.cpu_count() or 1
+                threads = self.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+                # 使用 spawn，避免在已启动线程的进程中 fork
+                self._executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_process_worker,
+                    initargs=(threads,),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        if self.kind == "thread":
+            # 线程池中沿用调用方的 contextvars（例如请求级的阶段计时）
+            call = functools.partial(contextvars.copy_context().run, call)
+        return await loop.run_in_executor(self._get_executor(), call)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# 进程池模式下，每个子进程各自缓存已加载的模型
+_process_models: Dict[str, Any] = {}
+
+
+def _init_process_worker(threads: int):
+    import torch
+    torch.set_num_threads(threads)
+
+
+def _process_model(name: str, config: Dict[str, Any]):
+    model = _process_models.get(name)
+    if model is None:
+        from app.models.backends import load_backend
+        model = load_backend(name, config.get('backend', 'pytorch'), config.get('device', 'cpu'), config)
+        _process_models[name] = model
+    return model
+
+
+def process_transcribe(name: str, config: Dict[str, Any], arr, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Entry point executed inside a process-pool worker: load the model (with the backend from its
+    config entry) once per process and transcribe.
+    """
+    return _process_model(name, config).transcribe(arr, **options)
+
+
+def process_detect_language(name: str, config: Dict[str, Any], arr) -> Dict[str, Any]:
+    """
+    Language detection counterpart of `process_transcribe` for process-pool workers.
+    """
+    from app.models.language import detect_language
+    return detect_language(_process_model(name, config), arr)
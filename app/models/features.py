@@ -0,0 +1,195 @@
+"""
+This module computes whisper log-mel features inside the app so they can be reused instead of recomputed.
+The Hann window and mel filterbank are cached per device and `n_mels`, short clips are framed and transformed
+together in one batched FFT, and streaming sessions keep the mel frames of their buffer so each re-decode only transforms
+the audio that arrived since the previous one.
+"""
+import contextlib
+import contextvars
+import threading
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import whisper
+from whisper.audio import HOP_LENGTH, N_FFT, N_SAMPLES
+
+# 一帧覆盖中心前后各 N_FFT // 2 个采样点（torch.stft center=True）
+_HALF = N_FFT // 2
+
+# 批量提取时每组的条数，限制分帧矩阵的内存（每条 30 s 约 4.6 MB）
+_BATCH_GROUP = 8
+
+# 当前推理调用可直接使用的特征：(音频对象, 特征提取器)
+_precomputed: contextvars.ContextVar[Optional[Tuple[np.ndarray, "IncrementalLogMel"]]] = contextvars.ContextVar(
+    "precomputed_features", default=None,
+)
+
+
+@lru_cache(maxsize=None)
+def hann_window(device: str = "cpu") -> torch.Tensor:
+    return torch.hann_window(N_FFT, device=device)
+
+
+@lru_cache(maxsize=None)
+def mel_filters(n_mels: int, device: str = "cpu") -> torch.Tensor:
+    return whisper.audio.mel_filters(device, n_mels)
+
+
+def _mel_power(audio: torch.Tensor, n_mels: int, center: bool = True) -> torch.Tensor:
+    """
+    Mel power spectrum (before log compression) of 1D `audio`.
+    With `center=False` the caller supplies the padding and every full N_FFT frame is returned.
+    """
+    device = str(audio.device)
+    stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=hann_window(device), center=center, return_complex=True)
+    if center:
+        stft = stft[..., :-1]
+    return mel_filters(n_mels, device) @ (stft.abs() ** 2)
+
+
+def _batch_mel_power(batch: torch.Tensor, n_mels: int) -> torch.Tensor:
+    """
+    Mel power spectrum of equal-length clips `(batch, samples)`, framed with `unfold` and transformed by one
+    batched real FFT; on CPU this is faster than a batched `torch.stft`. Frames are materialized, so only use
+    it for bounded (30 s) clips.
+    """
+    device = str(batch.device)
+    padded = F.pad(batch[:, None], (_HALF, _HALF), mode="reflect")[:, 0]
+    frames = padded.unfold(-1, N_FFT, HOP_LENGTH)[:, :-1] * hann_window(device)
+    spectrum = torch.fft.rfft(frames, dim=-1)
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    return mel_filters(n_mels, device) @ power.transpose(-1, -2)
+
+
+def _log_compress(mel_spec: torch.Tensor) -> torch.Tensor:
+    # 与 whisper 相同: 按整段（批量时按每条）最大值截断动态范围
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+    peak = log_spec.amax(dim=(-2, -1), keepdim=True)
+    log_spec = torch.maximum(log_spec, peak - 8.0)
+    return (log_spec + 4.0) / 4.0
+
+
+def log_mel_spectrogram(audio: Union[str, np.ndarray, torch.Tensor], n_mels: int = 80, padding: int = 0,
+                        device: Optional[Union[str, torch.device]] = None) -> torch.Tensor:
+    """
+    Drop-in replacement for `whisper.log_mel_spectrogram` with cached window and filterbank. If features were
+    provided for this exact audio object with `precomputed_features()`, they are used instead.
+    """
+    pre = _precomputed.get()
+    if pre is not None and audio is pre[0] and device is None:
+        return pre[1](pre[0], n_mels, padding)
+    if not torch.is_tensor(audio):
+        if isinstance(audio, str):
+            audio = whisper.load_audio(audio)
+        audio = torch.from_numpy(audio)
+    if device is not None:
+        audio = audio.to(device)
+    if padding > 0:
+        audio = F.pad(audio, (0, padding))
+    return _log_compress(_mel_power(audio, n_mels))
+
+
+def log_mel_batch(arrs: List[np.ndarray], n_mels: int = 80) -> torch.Tensor:
+    """
+    Log-mel spectrograms of up to 30 s clips, each padded/trimmed to one 30 s window, framed and transformed
+    together (in groups of 8) instead of one STFT per clip.
+
+    Args:
+        arrs (List[np.ndarray]): 1D float32 arrays, 16kHz.
+        n_mels (int): Number of mel bins of the target model (`model.dims.n_mels`).
+    Returns:
+        torch.Tensor: `(len(arrs), n_mels, 3000)`, equal (to float rounding) to stacking
+        `whisper.log_mel_spectrogram(whisper.pad_or_trim(a))`.
+    """
+    batch = np.zeros((len(arrs), N_SAMPLES), dtype=np.float32)
+    for i, a in enumerate(arrs):
+        a = a[:N_SAMPLES]
+        batch[i, :len(a)] = a
+    batch = torch.from_numpy(batch)
+    power = torch.cat([_batch_mel_power(batch[i:i + _BATCH_GROUP], n_mels)
+                       for i in range(0, len(arrs), _BATCH_GROUP)])
+    return _log_compress(power)
+
+
+class IncrementalLogMel:
+    """
+    Log-mel features of a streaming buffer that only transform new audio.
+
+    Mel frames whose analysis window lies entirely inside the buffer do not change when audio is appended, so
+    they are kept (as mel power, before the per-window log normalization) across calls. Each call transforms
+    the frames that became complete since the last one plus the few frames straddling the end of the buffer;
+    frames over the zero padding whisper appends are zero and are never transformed. `trim()` keeps the frames
+    when the buffer start moves by a whole number of hops.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._n_mels: Optional[int] = None
+        self._frames: Optional[torch.Tensor] = None  # 缓冲区第 2 帧起已完整的帧（第 0、1 帧依赖左侧反射填充）
+
+    def trim(self, n_samples: int):
+        """
+        Drop the first `n_samples` of the buffer (call together with trimming the audio itself).
+        """
+        with self._lock:
+            if self._frames is None or n_samples == 0:
+                return
+            if n_samples % HOP_LENGTH:
+                self._frames = None
+                return
+            # 新的第 0、1 帧需要重新计算，其余帧整体前移
+            self._frames = self._frames[:, n_samples // HOP_LENGTH:]
+
+    def reset(self):
+        with self._lock:
+            self._frames = None
+
+    def __call__(self, audio: np.ndarray, n_mels: int = 80, padding: int = 0) -> torch.Tensor:
+        """
+        Log-mel spectrogram of `audio` followed by `padding` zeros, equal to
+        `whisper.log_mel_spectrogram(audio, n_mels, padding=padding)`.
+        """
+        n = len(audio)
+        total = (n + padding) // HOP_LENGTH
+        if n < 2 * HOP_LENGTH + N_FFT or padding < N_FFT:
+            return log_mel_spectrogram(torch.from_numpy(audio), n_mels, padding)
+        with self._lock:
+            if self._n_mels != n_mels:
+                self._n_mels, self._frames = n_mels, None
+            frames = self._frames if self._frames is not None else torch.zeros(n_mels, 0)
+            # 第 t 帧覆盖 [t*hop - half, t*hop + half)，完全落在缓冲区内的帧不再变化
+            complete = (n - _HALF) // HOP_LENGTH + 1
+            start = 2 + frames.shape[1]
+            x = torch.from_numpy(audio)
+            if start < complete:
+                segment = x[start * HOP_LENGTH - _HALF:(complete - 1) * HOP_LENGTH + _HALF]
+                frames = torch.cat([frames, _mel_power(segment, n_mels, center=False)], dim=1)
+            frames = frames[:, :complete - 2]
+            self._frames = frames
+        head = F.pad(x[:HOP_LENGTH + _HALF + 1][None, None], (_HALF, 0), mode="reflect")[0, 0]
+        head = _mel_power(head[:HOP_LENGTH + N_FFT], n_mels, center=False)
+        # 跨越缓冲区末尾的帧: 右侧补零计算
+        end = -(-(n + _HALF) // HOP_LENGTH)
+        tail = F.pad(x[complete * HOP_LENGTH - _HALF:], (0, (end - 1) * HOP_LENGTH + _HALF - n))
+        tail = _mel_power(tail, n_mels, center=False)
+        zeros = torch.zeros(n_mels, total - end)
+        return _log_compress(torch.cat([head, frames, tail, zeros], dim=1))
+
+
+@contextlib.contextmanager
+def precomputed_features(audio: np.ndarray, features: Optional[IncrementalLogMel]):
+    """
+    Let `log_mel_spectrogram` calls for `audio` inside the block (including in the worker thread started from
+    it, via the copied context) use `features` instead of recomputing the spectrogram.
+    """
+    if features is None:
+        yield
+        return
+    token = _precomputed.set((audio, features))
+    try:
+        yield
+    finally:
+        _precomputed.reset(token)
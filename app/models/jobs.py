@@ -0,0 +1,358 @@
+"""
+This module implements the persistent queue behind the asynchronous batch transcription jobs API.
+Jobs and their items are stored in SQLite (uploaded audio is spooled to disk), so queued work survives restarts;
+a fixed number of background workers drain the queue one item at a time and deliver completion webhooks.
+"""
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+
+from app.models.executor import QueueFullError
+
+# 条目与任务的终态
+TERMINAL = ("completed", "failed", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    model TEXT NOT NULL,
+    options TEXT NOT NULL,
+    webhook_url TEXT,
+    webhook_status TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS items (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, seq);
+CREATE INDEX IF NOT EXISTS items_job ON items (job_id, idx);
+"""
+
+
+class JobStore:
+    """
+    SQLite-backed store of jobs and their items. Each item is one audio input; `source` is either
+    a path to a spooled upload (under `data_dir`) or an http(s) URL.
+
+    All methods are blocking and thread-safe; call them through `run_in_threadpool` from async code.
+    """
+
+    def __init__(self, db_path: str, data_dir: str):
+        self.data_dir = data_dir
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        os.makedirs(data_dir, exist_ok=True)
+        self.db_path = db_path
+        self._conn = self._connect()
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def reopen(self):
+        """
+        Open a fresh connection in a forked worker process; a SQLite connection must not be used across fork.
+        """
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def recover(self) -> int:
+        """
+        Requeue items left 'running' by a previous process (crash or restart). Returns the number requeued.
+        """
+        with self._lock:
+            cur = self._conn.execute("UPDATE items SET status = 'queued' WHERE status = 'running'")
+            self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+            return cur.rowcount
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.data_dir, job_id)
+
+    def create(self, job_id: str, model: str, options: Dict[str, Any], sources: List[Dict[str, str]],
+               webhook_url: Optional[str] = None):
+        """
+        Insert a job with one queued item per source ({"name", "source"}).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, model, options, webhook_url, created_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, model, json.dumps(options), webhook_url, time.time()),
+            )
+            self._conn.executemany(
+                "INSERT INTO items (job_id, idx, name, source, status) VALUES (?, ?, ?, ?, 'queued')",
+                [(job_id, i, s.get("name"), s["source"]) for i, s in enumerate(sources)],
+            )
+            self._conn.execute("COMMIT")
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Atomically take the oldest queued item and mark it (and its job) running.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT i.seq, i.job_id, i.idx, i.source, j.model, j.options FROM items i "
+                "JOIN jobs j ON j.id = i.job_id WHERE i.status = 'queued' ORDER BY i.seq LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE items SET status = 'running' WHERE seq = ?", (row[0],))
+            self._conn.execute("UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'queued'", (row[1],))
+        return {"seq": row[0], "job_id": row[1], "idx": row[2], "source": row[3], "model": row[4],
+                "options": json.loads(row[5])}
+
+    def finish_item(self, seq: int, status: str, result: Optional[Dict[str, Any]] = None,
+                    error: Optional[str] = None) -> Optional[str]:
+        """
+        Record an item's outcome (ignored if the item was cancelled meanwhile). If this was the job's
+        last pending item, set the job's final status and return it; otherwise return None.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "UPDATE items SET status = ?, result = ?, error = ? WHERE seq = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, error, seq),
+            )
+            job_id = self._conn.execute("SELECT job_id FROM items WHERE seq = ?", (seq,)).fetchone()[0]
+            final = self._final_status(job_id)
+            if final is not None:
+                # 已被取消的任务不再改写状态（取消时已负责收尾）
+                cur = self._conn.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status != 'cancelled'",
+                    (final, time.time(), job_id),
+                )
+                if cur.rowcount == 0:
+                    final = None
+            self._conn.execute("COMMIT")
+        return final
+
+    def requeue_item(self, seq: int):
+        with self._lock:
+            self._conn.execute("UPDATE items SET status = 'queued' WHERE seq = ? AND status = 'running'", (seq,))
+
+    def _final_status(self, job_id: str) -> Optional[str]:
+        counts = dict(self._conn.execute(
+            "SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        if counts.get("queued") or counts.get("running"):
+            return None
+        # 只要有一个条目成功，任务即视为完成；条目级错误在结果中单独返回
+        return "completed" if counts.get("completed") else "failed"
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        Cancel all not-yet-finished items of a job. Returns the job's resulting status, or None if unknown.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] in TERMINAL:
+                return row[0]
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "UPDATE items SET status = 'cancelled' WHERE job_id = ? AND status IN ('queued', 'running')",
+                (job_id,),
+            )
+            self._conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?",
+                               (time.time(), job_id))
+            self._conn.execute("COMMIT")
+        return "cancelled"
+
+    def get(self, job_id: str, include_results: bool = True) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT id, status, model, options, webhook_url, webhook_status, created_at, finished_at "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            items = self._conn.execute(
+                "SELECT idx, name, status, result, error FROM items WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        counts: Dict[str, int] = {}
+        for item in items:
+            counts[item[2]] = counts.get(item[2], 0) + 1
+        out = {
+            "id": job[0],
+            "status": job[1],
+            "model": job[2],
+            "options": json.loads(job[3]),
+            "webhook_url": job[4],
+            "webhook_status": job[5],
+            "created_at": job[6],
+            "finished_at": job[7],
+            "progress": {"total": len(items), **counts},
+        }
+        if include_results:
+            out["items"] = [
+                {"index": i[0], "name": i[1], "status": i[2], "result": json.loads(i[3]) if i[3] else None,
+                 "error": i[4]}
+                for i in items
+            ]
+        return out
+
+    def set_webhook_status(self, job_id: str, status: str):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET webhook_status = ? WHERE id = ?", (status, job_id))
+
+    def pending_webhooks(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE webhook_url IS NOT NULL AND webhook_status IS NULL "
+                "AND status IN ('completed', 'failed', 'cancelled')"
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def cleanup(self, job_id: str):
+        # 任务结束后删除落盘的上传音频
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobWorkers:
+    """
+    Background workers that drain a JobStore, sharing the ModelManager with the live endpoints.
+
+    Args:
+        store (JobStore): Persistent job store.
+        execute (Callable): `await execute(item)` returns a JSON-serializable result for one claimed item.
+        workers (int): Number of items processed concurrently.
+        poll_interval (float): Seconds to sleep when the queue is empty (new submissions wake workers immediately).
+        webhook_timeout (float): Timeout for each webhook delivery attempt.
+        webhook_retries (int): Delivery attempts before giving up.
+    """
+
+    def __init__(self, store: JobStore, execute: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                 workers: int = 2, poll_interval: float = 1.0, webhook_timeout: float = 10.0,
+                 webhook_retries: int = 3):
+        self.store = store
+        self.execute = execute
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = max(1, int(webhook_retries))
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[int, asyncio.Task] = {}  # item seq -> 正在执行的任务
+        self._background: set = set()
+        # 多进程服务时只由一个进程负责恢复中断的条目与补发回调
+        self.recover_on_start = True
+        self.resume_webhooks_on_start = True
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        if self.recover_on_start:
+            requeued = self.store.recover()
+            if requeued:
+                print(f"Requeued {requeued} interrupted job items")
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        if self.resume_webhooks_on_start:
+            for job_id in self.store.pending_webhooks():
+                self._spawn(self._deliver_webhook(job_id))
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def cancel(self, job_id: str) -> Optional[str]:
+        status = await run_in_threadpool(self.store.cancel, job_id)
+        if status == "cancelled":
+            for task in [t for t in self._running.values() if getattr(t, "job_id", None) == job_id]:
+                task.cancel()
+            self._spawn(self._finalize(job_id))
+        return status
+
+    async def _worker(self):
+        while True:
+            item = await run_in_threadpool(self.store.claim)
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.ensure_future(self.execute(item))
+            task.job_id = item["job_id"]
+            self._running[item["seq"]] = task
+            try:
+                result = await task
+                final = await run_in_threadpool(self.store.finish_item, item["seq"], "completed", result)
+            except QueueFullError as e:
+                # 实时请求占满了模型队列: 放回队列，稍后重试，不计为失败
+                await run_in_threadpool(self.store.requeue_item, item["seq"])
+                await asyncio.sleep(e.retry_after)
+                continue
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    # worker 本身被取消（服务关闭）: 条目保持 running，重启后由 recover 重新排队
+                    raise
+                continue
+            except Exception as e:
+                final = await run_in_threadpool(self.store.finish_item, item["seq"], "failed", None, str(e))
+            finally:
+                self._running.pop(item["seq"], None)
+            if final is not None:
+                # webhook 投递（含重试与退避）在后台进行，不占用 worker 处理队列
+                self._spawn(self._finalize(item["job_id"]))
+
+    async def _finalize(self, job_id: str):
+        await run_in_threadpool(self.store.cleanup, job_id)
+        await self._deliver_webhook(job_id)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _deliver_webhook(self, job_id: str):
+        job = await run_in_threadpool(self.store.get, job_id)
+        if job is None or not job["webhook_url"]:
+            return
+        status = "failed"
+        async with httpx.AsyncClient(timeout=self.webhook_timeout) as client:
+            for attempt in range(self.webhook_retries):
+                try:
+                    resp = await client.post(job["webhook_url"], json=job)
+                    if resp.status_code < 400:
+                        status = "delivered"
+                        break
+                except httpx.HTTPError as e:
+                    print(f"Webhook for job {job_id} failed: {e}")
+                # 只在两次尝试之间退避，最后一次失败后立即记录状态
+                if attempt + 1 < self.webhook_retries:
+                    await asyncio.sleep(2 ** attempt)
+        await run_in_threadpool(self.store.set_webhook_status, job_id, status)
+
+    async def shutdown(self):
+        for task in self._tasks + list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._background, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,52 @@
+"""
+This module implements spoken-language detection from a single 30 s log-mel window.
+It runs one encoder pass plus one decoder step, instead of letting every `transcribe` call detect the language
+on its own, so the result can be computed once (with the smallest suitable model) and reused.
+"""
+from typing import Any, Dict
+
+import numpy as np
+import whisper
+
+from app.models.features import log_mel_batch
+from app.utils.timing import timed_stage
+
+# 检测只使用开头的一个 30 s 窗口
+DETECTION_SAMPLES = whisper.audio.N_SAMPLES
+
+
+class LanguageDetectionError(Exception):
+    """Raised when the selected model cannot detect the spoken language."""
+
+
+def supports_language_detection(model) -> bool:
+    """
+    Only multilingual whisper PyTorch models can detect the language (not `.en` models or other backends).
+    """
+    return hasattr(model, "detect_language") and getattr(model, "is_multilingual", False)
+
+
+def detect_language(model, arr: np.ndarray, top_k: int = 5) -> Dict[str, Any]:
+    """
+    Detect the language of the first 30 s of `arr`.
+
+    Args:
+        model: Loaded multilingual whisper model.
+        arr (np.ndarray): 1D float32 audio, 16kHz.
+        top_k (int): Number of most likely languages to return.
+    Returns:
+        Dict[str, Any]: {"language", "probability", "languages": {code: probability}} (top_k entries).
+    Raises:
+        LanguageDetectionError: If the model cannot detect the language.
+    """
+    if not supports_language_detection(model):
+        raise LanguageDetectionError("The selected model cannot detect the language (English-only or non-PyTorch backend).")
+    with timed_stage("mel"):
+        mel = log_mel_batch([arr], model.dims.n_mels)[0].to(model.device)
+    _, probs = model.detect_language(mel)
+    top = sorted(probs.items(), key=lambda kv: kv[1], reverse=True)[:top_k]
+    return {
+        "language": top[0][0],
+        "probability": round(float(top[0][1]), 4),
+        "languages": {code: round(float(p), 4) for code, p in top},
+    }
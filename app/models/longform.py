@@ -0,0 +1,147 @@
+"""
+This module implements the long-form transcription pipeline.
+Long recordings are split at silence boundaries into windows of at most ~30 s, transcribed in parallel,
+and stitched back into one ordered result with absolute timestamps and de-duplicated overlap text.
+"""
+import re
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME = 480  # 30 ms 能量帧
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def plan_chunks(
+    audio: np.ndarray,
+    chunk_seconds: float = 30.0,
+    search_seconds: float = 5.0,
+    overlap_seconds: float = 1.0,
+    silence_db: float = -40.0,
+) -> List[Tuple[int, int]]:
+    """
+    Choose chunk boundaries for long audio, preferring the quietest point near each chunk end.
+
+    Each chunk is at most `chunk_seconds` long. The cut is placed at the lowest-energy frame within the last
+    `search_seconds` of the chunk; if that frame is not silent (above `silence_db`), the chunk is cut hard and
+    the next one starts `overlap_seconds` earlier so that words on the boundary are not lost.
+
+    Args:
+        audio (np.ndarray): 1D float32 audio, 16kHz.
+    Returns:
+        List[Tuple[int, int]]: (start_sample, end_sample) per chunk, in order (may overlap).
+    """
+    n = len(audio)
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    search = int(search_seconds * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    frames = audio[:n // FRAME * FRAME].reshape(-1, FRAME)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+    chunks: List[Tuple[int, int]] = []
+    start = 0
+    while start < n:
+        if n - start <= chunk:
+            chunks.append((start, n))
+            break
+        lo, hi = (start + chunk - search) // FRAME, (start + chunk) // FRAME
+        best = lo + int(np.argmin(energy_db[lo:hi])) if hi > lo else hi
+        if hi > lo and energy_db[best] < silence_db:
+            cut = best * FRAME + FRAME // 2
+            chunks.append((start, cut))
+            start = cut
+        else:
+            end = start + chunk
+            chunks.append((start, end))
+            start = end - overlap
+    return chunks
+
+
+def _dedupe_overlap(previous: str, current: str, max_words: int = 8) -> str:
+    """
+    Drop the longest run of leading words in `current` that repeats the trailing words of `previous`.
+    """
+    prev_words = [_normalize(w) for w in previous.split()]
+    cur_words = current.split()
+    cur_norm = [_normalize(w) for w in cur_words]
+    for k in range(min(max_words, len(prev_words), len(cur_words)), 0, -1):
+        if prev_words[-k:] == cur_norm[:k]:
+            return (" " + " ".join(cur_words[k:])) if k < len(cur_words) else ""
+    return current
+
+
+class SegmentStitcher:
+    """
+    Incrementally merge per-chunk `transcribe` results, in chunk order, onto the absolute timeline.
+    Segments that fall entirely inside an overlap already covered by the previous chunk are dropped and
+    repeated words at the boundary are removed.
+    """
+
+    def __init__(self):
+        self.segments: List[Dict[str, Any]] = []
+        self.languages: Counter = Counter()
+        self._last_end = 0.0
+
+    def add(self, result: Dict[str, Any], start: int) -> List[Dict[str, Any]]:
+        """
+        Add the result of the chunk starting at sample `start` and return the segments it contributed.
+        """
+        offset = start / SAMPLE_RATE
+        added: List[Dict[str, Any]] = []
+        if result.get("language"):
+            self.languages[result["language"]] += 1
+        for seg in result.get("segments", []):
+            seg = dict(seg)
+            seg["start"] = round(seg["start"] + offset, 3)
+            seg["end"] = round(seg["end"] + offset, 3)
+            if seg.get("words"):
+                seg["words"] = [
+                    dict(w, start=round(w["start"] + offset, 3), end=round(w["end"] + offset, 3))
+                    for w in seg["words"]
+                ]
+            if self.segments and seg["end"] <= self._last_end:
+                # 完全落在上一分片已覆盖的重叠区内
+                continue
+            if self.segments and seg["start"] < self._last_end:
+                seg["text"] = _dedupe_overlap(self.segments[-1]["text"], seg["text"])
+                if seg.get("words"):
+                    seg["words"] = [w for w in seg["words"] if w["start"] >= self._last_end]
+            if not seg["text"].strip():
+                continue
+            seg["id"] = len(self.segments)
+            self.segments.append(seg)
+            added.append(seg)
+            self._last_end = seg["end"]
+        return added
+
+    @property
+    def language(self):
+        return self.languages.most_common(1)[0][0] if self.languages else None
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            "text": "".join(seg["text"] for seg in self.segments),
+            "segments": self.segments,
+            "language": self.language,
+        }
+
+
+def stitch_results(results: List[Dict[str, Any]], chunks: List[Tuple[int, int]]) -> Dict[str, Any]:
+    """
+    Merge per-chunk `transcribe` results into one result on the absolute timeline.
+
+    Args:
+        results (List[Dict[str, Any]]): One result per chunk, in chunk order.
+        chunks (List[Tuple[int, int]]): Chunk boundaries returned by `plan_chunks`.
+    Returns:
+        Dict[str, Any]: Result with 'text', 'segments' and 'language' like `model.transcribe`.
+    """
+    stitcher = SegmentStitcher()
+    for (start, _), result in zip(chunks, results):
+        stitcher.add(result, start)
+    return stitcher.result()
@@ -1,37 +1,515 @@
 """
 This module manages the loading and retrieval of transcription models.
-It reads model configurations, loads models into memory, and provides access to them for API endpoints.
+It reads model configurations, loads models on demand (with an optional memory budget and LRU eviction),
+and provides access to them for API endpoints.
+Inference is dispatched to a worker pool behind a bounded per-model queue.
 """
+import asyncio
+import contextlib
+import gc
 import os
+import threading
+import time
 import yaml
-from typing import Dict, Any
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 import whisper
 
+from app.models.backends import BACKENDS, load_backend
+from app.models.encoder_cache import EncoderCache, encoder_cache_scope, install as install_encoder_cache
+from app.models.executor import InferencePool, ModelQueue, process_detect_language, process_transcribe
+from app.models.features import IncrementalLogMel, precomputed_features
+from app.models.language import DETECTION_SAMPLES, detect_language, supports_language_detection
+from app.models.batching import BatchScheduler, batchable, transcribe_batch
+from app.models.decoding import resolve_decoding
+from app.models.longform import plan_chunks, stitch_results
+from app.utils.timing import RequestTiming, instrument_model, timed_stage
+
+
+class ModelLoadError(Exception):
+    """Raised when a configured model cannot be loaded."""
+
+
+def model_memory_bytes(model) -> int:
+    """
+    Return the memory occupied by a model's weights, in bytes (0 for non-PyTorch backends).
+    """
+    if not hasattr(model, "state_dict"):
+        return 0
+
+    def size(value) -> int:
+        # 动态量化层的权重以 (packed weight, bias) 元组形式保存在 state_dict 中
+        if isinstance(value, (tuple, list)):
+            return sum(size(v) for v in value)
+        if hasattr(value, "element_size"):
+            return value.numel() * value.element_size()
+        return 0
+
+    return sum(size(v) for v in model.state_dict().values())
+
+
 class ModelManager:
     def __init__(self, config_path: str):
-        self.models: Dict[str, Any] = {}
+        self.models: "OrderedDict[str, Any]" = OrderedDict()  # 已加载模型，按最近使用排序
+        self.queues: Dict[str, ModelQueue] = {}
+        self.batchers: Dict[str, BatchScheduler] = {}
+        self.states: Dict[str, str] = {}
+        self.memory: Dict[str, int] = {}
+        self.last_used: Dict[str, float] = {}
+        self._in_use: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
         self.load_config(config_path)
 
     def load_config(self, config_path: str):
         with open(config_path, 'r') as f:
             config = yaml.safe_load(f)
+        self.config = config
         self.api_config = config.get('api', {})
         self.model_configs = config.get('models', [])
+        self.concurrency = config.get('concurrency', 1)
+        self.max_queue_size = config.get('max_queue_size', 8)
+        self.retry_after = config.get('retry_after', 5)
+        self.pool = InferencePool(config.get('executor', 'thread'), config.get('executor_workers'))
+        self.batching = config.get('batching') or {}
+        self.vad_config = config.get('vad') or {}
+        self.long_form = config.get('long_form') or {}
+        self.decoding = config.get('decoding') or {}
+        self.language_detection = config.get('language_detection') or {}
+        self.encoder_cache = config.get('encoder_cache') or {}
+        self.long_form_pool = InferencePool(
+            self.long_form.get('executor', 'process'),
+            self.long_form.get('workers'),
+            self.long_form.get('threads_per_worker'),
+        )
+        detector = self.language_detection.get('model')
+        if detector and detector not in {m['name'] for m in self.model_configs}:
+            raise ValueError(f"language_detection.model is not a configured model: {detector}")
+        budget_mb = config.get('memory_budget_mb')
+        self.memory_budget = int(budget_mb * 1024 * 1024) if budget_mb else None
+        for m in self.model_configs:
+            name = m['name']
+            if m.get('backend', 'pytorch') not in BACKENDS:
+                raise ValueError(f"Unknown backend for model {name}: {m['backend']}")
+            # 启动时校验解码预设与限制，配置错误尽早暴露
+            resolve_decoding(self.decoding, m)
+            self.states[name] = "unloaded"
+            self._in_use[name] = 0
+            self._load_locks[name] = threading.Lock()
+            concurrency = m.get('concurrency', self.concurrency)
+            if self.pool.kind == "thread" and concurrency > 1:
+                # 线程池中所有请求共用同一个模型实例，whisper 的 kv-cache/对齐钩子挂在共享模块上，并发推理会互相破坏
+                print(f"Model {name}: concurrency {concurrency} requires executor: process, using 1")
+                concurrency = 1
+            self.queues[name] = ModelQueue(
+                name,
+                concurrency=concurrency,
+                max_queue_size=m.get('max_queue_size', self.max_queue_size),
+                retry_after=m.get('retry_after', self.retry_after),
+            )
+            batching = m.get('batching', self.batching)
+            # 批量解码依赖 whisper 的 PyTorch 模型
+            if batching and self.pool.kind == "thread" and m.get('backend', 'pytorch') != "ctranslate2":
+                self.batchers[name] = self._make_batcher(name, batching)
         self.load_models()
 
     def load_models(self):
+        # 只预加载 preload/pinned 的模型，其余模型在首次请求时按需加载
+        if self.pool.kind == "process":
+            return
         for m in self.model_configs:
-            name = m['name']
-            device = m.get('device', 'cpu')
-            try:
-                model = whisper.load_model(name, device=device)
+            if m.get('preload') or m.get('pinned'):
+                self.get_model(m['name'])
+
+    def prepare_fork(self):
+        """
+        Load every configured model and make the weights read-only before worker processes are forked, so the
+        tensor memory stays shared copy-on-write between workers (models loaded later are per worker).
+        """
+        for m in self.model_configs:
+            self.get_model(m['name'])
+        with self._lock:
+            for model in self.models.values():
+                if hasattr(model, "parameters"):
+                    model.eval()
+                    # 关闭梯度，避免推理时写入 .grad 或版本计数导致共享页被复制
+                    for param in model.parameters():
+                        param.requires_grad_(False)
+
+    def new_encoder_cache(self) -> Optional[EncoderCache]:
+        """
+        A fresh encoder output cache scope (per request or per streaming session), or None if disabled.
+        """
+        return EncoderCache.from_config(self.encoder_cache)
+
+    def decoding_options(self, name: str, preset: Optional[str] = None,
+                         overrides: Optional[Dict[str, Any]] = None):
+        """
+        Resolve the decoding options of a request for model `name`; returns (preset, options).
+
+        Raises:
+            DecodingOptionsError: If the preset or an option is invalid or exceeds the limits.
+        """
+        return resolve_decoding(self.decoding, self.get_model_config(name), preset, overrides)
+
+    def cost_factor(self, name: str) -> float:
+        """
+        Relative cost of one audio second on model `name` for admission control (`cost_factor`, default 1).
+        """
+        return float(self.get_model_config(name).get('cost_factor', 1.0))
+
+    def has_model(self, name: str) -> bool:
+        return name in self.states
+
+    def get_model_config(self, name: str) -> Dict[str, Any]:
+        for m in self.model_configs:
+            if m['name'] == name:
+                return m
+        return {}
+
+    def get_model(self, name: str, _checkout: bool = False):
+        """
+        Return the loaded model, loading it on first use. Concurrent loads of the same model
+        are coalesced into one. Returns None if the model is not configured or fails to load.
+        """
+        if name not in self.states:
+            return None
+        model = self._lookup(name, _checkout)
+        if model is not None:
+            return model
+        with self._load_locks[name]:
+            model = self._lookup(name, _checkout)
+            if model is not None:
+                return model
+            model = self._load(name)
+            if model is None:
+                return None
+            with self._lock:
                 self.models[name] = model
-                print(f"Loaded model: {name} on {device}")
-            except Exception as e:
-                print(f"Failed to load model {name} on {device}: {e}")
+                self.states[name] = "loaded"
+                self.last_used[name] = time.time()
+                if _checkout:
+                    self._in_use[name] += 1
+                self._evict(0, keep=name)
+            return model
+
+    def _lookup(self, name: str, checkout: bool):
+        with self._lock:
+            model = self.models.get(name)
+            if model is not None:
+                self.models.move_to_end(name)
+                self.last_used[name] = time.time()
+                if checkout:
+                    self._in_use[name] += 1
+            return model
+
+    def _estimate_memory(self, name: str) -> int:
+        if name in self.memory:
+            return self.memory[name]
+        # 未加载过的模型用 checkpoint 文件大小估算
+        cache = os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        path = os.path.join(cache, "whisper", f"{name}.pt")
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _load(self, name: str):
+        config = self.get_model_config(name)
+        device = config.get('device', 'cpu')
+        backend = config.get('backend', 'pytorch')
+        with self._lock:
+            self.states[name] = "loading"
+            self._evict(self._estimate_memory(name))
+        try:
+            start = time.time()
+            model = load_backend(name, backend, device, config)
+        except Exception as e:
+            print(f"Failed to load model {name} ({backend}) on {device}: {e}")
+            with self._lock:
+                self.states[name] = "failed"
+            return None
+        self.memory[name] = model_memory_bytes(model)
+        instrument_model(model)
+        install_encoder_cache(model, name)
+        print(f"Loaded model: {name} ({backend}) on {device} ({self.memory[name] / 2**20:.0f} MB, {time.time() - start:.1f}s)")
+        return model
+
+    def _evict(self, incoming: int, keep: Optional[str] = None):
+        """
+        Evict least-recently-used models (never pinned or in-use ones) until `incoming`
+        more bytes fit in the memory budget. Must be called with `self._lock` held.
+        """
+        if self.memory_budget is None:
+            return
+        used = sum(self.memory.get(n, 0) for n in self.models)
+        evicted = False
+        for name in list(self.models):
+            if used + incoming <= self.memory_budget:
+                break
+            if name == keep or self._in_use[name] or self.get_model_config(name).get('pinned'):
+                continue
+            del self.models[name]
+            self.states[name] = "evicted"
+            used -= self.memory.get(name, 0)
+            evicted = True
+            print(f"Evicted model: {name}")
+        if evicted:
+            gc.collect()
+
+    @contextlib.asynccontextmanager
+    async def use_model(self, name: str):
+        """
+        Load (if needed) and hold a model for the duration of the block so it cannot be evicted.
+
+        Raises:
+            ModelLoadError: If the model is not configured or fails to load.
+        """
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(None, self.get_model, name, True)
+        try:
+            model = await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            # 加载仍在后台进行，完成后归还引用
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception() or f.result() is None or self._checkin(name))
+            raise
+        if model is None:
+            raise ModelLoadError(f"Model '{name}' could not be loaded.")
+        try:
+            yield model
+        finally:
+            self._checkin(name)
+
+    def _checkin(self, name: str):
+        with self._lock:
+            self._in_use[name] -= 1
+
+    def _make_batcher(self, name: str, batching: Dict[str, Any]) -> BatchScheduler:
+        queue = self.queues[name]
+
+        async def execute(arrs, language):
+            # 批次在独立任务中执行，阶段耗时按批次（input=batch）统计
+            timing = RequestTiming(name, "batch")
+            timing.activate()
+            with timing.stage("queue"):
+                await queue.acquire()
+            try:
+                async with self.use_model(name) as model:
+                    with timing.stage("inference"):
+                        results = await self.pool.run(transcribe_batch, model, arrs, language)
+            finally:
+                queue.release()
+            timing.finish(sum(len(a) for a in arrs) / whisper.audio.SAMPLE_RATE)
+            return results
+
+        max_batch_size = batching.get('max_batch_size', 8)
+        return BatchScheduler(
+            name,
+            execute,
+            max_batch_size=max_batch_size,
+            max_wait_ms=batching.get('max_wait_ms', 20),
+            max_pending=batching.get('max_pending', max_batch_size * max(1, queue.max_queue_size)),
+            retry_after=queue.retry_after,
+        )
+
+    async def transcribe(self, name: str, arr, features: Optional[IncrementalLogMel] = None,
+                         encoder_cache: Optional[EncoderCache] = None, **options) -> Dict[str, Any]:
+        """
+        Run `model.transcribe` in the worker pool, respecting the model's concurrency limit.
+        Clips of at most 30 s with greedy decoding options are routed through the model's batch scheduler
+        when batching is enabled. `features` (e.g. a streaming session's) supplies the log-mel spectrogram of
+        `arr` in the thread pool instead of recomputing it. Encoder outputs are cached in `encoder_cache`
+        (e.g. a streaming session's), else in a scope for this call when `encoder_cache.enabled` is set.
+
+        Raises:
+            KeyError: If the model is not configured.
+            QueueFullError: If the model's waiting queue is full.
+            ModelLoadError: If the model fails to load.
+        """
+        queue = self.queues[name]
+        batcher = self.batchers.get(name)
+        if batcher is not None and batchable(options) and len(arr) <= whisper.audio.N_SAMPLES:
+            with timed_stage("inference"):
+                return await batcher.submit(arr, options.get('language'))
+        with timed_stage("queue"):
+            await queue.acquire()
+        try:
+            if self.pool.kind == "process":
+                with timed_stage("inference"):
+                    return await self.pool.run(process_transcribe, name, self.get_model_config(name), arr, options)
+            async with self.use_model(name) as model:
+                with timed_stage("inference"), precomputed_features(arr, features), \
+                        encoder_cache_scope(encoder_cache or self.new_encoder_cache()):
+                    return await self.pool.run(model.transcribe, arr, **options)
+        finally:
+            queue.release()
+
+    def auto_detect_language(self, name: str) -> bool:
+        """
+        Whether requests for model `name` without a language go through the language-detection fast path
+        (`language_detection.enabled`; English-only models never need it).
+        """
+        return bool(self.language_detection.get('enabled')) and not name.endswith(".en")
+
+    def language_detector(self, fallback: Optional[str] = None) -> Optional[str]:
+        """
+        Name of the model used for language detection: `language_detection.model` if configured, else the
+        smallest loaded multilingual model, else `fallback`, else the first configured multilingual PyTorch model.
+        """
+        configured = self.language_detection.get('model')
+        if configured:
+            return configured
+        with self._lock:
+            candidates = [(self.memory.get(name, 0), name) for name, model in self.models.items()
+                          if supports_language_detection(model)]
+        if candidates:
+            return min(candidates)[1]
+        if fallback is not None:
+            return fallback
+        for m in self.model_configs:
+            if not m['name'].endswith(".en") and m.get('backend', 'pytorch') != "ctranslate2":
+                return m['name']
+        return None
+
+    async def detect_language(self, arr, model: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Detect the spoken language from the first 30 s of `arr` with `model` (default: `language_detector()`),
+        through the same queue and worker pool as transcription. The result includes the model used.
+
+        Raises:
+            KeyError: If the model is not configured.
+            QueueFullError: If the model's waiting queue is full.
+            ModelLoadError: If the model fails to load.
+            LanguageDetectionError: If the model cannot detect the language.
+        """
+        name = model or self.language_detector()
+        if name is None:
+            raise KeyError("No model available for language detection.")
+        arr = arr[:DETECTION_SAMPLES]
+        queue = self.queues[name]
+        with timed_stage("queue"):
+            await queue.acquire()
+        try:
+            with timed_stage("language_detection"):
+                if self.pool.kind == "process":
+                    result = await self.pool.run(process_detect_language, name, self.get_model_config(name), arr)
+                else:
+                    async with self.use_model(name) as m:
+                        result = await self.pool.run(detect_language, m, arr)
+        finally:
+            queue.release()
+        return dict(result, model=name)
+
+    def use_long_form(self, arr, requested: Optional[bool] = None) -> bool:
+        """
+        Decide whether a request should use the long-form pipeline (explicit flag or duration threshold).
+        """
+        if requested is not None:
+            return requested
+        threshold = self.long_form.get('min_duration_seconds', 300)
+        return bool(self.long_form.get('enabled')) and len(arr) >= threshold * whisper.audio.SAMPLE_RATE
+
+    async def transcribe_long(self, name: str, arr, **options) -> Dict[str, Any]:
+        """
+        Split long audio at silence into <=30 s chunks, transcribe them in parallel in the long-form
+        process pool (one after another with a thread pool, which shares one model instance) and stitch the
+        results back together with absolute timestamps.
+
+        Raises:
+            KeyError: If the model is not configured.
+            QueueFullError: If the model's waiting queue is full.
+        """
+        chunks = plan_chunks(
+            arr,
+            chunk_seconds=self.long_form.get('chunk_seconds', 30),
+            overlap_seconds=self.long_form.get('overlap_seconds', 1),
+        )
+        config = self.get_model_config(name)
+        queue = self.queues[name]
+        with timed_stage("queue"):
+            await queue.acquire()
+        try:
+            if self.long_form_pool.kind == "process":
+                with timed_stage("inference"):
+                    results = await asyncio.gather(*[
+                        self.long_form_pool.run(process_transcribe, name, config, arr[s:e], options)
+                        for s, e in chunks
+                    ])
+            else:
+                # 线程池共用同一个模型实例，分片只能逐个推理（并行需要 process 池）
+                async with self.use_model(name) as model:
+                    with timed_stage("inference"), encoder_cache_scope(self.new_encoder_cache()):
+                        results = []
+                        for s, e in chunks:
+                            results.append(await self.long_form_pool.run(model.transcribe, arr[s:e], **options))
+        finally:
+            queue.release()
+        return stitch_results(results, chunks)
+
+    async def transcribe_windows(self, name: str, arr, long_form: bool = False,
+                                 **options) -> AsyncIterator[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        """
+        Transcribe audio window by window (<=30 s, cut at silence) and yield `((start, end), result)` for each
+        window in order as soon as it is done, so callers can emit segments before the whole file finishes.
+        Windows run one after another in the inference pool, or in the long-form pool when `long_form` is set
+        (in parallel only if it is a process pool). Feed the results to a `SegmentStitcher` to get absolute timestamps.
+
+        Raises:
+            KeyError: If the model is not configured.
+            QueueFullError: If the model's waiting queue is full.
+            ModelLoadError: If the model fails to load.
+        """
+        chunks = plan_chunks(
+            arr,
+            chunk_seconds=min(30, self.long_form.get('chunk_seconds', 30)),
+            overlap_seconds=self.long_form.get('overlap_seconds', 1),
+        )
+        pool = self.long_form_pool if long_form else self.pool
+        queue = self.queues[name]
+        with timed_stage("queue"):
+            await queue.acquire()
+        tasks = []
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                if pool.kind == "process":
+                    config = self.get_model_config(name)
+
+                    def run(window):
+                        return pool.run(process_transcribe, name, config, window, options)
+                else:
+                    model = await stack.enter_async_context(self.use_model(name))
+                    encoder_cache = self.new_encoder_cache()
+
+                    async def run(window):
+                        # 生成器的每一步可能在不同的任务上下文中执行，缓存作用域只包住单次推理
+                        with encoder_cache_scope(encoder_cache):
+                            return await pool.run(model.transcribe, window, **options)
+                # 只有进程池可以并行推理各窗口；线程池共用同一个模型实例，窗口逐个推理
+                parallel = long_form and pool.kind == "process"
+                if parallel:
+                    tasks = [asyncio.ensure_future(run(arr[s:e])) for s, e in chunks]
+                for i, (s, e) in enumerate(chunks):
+                    with timed_stage("inference"):
+                        result = await (tasks[i] if parallel else run(arr[s:e]))
+                    yield (s, e), result
+        finally:
+            # 客户端提前断开时取消尚未开始的分片
+            for task in tasks:
+                task.cancel()
+            queue.release()
 
-    def get_model(self, name: str):
-        return self.models.get(name)
+    def shutdown(self):
+        self.pool.shutdown()
+        self.long_form_pool.shutdown()
 
     def list_models(self):
-        return list(self.models.keys()) 
\ No newline at end of file
+        with self._lock:
+            return [
+                {
+                    "name": m['name'],
+                    "device": m.get('device', 'cpu'),
+                    "backend": m.get('backend', 'pytorch'),
+                    "state": self.states[m['name']],
+                    "pinned": bool(m.get('pinned')),
+                    "memory_mb": round(self.memory[m['name']] / 2**20, 1) if m['name'] in self.models else 0,
+                    "last_used": self.last_used.get(m['name']),
+                }
+                for m in self.model_configs
+            ]
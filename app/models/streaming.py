@@ -0,0 +1,294 @@
+"""
+This module implements incremental streaming transcription for WebSocket sessions.
+Each session keeps a rolling buffer of not-yet-committed audio, re-decodes only that unstable tail,
+and commits words once two consecutive hypotheses agree on them (local agreement).
+Received audio reaches the session's inference task through a bounded backlog that coalesces whatever
+arrived during the previous re-decode into the next one.
+"""
+import asyncio
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.encoder_cache import EncoderCache
+from app.models.features import HOP_LENGTH, IncrementalLogMel
+from app.utils.vad import has_speech
+
+SAMPLE_RATE = 16000
+
+# (start, end, word)，时间为会话内的绝对秒数
+Word = Tuple[float, float, str]
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def _join(words: List[Word]) -> str:
+    return "".join(w for _, _, w in words).strip()
+
+
+class StreamingSession:
+    """
+    Rolling-buffer transcription state for one streaming connection.
+
+    Usage: `insert_audio()` each incoming chunk, run the model on `buffer` with `transcribe_options()`
+    (and `features` / `encoder_cache`), then pass the result to `process()` to obtain newly committed words and the current partial hypothesis.
+
+    Args:
+        model (str): Model name used by the session.
+        language (Optional[str]): Language code, or None to auto-detect.
+        max_buffer_seconds (float): Force a commit and trim when the uncommitted buffer grows beyond this.
+        prompt_chars (int): Number of trailing committed characters passed as decoding prompt.
+        vad (Optional[Dict[str, float]]): VAD options; when set, all-silent chunks skip inference.
+        decoding (Optional[Dict[str, Any]]): Decoding options (see app.models.decoding) applied to every re-decode.
+        detect_language_seconds (Optional[float]): When set and `language` is None, detect the language once this
+            much speech is buffered (see `language_sample()`) and lock it for the rest of the session.
+        min_language_probability (float): Detections below this probability are retried with more audio
+            (up to 30 s) before the language is locked anyway.
+        encoder_cache (Optional[EncoderCache]): Encoder output cache shared by all re-decodes of the session.
+    """
+
+    def __init__(self, model: str, language: Optional[str] = None, max_buffer_seconds: float = 15.0,
+                 prompt_chars: int = 200, vad: Optional[Dict[str, float]] = None,
+                 decoding: Optional[Dict[str, Any]] = None, detect_language_seconds: Optional[float] = None,
+                 min_language_probability: float = 0.0, encoder_cache: Optional[EncoderCache] = None):
+        self.model = model
+        self.requested_language = language
+        self.language = language
+        self.language_detection: Optional[Dict[str, Any]] = None
+        self.min_language_probability = min_language_probability
+        self._detect_at = int(detect_language_seconds * SAMPLE_RATE) if detect_language_seconds and not language else None
+        self._language_audio: List[np.ndarray] = []  # 检测语言用的音频（不随缓冲区裁剪）
+        self.vad = vad
+        self.decoding = decoding or {}
+        self.skipped_seconds = 0.0
+        self.max_buffer_seconds = max_buffer_seconds
+        self.prompt_chars = prompt_chars
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_offset = 0.0  # buffer[0] 对应的绝对时间
+        self.encoder_cache = encoder_cache
+        self.features = IncrementalLogMel()  # 缓冲区的 log-mel 帧，每次只变换新增音频
+        self.committed: List[Word] = []
+        self.hypothesis: List[Word] = []  # 上一轮未提交的假设
+
+    @property
+    def buffer_seconds(self) -> float:
+        return len(self.buffer) / SAMPLE_RATE
+
+    @property
+    def committed_end(self) -> float:
+        return self.committed[-1][1] if self.committed else self.buffer_offset
+
+    def insert_audio(self, arr: np.ndarray):
+        self.buffer = np.concatenate([self.buffer, arr.astype(np.float32, copy=False)])
+        if self._detect_at is not None:
+            self._language_audio.append(arr.astype(np.float32, copy=False))
+
+    def language_sample(self) -> Optional[np.ndarray]:
+        """
+        Return the audio to detect the language on once enough has been collected, else None
+        (also None once the language is known).
+        """
+        if self._detect_at is None or sum(len(a) for a in self._language_audio) < self._detect_at:
+            return None
+        return np.concatenate(self._language_audio)[:30 * SAMPLE_RATE]
+
+    def lock_language(self, detection: Optional[Dict[str, Any]]):
+        """
+        Apply a detection result from `language_sample()`. A missing (failed) detection stops further attempts and
+        leaves detection to the model; a low-probability one is retried after as much audio again, up to 30 s.
+        """
+        collected = sum(len(a) for a in self._language_audio)
+        if (detection is not None and detection["probability"] < self.min_language_probability
+                and collected < 30 * SAMPLE_RATE):
+            self._detect_at = min(2 * collected, 30 * SAMPLE_RATE)
+            return
+        if detection is not None:
+            self.language = detection["language"]
+            self.language_detection = detection
+        self._detect_at = None
+        self._language_audio = []
+
+    def is_silent(self, arr: np.ndarray) -> bool:
+        return self.vad is not None and not has_speech(arr, **self.vad)
+
+    def skip_silence(self, n_samples: int) -> List[Word]:
+        """
+        Handle an all-silent chunk without inference: commit the pending hypothesis
+        (silence ends the utterance) and advance the timeline past the chunk.
+        """
+        words = self.finish()
+        self.buffer_offset += n_samples / SAMPLE_RATE
+        self.skipped_seconds += n_samples / SAMPLE_RATE
+        return words
+
+    def transcribe_options(self) -> Dict[str, Any]:
+        prompt = _join(self.committed)[-self.prompt_chars:]
+        if self.decoding.get("initial_prompt"):
+            prompt = (self.decoding["initial_prompt"] + " " + prompt).strip()
+        # 默认贪心解码；缓冲区反复重解码，前文条件化由 initial_prompt（已提交文本）代替
+        return {
+            "temperature": 0.0,
+            **self.decoding,
+            "language": self.language,
+            "word_timestamps": True,
+            "condition_on_previous_text": False,
+            "initial_prompt": prompt or None,
+        }
+
+    def _words(self, result: Dict[str, Any]) -> List[Word]:
+        words = [
+            (self.buffer_offset + w["start"], self.buffer_offset + w["end"], w["word"])
+            for seg in result.get("segments", [])
+            for w in seg.get("words", [])
+        ]
+        # 丢弃落在已提交区间内的词
+        words = [w for w in words if w[0] > self.committed_end - 0.1]
+        # 去除与已提交文本末尾重复的 n-gram（缓冲区边界处可能重复识别）
+        if words and self.committed:
+            for n in range(min(5, len(words), len(self.committed)), 0, -1):
+                tail = [_normalize(w[2]) for w in self.committed[-n:]]
+                head = [_normalize(w[2]) for w in words[:n]]
+                if tail == head:
+                    words = words[n:]
+                    break
+        return words
+
+    def process(self, result: Dict[str, Any]) -> Tuple[List[Word], List[Word]]:
+        """
+        Apply the local-agreement policy to a new hypothesis for the current buffer.
+
+        Args:
+            result (Dict[str, Any]): `transcribe` result for `buffer` with word timestamps.
+        Returns:
+            Tuple[List[Word], List[Word]]: (newly committed words, remaining partial words).
+        """
+        current = self._words(result)
+        agreed = 0
+        for prev, cur in zip(self.hypothesis, current):
+            if _normalize(prev[2]) != _normalize(cur[2]):
+                break
+            agreed += 1
+        new_words, partial = current[:agreed], current[agreed:]
+        if not new_words and self.buffer_seconds > self.max_buffer_seconds:
+            # 长时间无法达成一致时强制提交，避免缓冲区无限增长
+            new_words, partial = current, []
+        self.committed.extend(new_words)
+        self.hypothesis = partial
+        if new_words:
+            self._trim(self.committed_end)
+        elif self.buffer_seconds > self.max_buffer_seconds:
+            self._trim(self.buffer_offset + self.buffer_seconds - self.max_buffer_seconds)
+        return new_words, partial
+
+    def _trim(self, until: float):
+        cut = int(round((until - self.buffer_offset) * SAMPLE_RATE))
+        cut = max(0, min(cut, len(self.buffer)))
+        if cut < len(self.buffer):
+            # 按帧移对齐（最多提前 10ms），已计算的 log-mel 帧可以继续复用
+            cut -= cut % HOP_LENGTH
+        self.buffer = self.buffer[cut:]
+        self.features.trim(cut)
+        self.buffer_offset += cut / SAMPLE_RATE
+
+    def finish(self) -> List[Word]:
+        """
+        Commit whatever partial hypothesis is left (e.g., at the end of the stream) and reset the buffer.
+        """
+        words = self.hypothesis
+        self.committed.extend(words)
+        self.hypothesis = []
+        self._trim(self.buffer_offset + self.buffer_seconds)
+        return words
+
+    def message(self, new_words: List[Word], partial: List[Word], final: bool = False) -> Dict[str, Any]:
+        """
+        Build the WebSocket response for one processing step (`final` marks the end-of-stream flush).
+        """
+        msg: Dict[str, Any]
+        if new_words or final:
+            msg = {"text": _join(new_words), "is_final": True, "partial": _join(partial)}
+            if new_words:
+                msg["start"] = round(new_words[0][0], 3)
+                msg["end"] = round(new_words[-1][1], 3)
+        else:
+            msg = {"text": _join(partial), "is_final": False}
+        msg["model"] = self.model
+        msg["buffer_seconds"] = round(self.buffer_seconds, 3)
+        if self.vad is not None:
+            msg["skipped_seconds"] = round(self.skipped_seconds, 3)
+        return msg
+
+
+class AudioBacklog:
+    """
+    Bounded buffer of received audio between a connection's receive task and its inference task.
+
+    `get()` takes everything buffered at once, so when inference falls behind real time the chunks that
+    arrived meanwhile are coalesced into a single re-decode instead of being processed one by one. `put()`
+    waits while `max_seconds` or more are buffered, which stops reading the socket (backpressure).
+    Must be used from the event loop thread.
+
+    Args:
+        max_seconds (float): Audio buffered before `put()` blocks.
+    """
+
+    def __init__(self, max_seconds: float = 10.0):
+        self.max_samples = int(max_seconds * SAMPLE_RATE)
+        self.closed = False
+        self._chunks: List[np.ndarray] = []
+        self._samples = 0
+        self._decode_seconds = 0.0
+        self._busy = False  # 推理任务正在处理取出的音频
+        self._cond = asyncio.Condition()
+
+    @property
+    def pending_seconds(self) -> float:
+        return self._samples / SAMPLE_RATE
+
+    def full(self) -> bool:
+        return self._samples >= self.max_samples
+
+    async def put(self, arr: np.ndarray, decode_seconds: float = 0.0):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._samples < self.max_samples or self.closed)
+            self._chunks.append(arr)
+            self._samples += len(arr)
+            self._decode_seconds += decode_seconds
+            self._cond.notify_all()
+
+    async def get(self) -> Optional[Tuple[np.ndarray, int, float]]:
+        """
+        Wait for audio and take all of it. Returns (audio, number of coalesced chunks, their decode seconds),
+        or None once closed and drained. Call `task_done()` when the audio has been processed.
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._chunks or self.closed)
+            if not self._chunks:
+                return None
+            chunks, decode_seconds = self._chunks, self._decode_seconds
+            self._chunks, self._samples, self._decode_seconds = [], 0, 0.0
+            self._busy = True
+            self._cond.notify_all()
+        audio = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        return audio, len(chunks), decode_seconds
+
+    async def task_done(self):
+        async with self._cond:
+            self._busy = False
+            self._cond.notify_all()
+
+    async def join(self):
+        """
+        Wait until all buffered audio has been processed (or the backlog is closed), e.g., before switching
+        sessions or flushing at the end of the stream.
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: not (self._chunks or self._busy) or self.closed)
+
+    async def close(self):
+        async with self._cond:
+            self.closed = True
+            self._cond.notify_all()
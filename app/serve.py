@@ -0,0 +1,144 @@
+"""
+This module runs the service with several worker processes that share one copy of the model weights.
+
+The master process imports the application (which builds the ModelManager), loads every configured model,
+freezes the Python heap (`gc.freeze`) and only then binds the listening socket and forks the workers. The
+workers inherit the weights copy-on-write: tensors are never written during inference, so each extra worker
+adds little more than its own Python objects and activations. Unlike `uvicorn --workers N`, which imports
+the app (and loads the models) in every worker, startup cost and weight memory are paid once.
+Crashed workers are re-forked from the master, so they start instantly and share the same weights.
+
+Usage:
+    python -m app.serve [--workers N] [--host HOST] [--port PORT]
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+import uvicorn
+
+RESPAWN_DELAY = 1.0  # worker 异常退出后重新 fork 前的等待（秒）
+
+
+def _run_worker(app, sock: socket.socket, index: int, first_start: bool, threads: int, log_level: str):
+    """
+    Body of a forked worker: reset per-process state that must not be shared, then serve on the inherited socket.
+    """
+    import torch
+    from app.api import jobs
+
+    # 独立进程组: 终端的 Ctrl-C 只发给主进程，由主进程统一转发 SIGTERM，避免 worker 收到两次信号被强制退出
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+    if jobs.job_store is not None:
+        jobs.job_store.reopen()
+        # 中断条目已由主进程恢复；待发送的回调只由第一个 worker 在首次启动时补发
+        jobs.job_workers.recover_on_start = False
+        jobs.job_workers.resume_webhooks_on_start = index == 0 and first_start
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def serve(workers: int, host: str, port: int, threads_per_worker: int = 0, log_level: str = "info"):
+    # 导入应用即构建 ModelManager；随后在 fork 之前加载所有模型
+    from app.main import app, model_manager
+    from app.api import jobs
+
+    start = time.time()
+    model_manager.prepare_fork()
+    if jobs.job_store is not None:
+        requeued = jobs.job_store.recover()
+        if requeued:
+            print(f"Requeued {requeued} interrupted job items")
+    # 把现有对象移入永久代，避免 worker 中的 GC 扫描触碰共享页
+    gc.collect()
+    gc.freeze()
+    print(f"Models ready in {time.time() - start:.1f}s, starting {workers} workers on {host}:{port}")
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    children: Dict[int, int] = {}  # pid -> worker index
+    stopping = False
+
+    def spawn(index: int, first_start: bool):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(app, sock, index, first_start, threads, log_level)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                # 不执行主进程继承来的 atexit 等清理逻辑
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for i in range(workers):
+        spawn(i, True)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+        time.sleep(RESPAWN_DELAY)
+        if not stopping:
+            spawn(index, False)
+    sock.close()
+    model_manager.shutdown()
+
+
+def main():
+    config_path = os.getenv("CONFIG_PATH", "config/config.yaml")
+    import yaml
+    with open(config_path) as f:
+        config = yaml.safe_load(f) or {}
+    api = config.get("api") or {}
+    prefork = config.get("prefork") or {}
+
+    parser = argparse.ArgumentParser(description="Serve the API with pre-forked workers sharing model weights.")
+    parser.add_argument("--workers", type=int, default=prefork.get("workers", os.cpu_count() or 1))
+    parser.add_argument("--host", default=api.get("host", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=api.get("port", 8000))
+    parser.add_argument("--threads-per-worker", type=int, default=prefork.get("threads_per_worker", 0),
+                        help="torch intra-op threads per worker (default: CPU count / workers)")
+    parser.add_argument("--log-level", default=api.get("log_level", "info"))
+    args = parser.parse_args()
+    serve(max(1, args.workers), args.host, args.port, args.threads_per_worker, args.log_level)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""
+This module implements admission control for `/transcribe` based on audio duration instead of request count.
+A request costs its audio seconds times the model's `cost_factor`; each client (API key, else client address)
+has a token bucket refilled in audio-seconds per minute, and admitted requests share each model's slots by
+start-time fair queuing, so a client submitting hour-long files cannot starve clients sending short clips.
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.models.executor import QueueFullError
+from app.utils.metrics import Counter
+
+ADMISSION_REJECTIONS = Counter(
+    "whisper_admission_rejections_total", "Requests rejected by admission control, by reason", ["reason"],
+)
+
+
+class AdmissionError(Exception):
+    """
+    Raised when a request exceeds its client's audio-seconds budget.
+    `retry_after` is None when the request can never be admitted (larger than the bucket).
+    """
+
+    def __init__(self, message: str, cost: float, available: float, retry_after: Optional[int] = None,
+                 status_code: int = 429):
+        super().__init__(message)
+        self.cost = cost
+        self.available = available
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """
+    Token bucket in audio-seconds.
+
+    Args:
+        rate (float): Refill rate in audio-seconds per wall-clock second.
+        capacity (float): Maximum balance (burst), also the largest single request that can be admitted.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def available(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available."""
+        deficit = amount - self.available()
+        return max(0.0, deficit / self.rate) if self.rate > 0 else math.inf
+
+    def consume(self, amount: float) -> bool:
+        if self.available() < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.available() + amount)
+
+
+class FairQueue:
+    """
+    Inference slots of one model shared across clients by start-time fair queuing: each request gets a
+    virtual start tag `max(virtual time, client's last finish tag)` and a freed slot goes to the smallest tag,
+    so clients are served in proportion to audio-seconds rather than arrival order.
+
+    All methods must be called from the event loop thread.
+    """
+
+    def __init__(self, name: str, concurrency: int = 1, max_waiting: int = 8, retry_after: int = 5):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.max_waiting = max(0, int(max_waiting))
+        self.retry_after = int(retry_after)
+        self.active = 0
+        self.vtime = 0.0
+        self._finish: Dict[str, float] = {}
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, client: str, cost: float):
+        start = max(self.vtime, self._finish.get(client, 0.0))
+        if self.active < self.concurrency and not self._waiters:
+            self._finish[client] = start + cost
+            self.active += 1
+            self._advance(start)
+            return
+        if len(self._waiters) >= self.max_waiting:
+            raise QueueFullError(self.name, self.retry_after)
+        # 只有被接纳（立即执行或排队）的请求才计入客户端的结束标签，被拒绝的请求不影响其后续排序
+        self._finish[client] = start + cost
+        fut = asyncio.get_running_loop().create_future()
+        entry = (start, next(self._seq), fut)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        # 把槽位交给虚拟开始时间最小的等待者，active 数不变
+        while self._waiters:
+            start, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                self._advance(start)
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def _advance(self, start: float):
+        self.vtime = max(self.vtime, start)
+        # 结束标签不超过虚拟时间的客户端与新客户端等价，删除以免字典无限增长
+        for client in [c for c, f in self._finish.items() if f <= self.vtime]:
+            del self._finish[client]
+
+
+class AdmissionTicket:
+    """Fair-queue slot held by one admitted request; `release()` is idempotent."""
+
+    def __init__(self, queue: FairQueue):
+        self._queue: Optional[FairQueue] = queue
+
+    def release(self):
+        if self._queue is not None:
+            self._queue.release()
+            self._queue = None
+
+
+class AdmissionController:
+    """
+    Per-client audio-seconds budgets plus per-model fair queuing.
+
+    Args:
+        audio_seconds_per_minute (float): Budget refill rate per client.
+        burst_audio_seconds (float): Bucket capacity per client (largest admissible request).
+        clients (Optional[Dict[str, Dict[str, float]]]): Per-API-key overrides of the two values above.
+        api_key_header (str): Header identifying the client; requests without it are keyed by client address.
+        upload_bytes_per_second (float): Assumed encoded bytes per audio second, used to estimate the cost
+            of an upload before it is decoded.
+        max_waiting (Optional[int]): Waiting requests per model before rejecting with 503
+            (default: the model queue's `max_queue_size`).
+    """
+
+    def __init__(self, audio_seconds_per_minute: float = 600, burst_audio_seconds: float = 3600,
+                 clients: Optional[Dict[str, Dict[str, float]]] = None, api_key_header: str = "X-API-Key",
+                 upload_bytes_per_second: float = 32000, max_waiting: Optional[int] = None):
+        self.audio_seconds_per_minute = float(audio_seconds_per_minute)
+        self.burst_audio_seconds = float(burst_audio_seconds)
+        self.clients = clients or {}
+        self.api_key_header = api_key_header
+        self.upload_bytes_per_second = float(upload_bytes_per_second)
+        self.max_waiting = max_waiting
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._queues: Dict[str, FairQueue] = {}
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> Optional["AdmissionController"]:
+        config = config or {}
+        if not config.get("enabled", False):
+            return None
+        return cls(
+            audio_seconds_per_minute=config.get("audio_seconds_per_minute", 600),
+            burst_audio_seconds=config.get("burst_audio_seconds", 3600),
+            clients=config.get("clients"),
+            api_key_header=config.get("api_key_header", "X-API-Key"),
+            upload_bytes_per_second=config.get("upload_bytes_per_second", 32000),
+            max_waiting=config.get("max_waiting"),
+        )
+
+    def client_id(self, headers, address: Optional[str]) -> str:
+        key = headers.get(self.api_key_header)
+        return f"key:{key}" if key else f"addr:{address or 'unknown'}"
+
+    def estimate_seconds(self, nbytes: int) -> float:
+        return nbytes / self.upload_bytes_per_second
+
+    def _bucket(self, client: str) -> TokenBucket:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            limits = self.clients.get(client[4:], {}) if client.startswith("key:") else {}
+            bucket = TokenBucket(
+                limits.get("audio_seconds_per_minute", self.audio_seconds_per_minute) / 60,
+                limits.get("burst_audio_seconds", self.burst_audio_seconds),
+            )
+            self._buckets[client] = bucket
+        return bucket
+
+    def check(self, client: str, cost: float):
+        """
+        Reject a request early (e.g., from its upload size, before decoding) if its estimated cost does not fit
+        the client's budget; nothing is charged.
+
+        Raises:
+            AdmissionError: 413 if the cost exceeds the bucket capacity, else 429 with a retry hint.
+        """
+        bucket = self._bucket(client)
+        available = bucket.available()
+        if cost > bucket.capacity:
+            ADMISSION_REJECTIONS.inc(reason="too_large")
+            raise AdmissionError(
+                f"Request costs {cost:.0f} audio-seconds, more than the budget of {bucket.capacity:.0f}.",
+                cost, available, status_code=413,
+            )
+        if available < cost:
+            ADMISSION_REJECTIONS.inc(reason="rate_limited")
+            raise AdmissionError(
+                f"Audio-seconds budget exceeded ({available:.0f} of {cost:.0f} available).",
+                cost, available, retry_after=max(1, math.ceil(bucket.wait_time(cost))),
+            )
+
+    async def admit(self, client: str, model: str, cost: float, concurrency: int,
+                    retry_after: int = 5, max_waiting: int = 8) -> AdmissionTicket:
+        """
+        Charge `cost` audio-seconds to the client and wait for a fair-queued slot of `model`.
+
+        Raises:
+            AdmissionError: If the budget does not cover the cost (see `check`).
+            QueueFullError: If too many requests are already waiting for the model (the charge is refunded).
+        """
+        self.check(client, cost)
+        bucket = self._bucket(client)
+        bucket.consume(cost)
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = FairQueue(model, concurrency, self.max_waiting if self.max_waiting is not None else max_waiting,
+                              retry_after)
+            self._queues[model] = queue
+        try:
+            await queue.acquire(client, cost)
+        except QueueFullError:
+            ADMISSION_REJECTIONS.inc(reason="queue_full")
+            bucket.refund(cost)
+            raise
+        except asyncio.CancelledError:
+            bucket.refund(cost)
+            raise
+        return AdmissionTicket(queue)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: {"active": q.active, "waiting": q.waiting} for name, q in self._queues.items()}
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that releases the admission slot a request stored in `request.state.admission_ticket`
+    once the whole response has been sent (streamed bodies included) or the client disconnected.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            ticket = state.get("admission_ticket")
+            if ticket is not None:
+                ticket.release()
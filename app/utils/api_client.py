@@ -2,7 +2,9 @@
 This module provides client utility functions for interacting with the Whisper transcription API.
 It supports both standard HTTP and streaming WebSocket transcription with numpy audio input.
 
-Provides standard and streaming transcription functions for numpy audio input.
+Provides standard and streaming transcription functions for numpy audio input, and `WhisperClient`, an async
+client with a pooled keep-alive connection, retries with backoff on 429/503, concurrent batch submission
+(`transcribe_many`) and pipelined WebSocket streaming.
 
 Author: whisper_docker_api_2 contributors
 Date: 2024-06-xx
@@ -10,17 +12,83 @@ Date: 2024-06-xx
 
 import requests
 import numpy as np
-import base64
 import asyncio
+import httpx
+import os
+import random
+import threading
+import time
 import websockets
 import json
-from typing import Optional, Dict, Any, List, Generator, Union, Iterable
-from app.utils.audio_utils import split_audio, audio_to_base64
+from typing import Optional, Dict, Any, List, Generator, Union, Iterable, AsyncIterator, Tuple
+from app.utils.audio_utils import split_audio, audio_to_base64, audio_to_pcm_bytes, audio_to_encoded_bytes, CODECS
 
 HTTP_URL = "http://localhost:8000/transcribe"
 WS_URL = "ws://localhost:8000/transcribe/stream"
+BASE_URL = "http://localhost:8000"
 SAMPLE_RATE = 16000
 
+# 服务端过载（429 准入限额 / 503 队列已满）时重试
+RETRY_STATUS = (429, 503)
+DEFAULT_RETRIES = 5
+
+AudioInput = Union[np.ndarray, str, os.PathLike, bytes]
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _shared_session() -> requests.Session:
+    # 进程内共享的 keep-alive 连接池，避免每次调用重新建立 TCP 连接
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        return _session
+
+
+def retry_delay(headers, attempt: int, backoff: float = 0.5, max_backoff: float = 30.0) -> float:
+    """
+    Seconds to wait before retry number `attempt` (0-based): the server's `Retry-After` if present, else
+    exponential backoff; both with random jitter so concurrent clients do not retry in lockstep.
+    """
+    retry_after = (headers or {}).get("Retry-After")
+    if retry_after is not None and str(retry_after).isdigit():
+        return min(float(retry_after), max_backoff) + random.uniform(0, backoff)
+    return min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def encode_request(audio: np.ndarray, encoding: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Build the `/transcribe` request for a numpy array: returns (query params, request keyword arguments).
+
+    Args:
+        audio (np.ndarray): 1D float32 numpy array, 16kHz, mono.
+        encoding (str): 'int16' or 'float32' (raw PCM body), 'flac' or 'opus' (compressed body, needs ffmpeg
+            on the client), or 'base64' (legacy form field `audio_ndarray`).
+        params (Dict[str, Any]): API parameters.
+    Raises:
+        ValueError: If the encoding is unsupported.
+    """
+    params = {k: (str(v).lower() if isinstance(v, bool) else v) for k, v in params.items() if v is not None}
+    if encoding == "base64":
+        return {}, {"data": dict(params, audio_ndarray=audio_to_base64(audio))}
+    if encoding in ("int16", "float32"):
+        params.update(dtype=encoding, sample_rate=SAMPLE_RATE)
+        return params, {"content": audio_to_pcm_bytes(audio, encoding),
+                        "headers": {"Content-Type": "application/octet-stream"}}
+    if encoding in CODECS:
+        return params, {"content": audio_to_encoded_bytes(audio, encoding, SAMPLE_RATE),
+                        "headers": {"Content-Type": CODECS[encoding][1]}}
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def _parse_response(resp) -> Dict[str, Any]:
+    try:
+        return resp.json()
+    except Exception:
+        return {"status": resp.status_code, "text": resp.text}
+
 
 def standard_transcribe(
     audio: np.ndarray,
@@ -28,37 +96,268 @@ def standard_transcribe(
     language: Optional[str] = None,
     output_format: str = "json",
     api_url: str = HTTP_URL,
+    encoding: str = "int16",
+    retries: int = DEFAULT_RETRIES,
     **kwargs
 ) -> Dict[str, Any]:
     """
     Transcribe audio using the standard HTTP API.
 
+    By default the audio is sent as a raw int16 PCM request body (parameters in the query string), about a third of
+    the size of the base64 float32 form upload and decoded by the server without ffmpeg. Calls share one
+    keep-alive connection pool, and 429/503 responses are retried with backoff (honoring `Retry-After`).
+
     Args:
         audio (np.ndarray): 1D float32 numpy array, 16kHz, mono.
         model (str): Model name (default: "base").
         language (Optional[str]): Language code (e.g., 'en', 'zh').
         output_format (str): Output format ('json', 'text', etc.).
         api_url (str): API endpoint URL.
+        encoding (str): 'int16' or 'float32' (raw PCM body), 'flac' or 'opus' (compressed body, needs ffmpeg
+            on the client), or 'base64' (legacy form field `audio_ndarray`).
+        retries (int): Maximum retries on 429/503 (0 to disable).
         **kwargs: Additional parameters for the API.
     Returns:
         Dict[str, Any]: API response as a dict (parsed JSON or error info).
     Raises:
         requests.RequestException: If the HTTP request fails.
+        ValueError: If the encoding is unsupported.
     """
-    audio_b64 = audio_to_base64(audio)
-    payload = {
-        "audio_ndarray": audio_b64,
-        "model": model,
-        "output_format": output_format,
-    }
-    if language:
-        payload["language"] = language
-    payload.update(kwargs)
-    resp = requests.post(api_url, data=payload)
-    try:
-        return resp.json()
-    except Exception:
-        return {"status": resp.status_code, "text": resp.text}
+    params, request = encode_request(audio, encoding, dict(kwargs, model=model, language=language,
+                                                           output_format=output_format))
+    if "content" in request:
+        request["data"] = request.pop("content")
+    session = _shared_session()
+    attempt = 0
+    while True:
+        resp = session.post(api_url, params=params, **request)
+        if resp.status_code not in RETRY_STATUS or attempt >= retries:
+            return _parse_response(resp)
+        time.sleep(retry_delay(resp.headers, attempt))
+        attempt += 1
+
+
+class WhisperClient:
+    """
+    Async client for the transcription API with a pooled keep-alive HTTP connection.
+
+    Use it as an async context manager (or call `aclose()`); one instance can serve many concurrent requests.
+
+    Args:
+        base_url (str): Server URL, e.g. "http://localhost:8000".
+        max_connections (int): Size of the connection pool (concurrent requests beyond it wait for a connection).
+        timeout (float): Read timeout in seconds (transcriptions of long files can take a while).
+        connect_timeout (float): Connect timeout in seconds.
+        retries (int): Maximum retries on 429/503 responses and rejected stream handshakes.
+        backoff (float): Base delay of the exponential backoff in seconds.
+        max_backoff (float): Upper bound of a single retry delay in seconds.
+        api_key (Optional[str]): Sent as `X-API-Key` (identifies the client for admission control).
+        encoding (str): Default upload encoding of numpy arrays (see `encode_request`).
+
+    Example:
+        >>> async with WhisperClient("http://localhost:8000") as client:
+        ...     results = await client.transcribe_many(["a.wav", "b.mp3"], concurrency=8, model="base")
+    """
+
+    def __init__(self, base_url: str = BASE_URL, max_connections: int = 16, timeout: float = 600.0,
+                 connect_timeout: float = 5.0, retries: int = DEFAULT_RETRIES, backoff: float = 0.5,
+                 max_backoff: float = 30.0, api_key: Optional[str] = None, encoding: str = "int16"):
+        self.base_url = base_url.rstrip("/")
+        self.ws_url = "ws" + self.base_url[len("http"):] + "/transcribe/stream"
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.encoding = encoding
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"X-API-Key": api_key} if api_key else None,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def __aenter__(self) -> "WhisperClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def _delay(self, headers, attempt: int) -> float:
+        return retry_delay(headers, attempt, self.backoff, self.max_backoff)
+
+    async def _post(self, path: str, params: Dict[str, Any], request: Dict[str, Any]) -> httpx.Response:
+        attempt = 0
+        while True:
+            resp = await self._client.post(path, params=params, **request)
+            if resp.status_code not in RETRY_STATUS or attempt >= self.retries:
+                return resp
+            await asyncio.sleep(self._delay(resp.headers, attempt))
+            attempt += 1
+
+    async def transcribe(self, audio: AudioInput, model: str = "base", language: Optional[str] = None,
+                         output_format: str = "json", encoding: Optional[str] = None,
+                         **kwargs) -> Dict[str, Any]:
+        """
+        Transcribe one input with `/transcribe`, retrying on 429/503.
+
+        Args:
+            audio (AudioInput): 1D float32 numpy array (16kHz, mono), a file path, or encoded file bytes
+                (paths and bytes are uploaded as `audio_file`).
+            model (str): Model name (default: "base").
+            language (Optional[str]): Language code.
+            output_format (str): Output format ('json', 'text', etc.).
+            encoding (Optional[str]): Upload encoding of numpy arrays (default: the client's `encoding`).
+            **kwargs: Additional parameters for the API.
+        Returns:
+            Dict[str, Any]: API response (parsed JSON or error info).
+        Raises:
+            httpx.HTTPError: If the request fails at the transport level.
+        """
+        params = dict(kwargs, model=model, language=language, output_format=output_format)
+        if isinstance(audio, np.ndarray):
+            query, request = encode_request(audio, encoding or self.encoding, params)
+        else:
+            if isinstance(audio, bytes):
+                name, content = "audio", audio
+            else:
+                path = os.fspath(audio)
+                with open(path, "rb") as f:
+                    content = await asyncio.get_running_loop().run_in_executor(None, f.read)
+                name = os.path.basename(path)
+            data = {k: (str(v).lower() if isinstance(v, bool) else v) for k, v in params.items() if v is not None}
+            query, request = {}, {"data": data, "files": {"audio_file": (name, content)}}
+        return _parse_response(await self._post("/transcribe", query, request))
+
+    async def transcribe_many(self, files: Iterable[AudioInput], concurrency: int = 4,
+                              **kwargs) -> List[Dict[str, Any]]:
+        """
+        Transcribe many inputs with at most `concurrency` requests in flight over the shared connection pool.
+
+        Args:
+            files (Iterable[AudioInput]): File paths, encoded file bytes or numpy arrays.
+            concurrency (int): Maximum concurrent requests.
+            **kwargs: Parameters passed to `transcribe` for every input.
+        Returns:
+            List[Dict[str, Any]]: One response per input, in input order; inputs that failed at the transport
+                level (after retries) get `{"error": ...}`.
+        """
+        semaphore = asyncio.Semaphore(max(1, int(concurrency)))
+
+        async def run(item: AudioInput) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    return await self.transcribe(item, **kwargs)
+                except (httpx.HTTPError, OSError) as e:
+                    return {"error": str(e)}
+
+        return list(await asyncio.gather(*(run(item) for item in files)))
+
+    async def stream(self, audio: Union[np.ndarray, Iterable[np.ndarray]], model: str = "base",
+                     language: Optional[str] = None, chunk_seconds: float = 1, dtype: str = "int16",
+                     **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream audio over `/transcribe/stream` with sending and receiving pipelined: chunks are sent as fast as
+        they are produced while responses are yielded as soon as they arrive, so the client never waits for
+        a chunk's response before sending the next one.
+
+        Args:
+            audio: 1D float32 numpy array (16kHz, mono), or an iterable/generator (blocking ones such as a
+                microphone are read in a worker thread) or async iterable of such chunks.
+            model (str): Model name (default: "base").
+            language (Optional[str]): Language code.
+            chunk_seconds (float): Duration of each chunk (only for np.ndarray input).
+            dtype (str): PCM sample format of the binary frames ('int16' or 'float32').
+            **kwargs: Additional parameters for the API (sent in the initial control message).
+        Yields:
+            Dict[str, Any]: Server messages as they are received, ending with the end-of-stream response
+                (`"event": "end"`), or a single error message if the session could not be started.
+        """
+        control = dict(kwargs, model=model, dtype=dtype, sample_rate=SAMPLE_RATE)
+        if language:
+            control["language"] = language
+        attempt = 0
+        while True:
+            async with websockets.connect(self.ws_url) as ws:
+                # 控制消息只发送一次，之后音频以二进制 PCM 帧发送
+                try:
+                    await ws.send(json.dumps(control))
+                except websockets.ConnectionClosed:
+                    pass  # 会话数已满时服务端可能已关闭连接，拒绝消息仍可读取
+                ready = json.loads(await ws.recv())
+                if "error" not in ready:
+                    async for message in self._pipeline(ws, audio, chunk_seconds, dtype):
+                        yield message
+                    return
+            if "retry_after" not in ready or attempt >= self.retries:
+                yield ready
+                return
+            # 会话数已满或模型繁忙: 退避后重新建立连接
+            await asyncio.sleep(self._delay({"Retry-After": str(ready["retry_after"])}, attempt))
+            attempt += 1
+
+    async def _pipeline(self, ws, audio, chunk_seconds: float, dtype: str) -> AsyncIterator[Dict[str, Any]]:
+        sender = asyncio.ensure_future(self._send_audio(ws, audio, chunk_seconds, dtype))
+
+        def on_sent(task: asyncio.Future):
+            # 发送失败时关闭连接，让接收循环结束并在 await sender 时抛出该错误
+            if not task.cancelled() and task.exception() is not None:
+                asyncio.ensure_future(ws.close())
+
+        sender.add_done_callback(on_sent)
+        try:
+            async for raw in ws:
+                try:
+                    message = json.loads(raw)
+                except ValueError as e:
+                    message = {"error": str(e)}
+                yield message
+                if message.get("event") == "end":
+                    break
+            await sender
+        finally:
+            sender.cancel()
+
+    @staticmethod
+    async def _send_audio(ws, audio, chunk_seconds: float, dtype: str):
+        if isinstance(audio, np.ndarray):
+            for chunk in split_audio(audio, int(SAMPLE_RATE * chunk_seconds)):
+                await ws.send(audio_to_pcm_bytes(chunk, dtype))
+        elif hasattr(audio, "__aiter__"):
+            async for chunk in audio:
+                await ws.send(audio_to_pcm_bytes(chunk, dtype))
+        else:
+            # 麦克风等阻塞式生成器在线程中读取，不阻塞接收响应
+            loop = asyncio.get_running_loop()
+            chunks = iter(audio)
+            done = object()
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, done)
+                if chunk is done:
+                    break
+                await ws.send(audio_to_pcm_bytes(chunk, dtype))
+        await ws.send(json.dumps({"event": "end"}))
+
+
+def transcribe_many(files: Iterable[AudioInput], concurrency: int = 4, base_url: str = BASE_URL,
+                    **kwargs) -> List[Dict[str, Any]]:
+    """
+    Synchronous wrapper of `WhisperClient.transcribe_many` (one pooled client for the whole batch).
+
+    Args:
+        files (Iterable[AudioInput]): File paths, encoded file bytes or numpy arrays.
+        concurrency (int): Maximum concurrent requests.
+        base_url (str): Server URL.
+        **kwargs: Parameters passed to `WhisperClient.transcribe` for every input.
+    Returns:
+        List[Dict[str, Any]]: One response per input, in input order.
+    """
+    async def _run():
+        async with WhisperClient(base_url, max_connections=concurrency) as client:
+            return await client.transcribe_many(files, concurrency=concurrency, **kwargs)
+
+    return asyncio.run(_run())
 
 
 def stream_transcribe(
@@ -67,11 +366,13 @@ def stream_transcribe(
     language: Optional[str] = None,
     chunk_seconds: int = 1,
     ws_url: str = WS_URL,
+    dtype: str = "int16",
     **kwargs
 ) -> 'Generator[Dict[str, Any], None, None]':
     """
     Transcribe audio using the streaming WebSocket API (yields results in real time).
     Supports both full numpy array input and iterable/generator of audio chunks (e.g., microphone stream).
+    Sending and receiving are pipelined (see `WhisperClient.stream`).
 
     Args:
         audio (Union[np.ndarray, Iterable[np.ndarray]]):
@@ -81,42 +382,31 @@ def stream_transcribe(
         language (Optional[str]): Language code.
         chunk_seconds (int): Duration (seconds) of each audio chunk (only for np.ndarray input).
         ws_url (str): WebSocket endpoint URL.
-        **kwargs: Additional parameters for the API.
+        dtype (str): PCM sample format of the binary frames ('int16' or 'float32').
+        **kwargs: Additional parameters for the API (sent in the initial control message).
     Yields:
-        Dict[str, Any]: Server response for each chunk, as soon as it is received.
+        Dict[str, Any]: Server responses as soon as they are received,
+            followed by the final response to the end-of-stream message.
     """
-    # Determine chunk source
-    if isinstance(audio, np.ndarray):
-        chunk_size = SAMPLE_RATE * chunk_seconds
-        chunks = split_audio(audio, chunk_size)
-    else:
-        chunks = audio  # Assume iterable/generator of np.ndarray
-
-    async def _stream():
-        async with websockets.connect(ws_url) as ws:
-            for chunk in chunks:
-                audio_b64 = audio_to_base64(chunk)
-                msg = {
-                    "model": model,
-                    "audio_ndarray": audio_b64,
-                }
-                if language:
-                    msg["language"] = language
-                msg.update(kwargs)
-                await ws.send(json.dumps(msg))
-                try:
-                    response = await ws.recv()
-                    resp_json = json.loads(response)
-                    yield resp_json
-                except Exception as e:
-                    yield {"error": str(e)}
-
-    # Run the async generator and yield results synchronously
-    loop = asyncio.get_event_loop() if asyncio.get_event_loop().is_running() else asyncio.new_event_loop()
+    base_url = "http" + ws_url[len("ws"):].rsplit("/transcribe/stream", 1)[0]
+    # 每次调用使用独立的事件循环，在同步生成器中逐条驱动异步流
+    loop = asyncio.new_event_loop()
+    client = None
+    gen = None
     try:
-        gen = _stream()
+        client = WhisperClient(base_url)
+        client.ws_url = ws_url
+        gen = client.stream(audio, model=model, language=language, chunk_seconds=chunk_seconds, dtype=dtype,
+                            **kwargs)
         while True:
-            result = loop.run_until_complete(gen.__anext__())
+            try:
+                result = loop.run_until_complete(gen.__anext__())
+            except StopAsyncIteration:
+                break
             yield result
-    except StopAsyncIteration:
-        pass 
\ No newline at end of file
+    finally:
+        if gen is not None:
+            loop.run_until_complete(gen.aclose())
+        if client is not None:
+            loop.run_until_complete(client.aclose())
+        loop.close()
@@ -1,5 +1,6 @@
 """
-This module provides utility functions for decoding audio from files, base64 strings, numpy arrays, and URLs.
+This module provides utility functions for decoding audio from files, base64 strings, numpy arrays, and raw PCM.
+URL downloads are handled asynchronously by app.utils.fetch.
 All decoded audio is converted to mono, 16kHz, float32 numpy arrays for downstream processing.
 
 Author: whisper_docker_api_2 contributors
@@ -8,26 +9,144 @@ Date: 2024-06-xx
 
 import base64
 import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
 import numpy as np
-from typing import Optional
+from typing import Generator, Union
 
-from pydub import AudioSegment
+SAMPLE_RATE = 16000
+READ_BLOCK = 1 << 16  # 64KB
+STDERR_TAIL = 4096  # 错误信息只保留最后 4KB
+
+class AudioDecodeError(ValueError):
+    """Raised when ffmpeg cannot decode the input audio."""
+
+def _ffmpeg_command(source: str) -> list:
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error"]
+    if source != "pipe:0":
+        cmd.append("-nostdin")
+    return cmd + ["-i", source, "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+
+def _feed_stdin(proc: subprocess.Popen, file):
+    # 在线程中把上传内容分块写入 ffmpeg 的 stdin，避免与读取 stdout 互相阻塞
+    try:
+        while True:
+            block = file.read(READ_BLOCK)
+            if not block:
+                break
+            proc.stdin.write(block)
+    except (BrokenPipeError, ValueError):
+        pass
+    finally:
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+
+def _drain_stderr(proc: subprocess.Popen):
+    # 在线程中持续读取 stderr，只保留末尾部分；否则错误输出写满管道缓冲区后 ffmpeg 会阻塞，与读取 stdout 互相等待
+    tail = bytearray()
+    while True:
+        block = proc.stderr.read1(READ_BLOCK)
+        if not block:
+            break
+        tail += block
+        del tail[:-STDERR_TAIL]
+    proc.stderr_tail = bytes(tail)
+
+def _open_ffmpeg(file: Union[str, io.IOBase]) -> subprocess.Popen:
+    if shutil.which("ffmpeg") is None:
+        raise AudioDecodeError("ffmpeg is not installed.")
+    if isinstance(file, (str, os.PathLike)):
+        proc = subprocess.Popen(_ffmpeg_command(os.fspath(file)), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    else:
+        proc = subprocess.Popen(
+            _ffmpeg_command("pipe:0"), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        proc.feeder = threading.Thread(target=_feed_stdin, args=(proc, file), daemon=True)
+        proc.feeder.start()
+    proc.stderr_reader = threading.Thread(target=_drain_stderr, args=(proc,), daemon=True)
+    proc.stderr_reader.start()
+    return proc
+
+def _finish(proc: subprocess.Popen, produced: bool):
+    returncode = proc.wait()
+    proc.stderr_reader.join()
+    stderr = proc.stderr_tail.decode("utf-8", "replace").strip()
+    # 部分解封装错误下 ffmpeg 仍以 0 退出，此时以"无输出且有错误信息"判定失败
+    if returncode != 0 or (not produced and stderr):
+        raise AudioDecodeError(f"Failed to decode audio: {stderr or 'ffmpeg exited with code %d' % proc.returncode}")
+
+def _needs_seekable_input(file) -> bool:
+    # mp4/m4a 等容器的索引可能位于文件末尾，无法通过管道解码
+    return not isinstance(file, (str, os.PathLike)) and hasattr(file, "seek") and file.seekable()
+
+def iter_audio_chunks(file, chunk_seconds: float = 30.0) -> Generator[np.ndarray, None, None]:
+    """
+    Decode an audio file incrementally through an ffmpeg pipe, yielding mono 16kHz float32 chunks
+    as soon as they are decoded, so a consumer can start working on the audio before decoding finishes.
+
+    Args:
+        file: File-like object or file path (wav, mp3, m4a, etc.)
+        chunk_seconds (float): Duration of each yielded chunk; the last one may be shorter.
+    Yields:
+        np.ndarray: 1D float32 numpy arrays of audio samples, normalized to [-1, 1]
+    Raises:
+        AudioDecodeError: If ffmpeg is missing or cannot decode the input.
+    """
+    chunk_samples = max(1, int(chunk_seconds * SAMPLE_RATE))
+    start = file.tell() if _needs_seekable_input(file) else 0
+    proc = _open_ffmpeg(file)
+    produced = False
+    try:
+        while True:
+            # 直接读入新分配的数组，不经过 bytes 中转
+            chunk = np.empty(chunk_samples, dtype=np.float32)
+            n = proc.stdout.readinto(memoryview(chunk).cast("B")) // 4
+            if not n:
+                break
+            produced = True
+            # 最后一段较短时复制出来，避免视图持有整块缓冲区
+            yield chunk if n == chunk_samples else chunk[:n].copy()
+        _finish(proc, produced)
+    except AudioDecodeError:
+        if produced or not _needs_seekable_input(file):
+            raise
+        # 管道解码失败且尚未输出任何数据: 落盘到临时文件后按路径重试
+        # 先等写入线程退出，避免与下面的复制同时读取 file
+        proc.feeder.join()
+        file.seek(start)
+        with tempfile.NamedTemporaryFile() as tmp:
+            shutil.copyfileobj(file, tmp, READ_BLOCK)
+            tmp.flush()
+            yield from iter_audio_chunks(tmp.name, chunk_seconds)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
 
 def decode_audio_file(file) -> np.ndarray:
     """
     Decode an audio file-like object to a mono, 16kHz, float32 numpy array.
 
+    The upload is piped straight into ffmpeg and its float32 output is collected in 30 s chunks that are
+    joined with a single `np.concatenate`, so the decoded audio is copied once and peak memory is about
+    twice its size while the chunks are joined.
+
     Args:
         file: File-like object or file path (wav, mp3, etc.)
     Returns:
         np.ndarray: 1D float32 numpy array of audio samples, normalized to [-1, 1]
+    Raises:
+        AudioDecodeError: If ffmpeg is missing or cannot decode the input.
     """
-    audio = AudioSegment.from_file(file)
-    # Ensure mono and 16kHz
-    audio = audio.set_frame_rate(16000).set_channels(1)
-    # Convert to float32 numpy array, normalize to [-1, 1]
-    samples = np.array(audio.get_array_of_samples()).astype(np.float32) / (2**15)
-    return samples
+    chunks = list(iter_audio_chunks(file))
+    if len(chunks) == 1:
+        return chunks[0]
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
 
 def decode_audio_base64(b64str: str) -> np.ndarray:
     """
@@ -54,17 +173,45 @@ def decode_audio_ndarray(b64str: str) -> np.ndarray:
     arr = np.frombuffer(arr_bytes, dtype=np.float32)
     return arr
 
-def decode_audio_url(url: str) -> Optional[np.ndarray]:
+PCM_DTYPES = {"float32": np.float32, "int16": np.int16}
+
+def resample_audio(arr: np.ndarray, sample_rate: int, target_rate: int = 16000) -> np.ndarray:
+    """
+    Resample a mono float32 array with linear interpolation (no-op if rates match).
+
+    Args:
+        arr (np.ndarray): 1D float32 numpy array of audio samples
+        sample_rate (int): Sample rate of `arr`
+        target_rate (int): Desired sample rate
+    Returns:
+        np.ndarray: 1D float32 numpy array at `target_rate`
     """
-    Download and decode an audio file from a URL to a mono, 16kHz, float32 numpy array.
+    if sample_rate == target_rate or len(arr) == 0:
+        return arr
+    n = int(round(len(arr) * target_rate / sample_rate))
+    positions = np.arange(n, dtype=np.float64) * (sample_rate / target_rate)
+    return np.interp(positions, np.arange(len(arr)), arr).astype(np.float32)
+
+def decode_pcm_bytes(data: bytes, dtype: str = "float32", sample_rate: int = 16000) -> np.ndarray:
+    """
+    Decode raw little-endian mono PCM bytes (float32 or int16) to a 16kHz float32 numpy array.
+    float32 data at 16kHz is returned as a view of `data` (no copy).
 
     Args:
-        url (str): URL to the audio file
+        data (bytes): Raw PCM bytes (any bytes-like object, e.g. a bytearray)
+        dtype (str): 'float32' or 'int16'
+        sample_rate (int): Sample rate of the PCM data
     Returns:
-        Optional[np.ndarray]: 1D float32 numpy array of audio samples, or None if download fails
+        np.ndarray: 1D float32 numpy array of audio samples
+    Raises:
+        ValueError: If dtype is unsupported or the byte length is not a multiple of the sample size
     """
-    import requests
-    resp = requests.get(url)
-    if resp.status_code == 200:
-        return decode_audio_file(io.BytesIO(resp.content))
-    return None 
\ No newline at end of file
+    if dtype not in PCM_DTYPES:
+        raise ValueError(f"Unsupported PCM dtype: {dtype}")
+    arr = np.frombuffer(data, dtype=np.dtype(PCM_DTYPES[dtype]).newbyteorder("<"))
+    if dtype == "int16":
+        # 转换与缩放一次完成，只分配一个 float32 数组
+        arr = np.multiply(arr, 1 / 2**15, dtype=np.float32)
+    elif arr.dtype != np.float32:
+        arr = arr.astype(np.float32)
+    return resample_audio(arr, sample_rate)
@@ -1,6 +1,7 @@
 """
-This module provides utility functions for splitting audio numpy arrays into chunks and encoding them to base64 strings.
-It is useful for streaming audio processing and WebSocket transmission.
+This module provides utility functions for splitting audio numpy arrays into chunks and encoding them to base64 strings,
+raw PCM bytes or compressed (FLAC/Opus) payloads.
+It is useful for streaming audio processing, WebSocket transmission and compact HTTP uploads.
 
 Author: whisper_docker_api_2 contributors
 Date: 2024-06-xx
@@ -8,8 +9,16 @@ Date: 2024-06-xx
 
 import numpy as np
 import base64
+import shutil
+import subprocess
 from typing import List
 
+# 压缩编码: (ffmpeg 输出参数, 请求体 Content-Type)
+CODECS = {
+    "flac": (["-c:a", "flac", "-f", "flac"], "audio/flac"),
+    "opus": (["-c:a", "libopus", "-b:a", "32k", "-f", "ogg"], "audio/ogg"),
+}
+
 def split_audio(audio: np.ndarray, chunk_size: int) -> List[np.ndarray]:
     """
     Split a numpy array of audio samples into fixed-size chunks.
@@ -45,4 +54,54 @@ def audio_to_base64(audio: np.ndarray) -> str:
         >>> send_over_ws(b64)
     """
     # Ensure float32 type and encode to base64 string
-    return base64.b64encode(audio.astype(np.float32).tobytes()).decode('utf-8') 
\ No newline at end of file
+    return base64.b64encode(audio.astype(np.float32).tobytes()).decode('utf-8') 
+
+def audio_to_pcm_bytes(audio: np.ndarray, dtype: str = "int16") -> bytes:
+    """
+    Encode a numpy array of audio samples to raw little-endian PCM bytes for binary WebSocket frames.
+
+    Args:
+        audio (np.ndarray): Audio samples as a 1D float32 numpy array in [-1, 1].
+        dtype (str): 'int16' (half the size) or 'float32' (lossless).
+
+    Returns:
+        bytes: Raw PCM bytes.
+
+    Example:
+        >>> await ws.send(audio_to_pcm_bytes(chunk))
+    """
+    if dtype == "int16":
+        return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    if dtype == "float32":
+        return audio.astype("<f4", copy=False).tobytes()
+    raise ValueError(f"Unsupported PCM dtype: {dtype}")
+
+def audio_to_encoded_bytes(audio: np.ndarray, codec: str = "flac", sample_rate: int = 16000) -> bytes:
+    """
+    Compress a numpy array of audio samples with ffmpeg for upload as a raw request body.
+
+    Args:
+        audio (np.ndarray): Audio samples as a 1D float32 numpy array in [-1, 1].
+        codec (str): 'flac' (lossless, about half the size of int16 PCM) or 'opus' (lossy, 32 kbit/s in Ogg).
+        sample_rate (int): Sample rate of `audio`.
+
+    Returns:
+        bytes: Encoded audio; send it with the Content-Type from `CODECS[codec][1]`.
+
+    Raises:
+        ValueError: If the codec is unsupported.
+        RuntimeError: If ffmpeg is missing or fails.
+
+    Example:
+        >>> body = audio_to_encoded_bytes(audio, "opus")
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unsupported codec: {codec}")
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg is not installed.")
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "f32le", "-ar", str(sample_rate), "-ac", "1",
+           "-i", "pipe:0"] + CODECS[codec][0] + ["pipe:1"]
+    proc = subprocess.run(cmd, input=audio.astype("<f4", copy=False).tobytes(), capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Failed to encode audio: {proc.stderr.decode('utf-8', 'replace').strip()}")
+    return proc.stdout
@@ -0,0 +1,172 @@
+"""
+This module provides a content-addressed cache for transcription results.
+Results are keyed on a fast hash of the decoded PCM plus model and decode options, kept in an in-process
+LRU tier and, optionally, in an on-disk tier with a size cap. Both tiers expire entries after a TTL.
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.utils.metrics import Counter
+
+CACHE_REQUESTS = Counter(
+    "whisper_result_cache_requests_total", "Result cache lookups by tier and outcome", ["tier", "result"],
+)
+
+
+def cache_key(audio: np.ndarray, model: str, options: Dict[str, Any]) -> str:
+    """
+    Build a cache key from the decoded audio samples, the model name and the decode options.
+
+    Args:
+        audio (np.ndarray): 1D float32 audio, 16kHz.
+        model (str): Model name.
+        options (Dict[str, Any]): Everything else that affects the result (language, VAD, ...).
+    Returns:
+        str: Hex digest.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    # 直接对内存视图做哈希，避免复制音频
+    h.update(memoryview(np.ascontiguousarray(audio, dtype=np.float32)).cast("B"))
+    h.update(model.encode("utf-8"))
+    h.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier (memory LRU + optional disk) cache of JSON-serializable transcription results.
+
+    Args:
+        max_entries (int): Maximum number of results kept in memory.
+        ttl_seconds (float): Time-to-live for entries in both tiers.
+        disk_dir (Optional[str]): Directory for the on-disk tier; disabled if None.
+        disk_max_mb (float): Size cap of the on-disk tier; oldest files are removed first.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400, disk_dir: Optional[str] = None,
+                 disk_max_mb: float = 1024):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl_seconds)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(e.stat().st_size for e in os.scandir(disk_dir) if e.name.endswith(".json"))
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> Optional["ResultCache"]:
+        config = config or {}
+        if not config.get("enabled", False):
+            return None
+        return cls(
+            max_entries=config.get("max_entries", 1024),
+            ttl_seconds=config.get("ttl_seconds", 86400),
+            disk_dir=config.get("disk_dir"),
+            disk_max_mb=config.get("disk_max_mb", 1024),
+        )
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.hits["memory"] += 1
+                    CACHE_REQUESTS.inc(tier="memory", result="hit")
+                    return entry[1]
+                del self._memory[key]
+        if self.disk_dir:
+            path = self._path(key)
+            try:
+                if os.path.getmtime(path) + self.ttl > now:
+                    with open(path, "r", encoding="utf-8") as f:
+                        value = json.load(f)
+                    self._put_memory(key, value, os.path.getmtime(path) + self.ttl)
+                    with self._lock:
+                        self.hits["disk"] += 1
+                    CACHE_REQUESTS.inc(tier="disk", result="hit")
+                    return value
+                os.remove(path)
+            except (OSError, ValueError):
+                pass
+        with self._lock:
+            self.misses += 1
+        CACHE_REQUESTS.inc(tier="all", result="miss")
+        return None
+
+    def _put_memory(self, key: str, value: Dict[str, Any], expires: float):
+        with self._lock:
+            self._memory[key] = (expires, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key: str, value: Dict[str, Any]):
+        self._put_memory(key, value, time.time() + self.ttl)
+        if self.disk_dir:
+            # 先写临时文件再原子替换，避免读到半写入的结果
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+                size = os.path.getsize(tmp)
+                os.replace(tmp, self._path(key))
+            except OSError:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return
+            with self._lock:
+                self._disk_bytes += size
+                over = self._disk_bytes > self.disk_max_bytes
+            if over:
+                self._enforce_disk_cap()
+
+    def _enforce_disk_cap(self):
+        # 只在超出上限时扫描目录，按修改时间从旧到新删除
+        entries = []
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".json"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+            }
@@ -0,0 +1,249 @@
+"""
+This module downloads audio from URLs asynchronously and decodes it while the download is still in progress
+(the same streaming decode is used for raw audio request bodies).
+A shared connection-pooled HTTP client enforces connect/read timeouts and a maximum download size, and
+concurrent requests for the same URL are coalesced into a single download.
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import asyncio
+import tempfile
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from app.utils.audio import READ_BLOCK, decode_audio_file
+from app.utils.metrics import Counter
+
+URL_FETCHES = Counter(
+    "whisper_url_fetch_total", "audio_url fetches by outcome (downloaded, deduplicated, error)", ["result"],
+)
+
+
+class AudioFetchError(Exception):
+    """Raised when an audio URL cannot be downloaded; `status_code` is the HTTP status to return."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _StreamReader:
+    """
+    Blocking file-like object fed by the async download and read by the ffmpeg feeder thread.
+
+    Everything read is also kept in a spooled temporary file, so the reader can be rewound; this lets
+    `decode_audio_file` fall back to a seekable copy for containers (mp4/m4a) that cannot be piped.
+    """
+
+    def __init__(self, max_buffered: int = 16 * READ_BLOCK):
+        self.max_buffered = max_buffered
+        self._chunks: Deque[bytes] = deque()
+        self._buffered = 0
+        self._eof = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._spool = tempfile.SpooledTemporaryFile(max_size=8 << 20)
+        self._pos = 0
+
+    # ---- 下载端（事件循环线程） ----
+    def feed(self, chunk: bytes) -> bool:
+        with self._cond:
+            if self._closed:
+                return False
+            self._chunks.append(chunk)
+            self._buffered += len(chunk)
+            self._cond.notify_all()
+            return True
+
+    def full(self) -> bool:
+        return self._buffered >= self.max_buffered and not self._closed
+
+    def wait_writable(self):
+        # 缓冲区满时在线程池中等待解码端消费，形成背压
+        with self._cond:
+            self._cond.wait_for(lambda: self._buffered < self.max_buffered or self._closed)
+
+    def finish(self):
+        with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+
+    def abort(self):
+        # 解码端已退出: 唤醒等待中的下载端，后续写入直接丢弃
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def close(self):
+        self.abort()
+        self._spool.close()
+
+    # ---- 解码端（ffmpeg 写入线程） ----
+    def read(self, size: int = -1) -> bytes:
+        size = READ_BLOCK if size is None or size < 0 else size
+        self._spool.seek(0, 2)
+        spooled = self._spool.tell()
+        if self._pos < spooled:
+            # 回退后先读已缓存的部分
+            self._spool.seek(self._pos)
+            data = self._spool.read(min(size, spooled - self._pos))
+            self._pos += len(data)
+            return data
+        with self._cond:
+            self._cond.wait_for(lambda: self._chunks or self._eof or self._closed)
+            if self._closed or not self._chunks:
+                return b""
+            data = self._chunks.popleft()
+            self._buffered -= len(data)
+            self._cond.notify_all()
+        self._spool.seek(0, 2)
+        self._spool.write(data)
+        self._pos += len(data)
+        return data
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        if whence != 0:
+            raise ValueError("Only absolute seeks are supported.")
+        self._spool.seek(0, 2)
+        self._pos = min(pos, self._spool.tell())
+        return self._pos
+
+
+async def decode_stream(chunks: AsyncIterator[bytes]) -> np.ndarray:
+    """
+    Decode an async stream of encoded audio bytes (a download, a raw request body) to a mono, 16kHz, float32
+    numpy array while it is still being received: ffmpeg reads in the thread pool while this coroutine feeds it.
+
+    Raises:
+        AudioDecodeError: If the content cannot be decoded.
+        Exception: Whatever `chunks` raises (e.g. AudioFetchError).
+    """
+    reader = _StreamReader()
+    decoding = asyncio.ensure_future(run_in_threadpool(decode_audio_file, reader))
+    decoding.add_done_callback(lambda _: reader.abort())
+    try:
+        try:
+            async for chunk in chunks:
+                if decoding.done() or not reader.feed(chunk):
+                    # 解码端已提前结束（通常是格式错误），不必继续接收
+                    break
+                if reader.full():
+                    await run_in_threadpool(reader.wait_writable)
+        except BaseException:
+            # 接收失败: 通知解码端结束并等待其退出，再把错误抛给调用方
+            reader.finish()
+            await asyncio.gather(decoding, return_exceptions=True)
+            raise
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        reader.finish()
+        return await decoding
+    finally:
+        reader.close()
+
+
+class AudioFetcher:
+    """
+    Async audio URL downloader with a shared connection pool and per-URL request coalescing.
+
+    Args:
+        max_bytes (Optional[int]): Maximum download size; larger responses are rejected with 413.
+        connect_timeout (float): Seconds to establish a connection.
+        read_timeout (float): Maximum seconds between received bytes.
+        max_connections (int): Size of the shared connection pool.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 max_connections: int = 20):
+        self.max_bytes = max_bytes
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "AudioFetcher":
+        fetch = config.get("url_fetch") or {}
+        max_mb = config.get("max_upload_size_mb")
+        return cls(
+            max_bytes=int(max_mb * 1024 * 1024) if max_mb else None,
+            connect_timeout=fetch.get("connect_timeout", 5.0),
+            read_timeout=fetch.get("read_timeout", 30.0),
+            max_connections=fetch.get("max_connections", 20),
+        )
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # 延迟创建，保证客户端绑定到服务运行的事件循环
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, follow_redirects=True)
+        return self._client
+
+    async def fetch(self, url: str) -> np.ndarray:
+        """
+        Download and decode an audio URL to a mono, 16kHz, float32 numpy array.
+
+        Concurrent calls for the same URL share one download; cancelling one caller does not cancel it.
+
+        Raises:
+            AudioFetchError: If the URL is invalid, unreachable, too large or returns an error status.
+            AudioDecodeError: If the downloaded content cannot be decoded.
+        """
+        if urlparse(url).scheme not in ("http", "https"):
+            raise AudioFetchError("audio_url must be an http(s) URL.")
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._download(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda t: self._inflight.pop(url, None) if self._inflight.get(url) is t else None)
+        else:
+            URL_FETCHES.inc(result="deduplicated")
+        return await asyncio.shield(task)
+
+    async def _download(self, url: str) -> np.ndarray:
+        try:
+            arr = await decode_stream(self._iter_download(url))
+        except Exception:
+            URL_FETCHES.inc(result="error")
+            raise
+        URL_FETCHES.inc(result="downloaded")
+        return arr
+
+    async def _iter_download(self, url: str) -> AsyncIterator[bytes]:
+        try:
+            async with self._get_client().stream("GET", url) as resp:
+                if resp.status_code != 200:
+                    raise AudioFetchError(f"Failed to download audio_url: HTTP {resp.status_code}.")
+                length = resp.headers.get("content-length")
+                if self.max_bytes and length and length.isdigit() and int(length) > self.max_bytes:
+                    raise AudioFetchError("audio_url exceeds the maximum upload size.", status_code=413)
+                received = 0
+                async for chunk in resp.aiter_bytes(READ_BLOCK):
+                    received += len(chunk)
+                    if self.max_bytes and received > self.max_bytes:
+                        raise AudioFetchError("audio_url exceeds the maximum upload size.", status_code=413)
+                    yield chunk
+        except httpx.TimeoutException:
+            raise AudioFetchError("Timed out downloading audio_url.", status_code=504)
+        except httpx.HTTPError as e:
+            raise AudioFetchError(f"Failed to download audio_url: {e}")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,188 @@
+"""
+This module provides minimal in-process metrics (labelled counters, gauges and histograms) for tuning and monitoring the service.
+All metrics register themselves in a module-level registry that the /metrics endpoint reports in the Prometheus
+text exposition format (or as JSON).
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import bisect
+import math
+import threading
+from typing import Any, Dict, List, Sequence, Tuple
+
+REGISTRY: List[Any] = []
+
+
+class Counter:
+    """
+    A monotonically increasing counter with optional labels.
+
+    Example:
+        >>> c = Counter('cache_requests_total', 'Cache lookups', ['result'])
+        >>> c.inc(result='hit')
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Dict]:
+        with self._lock:
+            items = list(self._values.items())
+        return [{"labels": dict(zip(self.labelnames, key)), "value": value} for key, value in items]
+
+
+class Gauge:
+    """
+    A value that can go up and down, with optional labels.
+
+    Example:
+        >>> g = Gauge('websocket_sessions', 'Open WebSocket sessions')
+        >>> g.inc(); g.dec()
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def set(self, value: float, **labels: str):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Dict]:
+        with self._lock:
+            items = list(self._values.items())
+        return [{"labels": dict(zip(self.labelnames, key)), "value": value} for key, value in items]
+
+
+class Histogram:
+    """
+    A cumulative histogram with fixed bucket upper bounds and optional labels.
+
+    Args:
+        name (str): Metric name (e.g., 'batch_size').
+        documentation (str): Short human-readable description.
+        buckets (Sequence[float]): Sorted bucket upper bounds; +Inf is implicit.
+        labelnames (Sequence[str]): Names of the labels passed to `observe`.
+
+    Example:
+        >>> h = Histogram('batch_size', 'Requests per batch', [1, 2, 4, 8], ['model'])
+        >>> h.observe(3, model='base')
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = sorted(float(b) for b in buckets)
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        # 每个标签组合存储: 各桶计数(含 +Inf) + 总和 + 总数
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0.0] * (len(self.buckets) + 3)
+            values[idx] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def samples(self) -> List[Dict]:
+        """
+        Return one entry per label combination with cumulative bucket counts, sum and count.
+        """
+        out = []
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, values in items:
+            cumulative, running = {}, 0.0
+            for bound, n in zip(self.buckets + [float("inf")], values[:-2]):
+                running += n
+                cumulative["+Inf" if bound == float("inf") else repr(bound)] = int(running)
+            out.append({
+                "labels": dict(zip(self.labelnames, key)),
+                "buckets": cumulative,
+                "sum": values[-2],
+                "count": int(values[-1]),
+            })
+        return out
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render_prometheus() -> str:
+    """
+    Return all registered metrics in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines: List[str] = []
+    for m in REGISTRY:
+        lines.append(f"# HELP {m.name} {m.documentation}")
+        lines.append(f"# TYPE {m.name} {m.type}")
+        for sample in m.samples():
+            labels = sample["labels"]
+            if m.type == "histogram":
+                for bound, count in sample["buckets"].items():
+                    lines.append(f"{m.name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{m.name}_sum{_format_labels(labels)} {_format_value(sample['sum'])}")
+                lines.append(f"{m.name}_count{_format_labels(labels)} {sample['count']}")
+            else:
+                lines.append(f"{m.name}{_format_labels(labels)} {_format_value(sample['value'])}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> Dict[str, Dict]:
+    """
+    Return all registered metrics as a JSON-serializable dict.
+    """
+    return {
+        m.name: {"help": m.documentation, "type": m.type, "samples": m.samples()}
+        for m in REGISTRY
+    }
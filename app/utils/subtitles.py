@@ -0,0 +1,107 @@
+"""
+This module renders transcription segments as subtitle and timing formats (SRT, WebVTT, TSV and word-level JSON).
+Writers are incremental: `header()`, then `segments()` for each batch of segments as they become available,
+then `footer()`, so responses can be streamed while the rest of the audio is still being transcribed.
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+SUBTITLE_FORMATS = ("srt", "vtt", "tsv", "words")
+
+MEDIA_TYPES = {
+    "srt": "application/x-subrip; charset=utf-8",
+    "vtt": "text/vtt; charset=utf-8",
+    "tsv": "text/tab-separated-values; charset=utf-8",
+    "words": "application/json",
+}
+
+
+def format_timestamp(seconds: float, decimal_marker: str = ".") -> str:
+    """
+    Format seconds as HH:MM:SS.mmm (SRT uses ',' as the decimal marker).
+
+    Example:
+        >>> format_timestamp(3725.5, ",")
+        '01:02:05,500'
+    """
+    milliseconds = max(0, int(round(seconds * 1000)))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    secs, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{decimal_marker}{milliseconds:03d}"
+
+
+def _cue_text(segment: Dict[str, Any]) -> str:
+    # "-->" 会被播放器误认为时间轴
+    return segment["text"].strip().replace("-->", "->")
+
+
+class SubtitleWriter:
+    """
+    Incremental writer for one response in one of SUBTITLE_FORMATS.
+
+    Args:
+        fmt (str): 'srt', 'vtt', 'tsv' or 'words'.
+        model (Optional[str]): Model name, included in the word-level JSON output.
+    """
+
+    def __init__(self, fmt: str, model: Optional[str] = None):
+        if fmt not in SUBTITLE_FORMATS:
+            raise ValueError(f"Unsupported subtitle format: {fmt}")
+        self.fmt = fmt
+        self.model = model
+        self.media_type = MEDIA_TYPES[fmt]
+        self._cues = 0
+        self._words = 0
+
+    def header(self) -> str:
+        if self.fmt == "vtt":
+            return "WEBVTT\n\n"
+        if self.fmt == "tsv":
+            return "start\tend\ttext\n"
+        if self.fmt == "words":
+            return '{"model": %s, "words": [' % json.dumps(self.model)
+        return ""
+
+    def segments(self, segments: List[Dict[str, Any]]) -> str:
+        """
+        Render a batch of segments (timestamps in seconds); segments with empty text are skipped.
+        """
+        parts = []
+        for seg in segments:
+            if self.fmt == "words":
+                for w in seg.get("words") or []:
+                    word = {"word": w["word"], "start": w["start"], "end": w["end"],
+                            "probability": round(w.get("probability", 0.0), 4), "segment": seg.get("id")}
+                    parts.append(("" if self._words == 0 else ", ") + json.dumps(word, ensure_ascii=False))
+                    self._words += 1
+                continue
+            text = _cue_text(seg)
+            if not text:
+                continue
+            self._cues += 1
+            if self.fmt == "srt":
+                parts.append(f"{self._cues}\n{format_timestamp(seg['start'], ',')} --> "
+                             f"{format_timestamp(seg['end'], ',')}\n{text}\n\n")
+            elif self.fmt == "vtt":
+                parts.append(f"{format_timestamp(seg['start'])} --> {format_timestamp(seg['end'])}\n{text}\n\n")
+            else:
+                # 与 whisper 的 tsv 输出一致：毫秒整数，文本中的制表符替换为空格
+                parts.append(f"{int(round(seg['start'] * 1000))}\t{int(round(seg['end'] * 1000))}\t"
+                             f"{text.replace(chr(9), ' ')}\n")
+        return "".join(parts)
+
+    def footer(self, language: Optional[str] = None) -> str:
+        if self.fmt == "words":
+            return '], "language": %s}' % json.dumps(language)
+        return ""
+
+    def render(self, result: Dict[str, Any]) -> str:
+        """
+        Render a complete transcribe result in one go.
+        """
+        return self.header() + self.segments(result.get("segments", [])) + self.footer(result.get("language"))
@@ -0,0 +1,162 @@
+"""
+This module records per-request, per-stage latency (decode, queue, mel, encoder, decoder, inference, serialization).
+The timing of the current request is carried in a context variable, so stages measured deep inside the
+inference thread (via hooks on the whisper encoder/decoder) are attributed to the right request.
+Every finished request is exported as Prometheus histograms and can be rendered as a `Server-Timing` header.
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import contextlib
+import contextvars
+import importlib
+import threading
+import time
+from typing import Dict, Optional
+
+from app.utils.metrics import Counter, Histogram
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+STAGE_SECONDS = Histogram(
+    "whisper_stage_seconds", "Time spent per request in each processing stage",
+    LATENCY_BUCKETS, ["stage", "model", "input"],
+)
+REQUEST_SECONDS = Histogram(
+    "whisper_request_seconds", "End-to-end request processing time",
+    LATENCY_BUCKETS, ["model", "input"],
+)
+REAL_TIME_FACTOR = Histogram(
+    "whisper_real_time_factor", "Processing time divided by audio duration, per request",
+    [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0], ["model", "input"],
+)
+AUDIO_SECONDS = Counter("whisper_audio_seconds_total", "Seconds of audio processed", ["model", "input"])
+PROCESSING_SECONDS = Counter(
+    "whisper_processing_seconds_total", "Seconds spent processing requests (divide by audio seconds for RTF)",
+    ["model", "input"],
+)
+
+_current: "contextvars.ContextVar[Optional[RequestTiming]]" = contextvars.ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    """
+    Accumulates stage durations for one request (or one stream step / one batch).
+
+    Args:
+        model (str): Model label.
+        input (str): Input type label (file, url, base64, ndarray, stream, batch, ...).
+    """
+
+    def __init__(self, model: str, input: str):
+        self.model = model
+        self.input = input
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def activate(self) -> contextvars.Token:
+        """Make this the current timing for the calling context (and threads started from it)."""
+        return _current.set(self)
+
+    def finish(self, audio_seconds: Optional[float] = None):
+        """
+        Export the stage durations, total time and (if the audio duration is known) real-time factor.
+        """
+        total = time.perf_counter() - self.started
+        labels = {"model": self.model, "input": self.input}
+        with self._lock:
+            stages = dict(self.stages)
+        for stage, seconds in stages.items():
+            STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+        REQUEST_SECONDS.observe(total, **labels)
+        if audio_seconds:
+            REAL_TIME_FACTOR.observe(total / audio_seconds, **labels)
+            AUDIO_SECONDS.inc(audio_seconds, **labels)
+            PROCESSING_SECONDS.inc(total, **labels)
+
+    def server_timing(self) -> str:
+        """
+        Render the stages as a `Server-Timing` header value (durations in milliseconds).
+        """
+        with self._lock:
+            stages = dict(self.stages)
+        stages["total"] = time.perf_counter() - self.started
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items())
+
+
+def current_timing() -> Optional[RequestTiming]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def timed_stage(name: str):
+    """
+    Time a block into the current request's timing; a no-op if no request is being timed.
+    """
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    with timing.stage(name):
+        yield
+
+
+# ---- whisper 模型内部的阶段计时 ----
+_hook_state = threading.local()
+_patched_mel = False
+
+
+def _pre_hook(stage: str):
+    def hook(module, args):
+        if _current.get() is not None:
+            setattr(_hook_state, stage, time.perf_counter())
+    return hook
+
+
+def _post_hook(stage: str):
+    def hook(module, args, output):
+        timing = _current.get()
+        start = getattr(_hook_state, stage, None)
+        if timing is not None and start is not None:
+            timing.add(stage, time.perf_counter() - start)
+            setattr(_hook_state, stage, None)
+    return hook
+
+
+def instrument_model(model):
+    """
+    Attach timing hooks to a whisper PyTorch model's encoder and decoder, and time log-mel extraction
+    inside `whisper.transcribe` (which then goes through app.models.features, so precomputed features are
+    used). Models of other backends are left untouched.
+    """
+    global _patched_mel
+    for stage in ("encoder", "decoder"):
+        module = getattr(model, stage, None)
+        if module is not None and hasattr(module, "register_forward_hook"):
+            module.register_forward_pre_hook(_pre_hook(stage))
+            module.register_forward_hook(_post_hook(stage))
+    if not _patched_mel:
+        # whisper.transcribe 这个名字被同名函数覆盖，需要通过 importlib 取模块本身
+        transcribe_module = importlib.import_module("whisper.transcribe")
+        from app.models.features import log_mel_spectrogram
+
+        def timed_log_mel_spectrogram(*args, **kwargs):
+            with timed_stage("mel"):
+                return log_mel_spectrogram(*args, **kwargs)
+
+        transcribe_module.log_mel_spectrogram = timed_log_mel_spectrogram
+        _patched_mel = True
@@ -0,0 +1,149 @@
+"""
+This module provides a lightweight, vectorized energy/spectral voice activity detector (VAD).
+It finds speech regions in 16kHz float32 audio, compacts the audio to those regions before inference,
+and maps transcription timestamps back to the original timeline.
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import numpy as np
+from typing import Any, Dict, List, Tuple
+
+SAMPLE_RATE = 16000
+
+DEFAULT_VAD_OPTIONS: Dict[str, float] = {
+    "threshold_db": -45.0,      # 帧能量阈值 (dBFS)，低于此值视为静音
+    "max_flatness": 0.5,        # 频谱平坦度上限，高于此值视为噪声
+    "frame_ms": 30.0,
+    "min_speech_ms": 120.0,     # 短于此长度的语音段丢弃
+    "min_silence_ms": 500.0,    # 短于此长度的静音间隔合并
+    "speech_pad_ms": 200.0,     # 语音段前后各保留的余量
+}
+
+# (original_start_s, original_end_s, compact_start_s)
+Region = Tuple[float, float, float]
+
+
+def vad_options(**overrides) -> Dict[str, float]:
+    """
+    Merge non-None overrides into the default VAD options.
+
+    Returns:
+        Dict[str, float]: Complete VAD option dict.
+    """
+    options = dict(DEFAULT_VAD_OPTIONS)
+    options.update({k: float(v) for k, v in overrides.items() if v is not None and k in DEFAULT_VAD_OPTIONS})
+    return options
+
+
+def speech_frames(audio: np.ndarray, threshold_db: float, max_flatness: float, frame_ms: float) -> np.ndarray:
+    """
+    Classify fixed-size frames as speech/non-speech by energy and spectral flatness.
+
+    Args:
+        audio (np.ndarray): 1D float32 audio, 16kHz.
+        threshold_db (float): Minimum frame RMS energy in dBFS for speech.
+        max_flatness (float): Maximum spectral flatness (0=tonal, 1=white noise) for speech.
+        frame_ms (float): Frame length in milliseconds.
+    Returns:
+        np.ndarray: Boolean array, one entry per frame.
+    """
+    frame = int(SAMPLE_RATE * frame_ms / 1000)
+    n = len(audio) // frame
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    frames = audio[:n * frame].reshape(n, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    power = np.abs(np.fft.rfft(frames * np.hanning(frame).astype(np.float32), axis=1)) ** 2 + 1e-10
+    flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+    return (energy_db > threshold_db) & (flatness < max_flatness)
+
+
+def detect_speech(audio: np.ndarray, **options) -> List[Tuple[int, int]]:
+    """
+    Detect speech regions in audio.
+
+    Args:
+        audio (np.ndarray): 1D float32 audio, 16kHz.
+        **options: Overrides for DEFAULT_VAD_OPTIONS.
+    Returns:
+        List[Tuple[int, int]]: Sorted, non-overlapping (start_sample, end_sample) speech regions.
+    """
+    opts = vad_options(**options)
+    frame = int(SAMPLE_RATE * opts["frame_ms"] / 1000)
+    flags = speech_frames(audio, opts["threshold_db"], opts["max_flatness"], opts["frame_ms"])
+    if not flags.any():
+        return []
+    # 语音段的起止帧
+    edges = np.diff(np.concatenate([[0], flags.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    # 合并间隔过短的语音段
+    min_gap = opts["min_silence_ms"] / opts["frame_ms"]
+    keep = np.concatenate([[True], (starts[1:] - ends[:-1]) >= min_gap])
+    starts = starts[keep]
+    ends = ends[np.concatenate([keep[1:], [True]])]
+    # 丢弃过短的语音段
+    long_enough = (ends - starts) * opts["frame_ms"] >= opts["min_speech_ms"]
+    starts, ends = starts[long_enough], ends[long_enough]
+    pad = int(SAMPLE_RATE * opts["speech_pad_ms"] / 1000)
+    regions: List[Tuple[int, int]] = []
+    for s, e in zip(starts * frame - pad, ends * frame + pad):
+        s, e = max(0, int(s)), min(len(audio), int(e))
+        if regions and s <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], e)
+        else:
+            regions.append((s, e))
+    return regions
+
+
+def has_speech(audio: np.ndarray, **options) -> bool:
+    return bool(detect_speech(audio, **options))
+
+
+def apply_vad(audio: np.ndarray, **options) -> Tuple[np.ndarray, List[Region]]:
+    """
+    Remove non-speech audio, keeping a mapping back to the original timeline.
+
+    Args:
+        audio (np.ndarray): 1D float32 audio, 16kHz.
+        **options: Overrides for DEFAULT_VAD_OPTIONS.
+    Returns:
+        Tuple[np.ndarray, List[Region]]: Compacted speech-only audio (may be empty) and its regions.
+    """
+    regions = detect_speech(audio, **options)
+    if not regions:
+        return audio[:0], []
+    mapping: List[Region] = []
+    offset = 0
+    for s, e in regions:
+        mapping.append((s / SAMPLE_RATE, e / SAMPLE_RATE, offset / SAMPLE_RATE))
+        offset += e - s
+    compact = np.concatenate([audio[s:e] for s, e in regions])
+    return compact, mapping
+
+
+def remap_time(t: float, regions: List[Region]) -> float:
+    """
+    Map a timestamp on the compacted timeline back to the original timeline.
+    """
+    if not regions:
+        return t
+    compact_starts = [r[2] for r in regions]
+    i = max(0, int(np.searchsorted(compact_starts, t, side="right")) - 1)
+    start, end, compact_start = regions[i]
+    return round(min(start + (t - compact_start), end), 3)
+
+
+def remap_timestamps(result: Dict[str, Any], regions: List[Region]) -> Dict[str, Any]:
+    """
+    Rewrite segment (and word) timestamps of a transcribe result in place to the original timeline.
+    """
+    for seg in result.get("segments", []):
+        seg["start"] = remap_time(seg["start"], regions)
+        seg["end"] = remap_time(seg["end"], regions)
+        for w in seg.get("words", []) or []:
+            w["start"] = remap_time(w["start"], regions)
+            w["end"] = remap_time(w["end"], regions)
+    return result
@@ -0,0 +1,368 @@
+"""
+Load and benchmark harness for the HTTP (`POST /transcribe`) and WebSocket (`/transcribe/stream`) endpoints.
+
+By default the app is started in-process (uvicorn on a free local port) with a benchmark config derived from
+config.yaml: only the benchmarked model, result cache and jobs disabled. Use `--stub` to replace the whisper
+model by a deterministic stub whose cost is proportional to the audio duration (no weights needed), or `--url`
+to benchmark an already running server instead.
+
+Each scenario drives a fixed number of requests / streaming sessions at a configurable concurrency using
+`sample/sample.wav`, and the script prints one machine-readable JSON report with throughput, p50/p95/p99
+latency, real-time factor (processing time / audio duration), peak RSS and the server-side stage breakdown
+from `/metrics?format=json`. Pass `--baseline old.json` to compare against a previous report: the script exits
+with status 1 if p95 latency or throughput regressed by more than `--tolerance`.
+
+Usage:
+    python tests/benchmark_api.py --stub --concurrency 8 --requests 64 --ws-sessions 4
+    python tests/benchmark_api.py --model tiny --output bench.json
+    python tests/benchmark_api.py --url http://localhost:8000 --model base --baseline bench.json
+
+Dependencies: httpx, websockets, numpy, uvicorn (in-process mode), openai-whisper
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import wave
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+import websockets
+import yaml
+
+AUDIO_PATH = "sample/sample.wav"  # Path to your local audio file
+MODEL = "tiny"  # Model name to benchmark
+LANGUAGE = "en"
+SAMPLE_RATE = 16000
+
+
+# ---- 被测服务 ----
+
+def install_stub(seconds_per_audio_second: float):
+    """
+    Replace `whisper.load_model` by a stub model that sleeps in proportion to the audio duration
+    and returns a fixed text, so the serving path can be benchmarked without model weights.
+    """
+    import torch
+    import whisper
+
+    class StubModel(torch.nn.Module):
+        def transcribe(self, arr, **options):
+            duration = len(arr) / SAMPLE_RATE
+            time.sleep(duration * seconds_per_audio_second)
+            words = [{"word": " stub", "start": i * 0.5, "end": i * 0.5 + 0.4, "probability": 1.0}
+                     for i in range(int(duration / 0.5))]
+            text = "".join(w["word"] for w in words)
+            return {"text": text, "language": options.get("language") or LANGUAGE,
+                    "segments": [{"id": 0, "start": 0.0, "end": duration, "text": text, "words": words}]}
+
+    whisper.load_model = lambda name, device="cpu", **kwargs: StubModel()
+
+
+def write_bench_config(config_path: str, model: str, stub: bool) -> str:
+    """
+    Derive the in-process benchmark config: only `model`, result cache and jobs disabled.
+    """
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+    entry = next((m for m in config.get("models", []) if m["name"] == model), {"name": model, "device": "cpu"})
+    entry = dict(entry, preload=True)
+    if stub:
+        # 桩模型不支持批量解码，且没有可量化的权重
+        entry.pop("backend", None)
+        entry.pop("batching", None)
+        config.pop("batching", None)
+    config["models"] = [entry]
+    config["cache"] = {"enabled": False}
+    config["jobs"] = {"enabled": False}
+    fd, path = tempfile.mkstemp(prefix="whisper_bench_", suffix=".yaml")
+    with os.fdopen(fd, "w") as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def start_server(config_path: str):
+    """
+    Start the app with uvicorn in a background thread on a free port; returns (base_url, server).
+    """
+    import uvicorn
+    os.environ["CONFIG_PATH"] = config_path
+    from app.main import app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+# ---- 统计 ----
+
+def peak_rss_mb() -> float:
+    import resource
+    # Linux 上 ru_maxrss 的单位是 KB；进程池子进程计入 RUSAGE_CHILDREN
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round((self_rss + children_rss) / 1024, 1)
+
+
+def latency_summary(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    arr = np.asarray(values)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4),
+            "mean": round(float(arr.mean()), 4), "max": round(float(arr.max()), 4)}
+
+
+def stage_breakdown(before: Dict, after: Dict, model: str) -> Dict[str, Dict[str, float]]:
+    """
+    Mean server-side seconds per stage and input type between two `/metrics?format=json` snapshots.
+    """
+    def totals(snap):
+        out = {}
+        for s in snap.get("whisper_stage_seconds", {}).get("samples", []):
+            if s["labels"].get("model") == model:
+                out[(s["labels"]["input"], s["labels"]["stage"])] = (s["sum"], s["count"])
+        return out
+
+    old, new = totals(before), totals(after)
+    breakdown: Dict[str, Dict[str, float]] = {}
+    for (input_type, stage), (total, count) in sorted(new.items()):
+        old_total, old_count = old.get((input_type, stage), (0.0, 0))
+        if count > old_count:
+            breakdown.setdefault(input_type, {})[stage] = round((total - old_total) / (count - old_count), 4)
+    return breakdown
+
+
+# ---- 负载场景 ----
+
+def to_wav_bytes(audio: np.ndarray, salt: int) -> bytes:
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+    # 每个请求改动一个采样点，避免命中服务端结果缓存
+    pcm[-1] = salt % 32767
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+async def bench_http(base_url: str, model: str, audio: np.ndarray, requests: int, concurrency: int,
+                     timeout: float) -> Dict:
+    duration = len(audio) / SAMPLE_RATE
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def one(i: int):
+            body = to_wav_bytes(audio, i)
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    r = await client.post("/transcribe", data={"model": model, "language": LANGUAGE},
+                                          files={"audio_file": ("bench.wav", body, "audio/wav")})
+                    status = str(r.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                elapsed = time.perf_counter() - start
+            if status == "200":
+                latencies.append(elapsed)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "errors": errors,
+        "audio_seconds_per_request": round(duration, 2),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3),
+        "audio_seconds_per_second": round(len(latencies) * duration / wall, 3),
+        "latency_seconds": latency_summary(latencies),
+        "rtf": latency_summary([t / duration for t in latencies]),
+    }
+
+
+async def bench_stream(ws_url: str, model: str, audio: np.ndarray, sessions: int, concurrency: int,
+                       chunk_seconds: float, realtime: bool) -> Dict:
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+    chunks = [pcm[i:i + chunk].tobytes() for i in range(0, len(pcm), chunk)]
+    duration = len(audio) / SAMPLE_RATE
+    chunk_latencies: List[float] = []
+    session_rtf: List[float] = []
+    errors: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            try:
+                async with websockets.connect(ws_url, max_size=None) as ws:
+                    await ws.send(json.dumps({"model": model, "language": LANGUAGE, "dtype": "int16",
+                                              "sample_rate": SAMPLE_RATE}))
+                    ready = json.loads(await ws.recv())
+                    if "error" in ready:
+                        raise RuntimeError(ready["error"])
+                    busy = 0.0
+                    for data in chunks:
+                        sent = time.perf_counter()
+                        await ws.send(data)
+                        msg = json.loads(await ws.recv())
+                        elapsed = time.perf_counter() - sent
+                        if "error" in msg:
+                            raise RuntimeError(msg["error"])
+                        chunk_latencies.append(elapsed)
+                        busy += elapsed
+                        if realtime:
+                            # 按实时速率发送：补足分片时长
+                            await asyncio.sleep(max(0.0, chunk_seconds - elapsed))
+                    await ws.send(json.dumps({"event": "end"}))
+                    await ws.recv()
+                session_rtf.append(busy / duration)
+            except Exception as e:
+                key = type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(sessions)))
+    wall = time.perf_counter() - start
+    return {
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "ok": len(session_rtf),
+        "errors": errors,
+        "chunk_seconds": chunk_seconds,
+        "realtime": realtime,
+        "audio_seconds_per_session": round(duration, 2),
+        "wall_seconds": round(wall, 3),
+        "throughput_chunks_per_second": round(len(chunk_latencies) / wall, 3),
+        "audio_seconds_per_second": round(len(session_rtf) * duration / wall, 3),
+        "chunk_latency_seconds": latency_summary(chunk_latencies),
+        "rtf": latency_summary(session_rtf),
+    }
+
+
+# ---- 回归比较 ----
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Return the regressions of `report` against `baseline` (p95 latency up or throughput down by more than tolerance).
+    """
+    checks = [
+        ("http", "latency_seconds", "p95", "throughput_rps"),
+        ("stream", "chunk_latency_seconds", "p95", "audio_seconds_per_second"),
+    ]
+    regressions = []
+    for scenario, latency_key, pct, throughput_key in checks:
+        new, old = report.get(scenario), baseline.get(scenario)
+        if not new or not old:
+            continue
+        new_p, old_p = new[latency_key][pct], old[latency_key][pct]
+        if new_p is not None and old_p and new_p > old_p * (1 + tolerance):
+            regressions.append(f"{scenario} {pct} latency {old_p:.4f}s -> {new_p:.4f}s")
+        new_t, old_t = new[throughput_key], old[throughput_key]
+        if old_t and new_t < old_t * (1 - tolerance):
+            regressions.append(f"{scenario} {throughput_key} {old_t} -> {new_t}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="Benchmark a running server instead of starting the app in-process")
+    parser.add_argument("--config", default="config/config.yaml", help="Base config for the in-process server")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--stub", action="store_true", help="Use a stub model instead of whisper weights")
+    parser.add_argument("--stub-rtf", type=float, default=0.05, help="Stub cost in seconds per audio second")
+    parser.add_argument("--audio", default=AUDIO_PATH)
+    parser.add_argument("--requests", type=int, default=32, help="HTTP requests (0 to skip)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--ws-sessions", type=int, default=4, help="WebSocket sessions (0 to skip)")
+    parser.add_argument("--ws-concurrency", type=int, default=None, help="Default: --concurrency")
+    parser.add_argument("--chunk-seconds", type=float, default=1.0)
+    parser.add_argument("--realtime", action="store_true", help="Pace WebSocket chunks at real-time speed")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="Previous JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    server = None
+    bench_config = None
+    base_url = args.url
+    if base_url is None:
+        if args.stub:
+            install_stub(args.stub_rtf)
+        bench_config = write_bench_config(args.config, args.model, args.stub)
+        base_url, server = start_server(bench_config)
+    base_url = base_url.rstrip("/")
+    ws_url = "ws" + base_url[len("http"):] + "/transcribe/stream"
+
+    from app.utils.audio import decode_audio_file
+    audio = decode_audio_file(args.audio)
+
+    report = {
+        "model": args.model,
+        "mode": "remote" if args.url else ("in-process-stub" if args.stub else "in-process"),
+        "audio": args.audio,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    try:
+        before = httpx.get(base_url + "/metrics", params={"format": "json"}, timeout=args.timeout).json()
+        if args.requests > 0:
+            report["http"] = asyncio.run(bench_http(
+                base_url, args.model, audio, args.requests, args.concurrency, args.timeout))
+        if args.ws_sessions > 0:
+            report["stream"] = asyncio.run(bench_stream(
+                ws_url, args.model, audio, args.ws_sessions, args.ws_concurrency or args.concurrency,
+                args.chunk_seconds, args.realtime))
+        after = httpx.get(base_url + "/metrics", params={"format": "json"}, timeout=args.timeout).json()
+        report["server_stage_seconds"] = stage_breakdown(before, after, args.model)
+        # 远程模式下只能得到客户端进程的内存
+        report["peak_rss_mb"] = None if args.url else peak_rss_mb()
+    finally:
+        if server is not None:
+            server.should_exit = True
+        if bench_config is not None:
+            os.remove(bench_config)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        status = 1 if regressions else 0
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
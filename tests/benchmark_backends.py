@@ -0,0 +1,78 @@
+"""
+Benchmark script comparing the inference backends selectable per model in config.yaml.
+
+For each backend, the model is loaded in a fresh process and used to transcribe the sample file a few times.
+The script prints one JSON object per backend with load time, weight memory, peak RSS and real-time factor
+(processing time / audio duration, lower is better).
+
+Usage:
+    python tests/benchmark_backends.py [model] [backend ...]
+    python tests/benchmark_backends.py base pytorch pytorch-int8 ctranslate2
+
+Dependencies: openai-whisper, numpy (faster-whisper for the ctranslate2 backend)
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import json
+import multiprocessing
+import sys
+import time
+
+AUDIO_PATH = "sample/sample.wav"  # Path to your local audio file
+MODEL = "base"  # Model name to benchmark
+BACKENDS = ["pytorch", "pytorch-int8"]
+RUNS = 3  # Timed runs per backend (after one warm-up run)
+
+def peak_rss_mb() -> float:
+    import resource
+    # Linux 上 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def bench(model_name: str, backend: str) -> dict:
+    """
+    Load one backend and measure it; runs in its own process so memory numbers are not shared.
+    """
+    from app.models.backends import load_backend
+    from app.models.manager import model_memory_bytes
+    from app.utils.audio import decode_audio_file
+
+    audio = decode_audio_file(AUDIO_PATH)
+    duration = len(audio) / 16000
+    rss_before = peak_rss_mb()
+    start = time.time()
+    model = load_backend(model_name, backend)
+    load_seconds = time.time() - start
+    options = {"language": "en", "temperature": 0.0}
+    model.transcribe(audio, **options)  # warm-up
+    times = []
+    for _ in range(RUNS):
+        start = time.time()
+        result = model.transcribe(audio, **options)
+        times.append(time.time() - start)
+    best = min(times)
+    return {
+        "model": model_name,
+        "backend": backend,
+        "audio_seconds": round(duration, 2),
+        "load_seconds": round(load_seconds, 2),
+        "weights_mb": round(model_memory_bytes(model) / 2**20, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "load_rss_mb": round(peak_rss_mb() - rss_before, 1),
+        "rtf": round(best / duration, 4),
+        "rtf_mean": round(sum(times) / len(times) / duration, 4),
+        "text": result["text"][:80],
+    }
+
+if __name__ == "__main__":
+    model_name = sys.argv[1] if len(sys.argv) > 1 else MODEL
+    backends = sys.argv[2:] or BACKENDS
+    ctx = multiprocessing.get_context("spawn")
+    for backend in backends:
+        with ctx.Pool(1) as pool:
+            try:
+                report = pool.apply(bench, (model_name, backend))
+            except Exception as e:
+                report = {"model": model_name, "backend": backend, "error": str(e)}
+        print(json.dumps(report, ensure_ascii=False))
@@ -0,0 +1,46 @@
+"""
+This test script verifies the pooled async client utility.
+It submits several audio inputs concurrently with transcribe_many and streams one with the pipelined client.
+
+Dependencies: numpy, httpx, websockets, app.utils.api_client, app.utils.audio
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import asyncio
+import time
+
+from app.utils.audio import decode_audio_file
+from app.utils.api_client import WhisperClient
+
+AUDIO_PATH = 'sample/sample.wav'
+MODEL = 'base'  # or 'small', etc.
+LANGUAGE = 'en'
+BATCH_SIZE = 8
+CONCURRENCY = 4
+
+
+async def test_batch():
+    """Test WhisperClient.transcribe_many (file paths and numpy arrays) and the pipelined stream."""
+    audio = decode_audio_file(AUDIO_PATH)
+    async with WhisperClient(max_connections=CONCURRENCY) as client:
+        print(f"\n--- Testing transcribe_many ({BATCH_SIZE} inputs, concurrency {CONCURRENCY}) ---")
+        inputs = [AUDIO_PATH if i % 2 else audio for i in range(BATCH_SIZE)]
+        started = time.perf_counter()
+        results = await client.transcribe_many(inputs, concurrency=CONCURRENCY, model=MODEL, language=LANGUAGE)
+        print(f"{len(results)} results in {time.perf_counter() - started:.2f}s")
+        for resp in results:
+            print(resp)
+
+        print("\n--- Testing WhisperClient.stream (pipelined) ---")
+        text_list = []
+        async for resp in client.stream(audio, model=MODEL, language=LANGUAGE, chunk_seconds=1):
+            print(resp)
+            if resp.get('is_final') and resp.get('text'):
+                text_list.append(resp['text'])
+        print("\nConcatenated text from all is_final results:")
+        print(''.join(text_list))
+
+if __name__ == '__main__':
+    asyncio.run(test_batch())
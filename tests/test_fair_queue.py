@@ -0,0 +1,51 @@
+"""
+Test script for the start-time fair queue used by admission control.
+
+Fills one model's slot and waiting list, then checks that an acquire rejected with QueueFullError
+does not advance the client's finish tag, so its next admitted request keeps its place in the queue.
+
+Dependencies: app.utils.admission, app.models.executor
+
+Author: whisper_docker_api_2 contributors
+Date: 2024-06-xx
+"""
+
+import asyncio
+
+from app.models.executor import QueueFullError
+from app.utils.admission import FairQueue
+
+
+async def check_rejected_acquire():
+    """A rejected acquire must leave the client's next start tag unchanged."""
+    queue = FairQueue("base", concurrency=1, max_waiting=1)
+    await queue.acquire("a", 10.0)  # 占用唯一的槽位
+    waiter = asyncio.ensure_future(queue.acquire("b", 5.0))  # 占满等待队列
+    await asyncio.sleep(0)
+    assert queue.waiting == 1
+
+    before = queue._finish.get("c", 0.0)
+    try:
+        await queue.acquire("c", 30.0)
+    except QueueFullError:
+        pass
+    else:
+        raise AssertionError("acquire should be rejected when the waiting list is full")
+    assert queue._finish.get("c", 0.0) == before, "rejected acquire charged the client's finish tag"
+    print("Rejected acquire left the finish tag unchanged")
+
+    queue.release()  # 槽位交给 b
+    await waiter
+    queue.release()
+    await queue.acquire("c", 1.0)
+    assert queue._finish["c"] == queue.vtime + 1.0
+    queue.release()
+    print("Next acquire of the rejected client starts at the current virtual time")
+
+
+def test_rejected_acquire():
+    asyncio.run(check_rejected_acquire())
+
+
+if __name__ == '__main__':
+    test_rejected_acquire()